@@ -0,0 +1,368 @@
+import geopandas as gpd
+import pandas as pd
+import numpy as np
+from shapely import voronoi_polygons, multipoints, points, box, get_parts, intersection, STRtree
+import copy
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import models
+from models import python_directory
+
+### Benchmarks of the models on synthetic inputs
+## Default location of the results
+benchmarks_directory = os.path.join(python_directory, "data", "benchmarks")
+## Sizes of the synthetic inputs (schools, LSOAs, catchments)
+benchmark_sizes = {
+    "small": (10, 100, 3),
+    "city": (10, 200, 4),
+    "county": (100, 5000, 20),
+    "region": (1000, 20000, 150),
+    "national": (5000, 50000, 700),
+}
+
+## Polygons covering a square (Voronoi cells of the points), in the order of the points
+def voronoi_cells(points_xy, extent):
+    cells = get_parts(voronoi_polygons(multipoints(points_xy), extend_to=box(0, 0, extent, extent)))
+    cells = intersection(cells, box(0, 0, extent, extent))
+    # the cells are not returned in the order of the points
+    tree = STRtree(cells)
+    i_points, i_cells = tree.query(points(points_xy), predicate="within")
+    ordered = np.empty(len(points_xy), dtype=object)
+    ordered[i_points] = cells[i_cells]
+    return ordered
+
+def synthetic_inputs(n_schools=10, n_lsoas=200, n_catchments=4, seed=0, pan_scale=1.1, lsoa_size=800, crs=27700):
+    """
+    A function that generates synthetic inputs of the models: LSOAs as Voronoi cells of a jittered grid,
+    catchments as Voronoi cells of random points, schools as random points and PANs shared proportionally to random weights.
+
+    Parameters
+    ----------
+    `n_schools`: int (default=10)
+        Number of schools
+    `n_lsoas`: int (default=200)
+        Number of LSOAs (rounded to a square grid)
+    `n_catchments`: int (default=4)
+        Number of catchments
+    `seed`: int (default=0)
+        Seed of the random number generator
+    `pan_scale`: float (default=1.1)
+        Ratio of the sum of the PANs to the number of students
+    `lsoa_size`: float (default=800)
+        Average width of the LSOAs (m)
+    `crs`: int (default=27700)
+        EPSG code of the coordinates
+
+    Returns
+    -------
+    Dictionary including:
+        - "catchment", "schools", "students": GeoPandas DataFrames (before `models.reset_parameters`),
+        - "target_PAN": dict, schools names as index and PAN as value,
+        - "PANs": Pandas DataFrame, PANs in the format of the LSOA-driven models (column "pan2024")
+    """
+    rng = np.random.default_rng(seed)
+    grid = max(int(round(np.sqrt(n_lsoas))), 2)
+    extent = grid * lsoa_size
+    ## LSOAs
+    centres = (np.stack(np.meshgrid(np.arange(grid), np.arange(grid)), axis=-1).reshape(-1, 2) + 0.5) * lsoa_size
+    centres += rng.uniform(-0.3, 0.3, centres.shape) * lsoa_size
+    students = gpd.GeoDataFrame(
+        {"LSOA21CD": [f"L{i:06d}" for i in range(len(centres))], "5_9_total": rng.integers(20, 200, len(centres))},
+        geometry=voronoi_cells(centres, extent), crs=crs,
+    )
+    ## catchments
+    catchment_seeds = rng.uniform(0, extent, (max(n_catchments, 2), 2))
+    catchment = gpd.GeoDataFrame(
+        {"name": [f"Catchment {i}" for i in range(len(catchment_seeds))]},
+        geometry=voronoi_cells(catchment_seeds, extent), crs=crs,
+    )
+    ## schools
+    school_strs = [f"School {i}" for i in range(n_schools)]
+    schools = gpd.GeoDataFrame(
+        {"establishment_name": school_strs},
+        geometry=points(rng.uniform(0.02 * extent, 0.98 * extent, (n_schools, 2))), crs=crs,
+    )
+    ## PANs
+    total = np.floor(students["5_9_total"] * 0.19288).sum()
+    weights = rng.gamma(4.0, size=n_schools)
+    PAN_values = np.floor(weights / weights.sum() * total * pan_scale).astype(int)
+    target_PAN = dict(zip(school_strs, PAN_values.tolist()))
+    PANs = pd.DataFrame({"school": school_strs, "pan2024": PAN_values})
+    return {
+        "catchment": catchment,
+        "schools": schools,
+        "students": students,
+        "target_PAN": target_PAN,
+        "PANs": PANs,
+    }
+
+## Cases of the benchmark: name, and a function running it on prepared inputs
+benchmark_models = {
+    "Optimise_PANs_Schools": lambda inputs: models.Optimise_PANs_Schools(inputs["schools"], inputs["students"], inputs["target_PAN"], initial_school="School 0"),
+    "Optimise_PANs_LSOAs": lambda inputs: models.Optimise_PANs_LSOAs(inputs["schools"], inputs["students"], inputs["PANs"]),
+    "Optimise_PANsCatchment_Schools": lambda inputs: models.Optimise_PANsCatchment_Schools(inputs["schools"], inputs["students"], inputs["target_PAN"], initial_school="School 0"),
+    "Optimise_PANsCatchment_LSOAs": lambda inputs: models.Optimise_PANsCatchment_LSOAs(inputs["schools"], inputs["students"], inputs["PANs"]),
+    "Optimise_PANs_Flow": lambda inputs: models.Optimise_PANs_Flow(inputs["schools"], inputs["students"], inputs["target_PAN"]),
+    "Random_PANsCatchment_schools": lambda inputs: models.Random_PANsCatchment_schools(inputs["schools"], inputs["students"], inputs["target_PAN"], n_runs=20, seed=0, batch_size=20),
+}
+
+## Time (s) of a function, and its peak memory (MB, allocations traced by Python, including NumPy arrays) if `trace_memory`
+# tracing the allocations slows the function down, so the times of the traced runs are not reported
+def measure(function, *args, trace_memory=False):
+    if trace_memory: tracemalloc.start()
+    start = time.perf_counter()
+    function(*args)
+    seconds = time.perf_counter() - start
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    return seconds, peak
+
+## Budget of the time to import the models (s), and the modules that should not be loaded by the import
+import_time_budget = 0.5
+deferred_modules = ("pandas", "geopandas", "matplotlib", "tqdm")
+
+## Time (s) to import a module in a new Python process (fastest of `repeat`), and the deferred modules it loaded
+def measure_import_time(module="models", repeat=5):
+    code = (
+        "import sys, time; start = time.perf_counter(); "
+        f"import {module}; print(time.perf_counter() - start); "
+        f"print(','.join(name for name in {deferred_modules!r} if name in sys.modules))"
+    )
+    seconds, loaded = [], []
+    for k in range(repeat):
+        lines = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                               cwd=os.path.dirname(os.path.abspath(__file__))).stdout.splitlines()
+        seconds.append(float(lines[0]))
+        loaded = [name for name in lines[1].split(",") if name] if len(lines) > 1 else []
+    return seconds, loaded
+
+## Commit of the repository the benchmarks run on (None if not available)
+def current_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(sizes=("small", "city"), model_names=None, repeat=3, seed=0, output=None):
+    """
+    A function that times the import of the models (against `import_time_budget`), 
+    the preparation of the inputs (`models.reset_parameters`) and each model on synthetic inputs,
+    and writes the results to a JSON file (to compare the results of different commits, see `compare_benchmarks`).
+
+    Parameters
+    ----------
+    `sizes`: tuple of str or tuple (default=("small", "city"))
+        Names of the sizes in `benchmark_sizes`, or tuples (schools, LSOAs, catchments).
+        "flow" times the solver of `Optimise_PANs_Flow` at national scale against `flow_time_budget` (see `flow_benchmark`)
+    `model_names`: list of str (default=None)
+        Names of the models in `benchmark_models`. All the models if not provided
+    `repeat`: int (default=3)
+        Number of times each case is timed (on a fresh copy of the inputs), followed by a run measuring the peak memory
+    `seed`: int (default=0)
+        Seed of the synthetic inputs
+    `output`: str (default=None)
+        Path of the results file. "data/benchmarks/{commit}.json" if not provided, not written if False
+
+    Returns
+    -------
+    Pandas DataFrame with a row for each case: "size", "n_schools", "n_lsoas", "case",
+    "seconds" (fastest of the repeats), "seconds_mean", "peak_memory_mb" and "error" (if the case failed, 
+    or if the import is over the budget or loads any of the `deferred_modules`)
+    """
+    if model_names is None: model_names = list(benchmark_models)
+    ## import of the models
+    seconds, loaded = measure_import_time("models", max(repeat, 3))
+    errors = []
+    if min(seconds) > import_time_budget: errors.append(f"over the import time budget ({import_time_budget} s)")
+    if loaded: errors.append(f"loads {', '.join(loaded)}")
+    rows = [{
+        "size": "import",
+        "n_schools": None,
+        "n_lsoas": None,
+        "case": "import models",
+        "seconds": min(seconds),
+        "seconds_mean": float(np.mean(seconds)),
+        "peak_memory_mb": None,
+        "error": "; ".join(errors) or None,
+    }]
+    for size in sizes:
+        if size == "flow":
+            ## solver of the transportation problem at national scale
+            outcome = flow_benchmark(repeat=repeat)
+            rows.append({
+                "size": "flow",
+                "n_schools": outcome["n_schools"],
+                "n_lsoas": outcome["n_lsoas"],
+                "case": "min_cost_assignment",
+                "seconds": outcome["seconds"],
+                "seconds_mean": outcome["seconds_mean"],
+                "peak_memory_mb": None,
+                "error": outcome["error"],
+            })
+            continue
+        size_name, (n_schools, n_lsoas, n_catchments) = (size, benchmark_sizes[size]) if isinstance(size, str) else (str(size), size)
+        inputs = synthetic_inputs(n_schools, n_lsoas, n_catchments, seed=seed)
+        ## preparation of the inputs
+        timings = {"reset_parameters": ([], None)}
+        for k in range(repeat + 1):
+            catchment, schools, students = copy.deepcopy((inputs["catchment"], inputs["schools"], inputs["students"]))
+            timings["reset_parameters"][0].append(measure(models.reset_parameters, catchment, schools, students, trace_memory=k == repeat))
+        inputs["schools"], inputs["students"] = schools, students
+        ## models (each run on a fresh copy of the prepared inputs)
+        for model_name in model_names:
+            runs, error = [], None
+            for k in range(repeat + 1):
+                inputs_copy = dict(inputs, schools=inputs["schools"].copy(), students=inputs["students"].copy())
+                try:
+                    runs.append(measure(benchmark_models[model_name], inputs_copy, trace_memory=k == repeat))
+                except Exception as exception:
+                    error = f"{type(exception).__name__}: {exception}"
+                    break
+            timings[model_name] = (runs, error)
+        for case, (runs, error) in timings.items():
+            seconds = [run[0] for run in runs if run[1] is None]
+            peaks = [run[1] for run in runs if run[1] is not None]
+            rows.append({
+                "size": size_name,
+                "n_schools": n_schools,
+                "n_lsoas": len(inputs["students"]),
+                "case": case,
+                "seconds": min(seconds) if seconds else None,
+                "seconds_mean": float(np.mean(seconds)) if seconds else None,
+                "peak_memory_mb": peaks[0] if peaks else None,
+                "error": error,
+            })
+    results = pd.DataFrame(rows)
+
+    ## results file
+    if output is not False:
+        commit = current_commit()
+        if output is None:
+            output = os.path.join(benchmarks_directory, f"{commit or 'results'}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, "w") as file:
+            json.dump({
+                "commit": commit,
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "pandas": pd.__version__,
+                "geopandas": gpd.__version__,
+                "machine": platform.machine(),
+                "repeat": repeat,
+                "seed": seed,
+                "cases": results.replace({np.nan: None}).to_dict(orient="records"),
+            }, file, indent=1)
+    return results
+
+def compare_benchmarks(baseline_path, current_path):
+    """
+    A function that compares two results files of `run_benchmarks`.
+
+    Parameters
+    ----------
+    `baseline_path`: str
+        Results file of the reference (e.g. the previous commit)
+    `current_path`: str
+        Results file to compare with the reference
+
+    Returns
+    -------
+    Pandas DataFrame with a row for each case in both files, including the times and peak memory of both,
+    and their ratios ("seconds_ratio", "memory_ratio", above 1 if slower or larger than the reference)
+    """
+    frames = []
+    for path in (baseline_path, current_path):
+        with open(path) as file:
+            frames.append(pd.DataFrame(json.load(file)["cases"]).set_index(["size", "case"])[["seconds", "peak_memory_mb"]])
+    comparison = frames[0].join(frames[1], how="inner", lsuffix="_baseline", rsuffix="_current")
+    comparison["seconds_ratio"] = comparison["seconds_current"] / comparison["seconds_baseline"]
+    comparison["memory_ratio"] = comparison["peak_memory_mb_current"] / comparison["peak_memory_mb_baseline"]
+    return comparison
+
+## Size of the transportation problem of `Optimise_PANs_Flow` at national scale (schools, LSOAs)
+flow_benchmark_size = (3000, 30000)
+## Budget of the time to solve it (s)
+flow_time_budget = 15
+
+## Transportation problem on random points: distances between the schools and the LSOAs (m), students of each LSOA and PANs as in `synthetic_inputs`
+# without geometries, and with the distances calculated in place (the national distance matrix alone is 720 MB)
+def synthetic_flow_instance(n_schools, n_lsoas, seed=0, pan_scale=1.1, lsoa_size=800):
+    rng = np.random.default_rng(seed)
+    extent = np.sqrt(n_lsoas) * lsoa_size
+    schools_xy, lsoas_xy = rng.uniform(0, extent, (n_schools, 2)), rng.uniform(0, extent, (n_lsoas, 2))
+    dist_matrix = np.subtract.outer(schools_xy[:, 0], lsoas_xy[:, 0])
+    dist_matrix **= 2
+    dy = np.subtract.outer(schools_xy[:, 1], lsoas_xy[:, 1])
+    dy **= 2
+    dist_matrix += dy
+    del dy
+    np.sqrt(dist_matrix, out=dist_matrix)
+    students = np.floor(rng.integers(20, 200, n_lsoas) * 0.19288).astype(np.int64)
+    weights = rng.gamma(4.0, size=n_schools)
+    PANs = np.floor(weights / weights.sum() * students.sum() * pan_scale).astype(np.int64)
+    return dist_matrix, students, PANs
+
+def flow_benchmark(n_schools=None, n_lsoas=None, seed=0, n_candidates=8, repeat=1):
+    """
+    A function that times the solver of `Optimise_PANs_Flow` (`models.min_cost_assignment`) on a synthetic transportation problem,
+    by default at national scale (`flow_benchmark_size`).
+
+    Parameters
+    ----------
+    `n_schools`: int (default=None)
+        Number of schools. The first of `flow_benchmark_size` if not provided
+    `n_lsoas`: int (default=None)
+        Number of LSOAs. The second of `flow_benchmark_size` if not provided
+    `seed`: int (default=0)
+        Seed of the synthetic problem
+    `n_candidates`: int (default=8)
+        Number of cheapest schools of each LSOA in the first arcs (see `models.min_cost_assignment`)
+    `repeat`: int (default=1)
+        Number of times the solver is timed
+
+    Returns
+    -------
+    Dictionary including:
+        - "n_schools", "n_lsoas": int, size of the problem,
+        - "seconds": float, fastest of the repeats, and "seconds_mean",
+        - "rounds": int, number of solves at the distances themselves, and "phases", number of shortest paths and maximum flows,
+        - "cost": float, total distance of the assignment (m),
+        - "overflow_students": int, students beyond the PANs,
+        - "error": str, if the fastest of the repeats is over `flow_time_budget` (None otherwise)
+    """
+    if n_schools is None: n_schools = flow_benchmark_size[0]
+    if n_lsoas is None: n_lsoas = flow_benchmark_size[1]
+    dist_matrix, students, PANs = synthetic_flow_instance(n_schools, n_lsoas, seed)
+    seconds = []
+    for k in range(repeat):
+        start = time.perf_counter()
+        outcome = models.min_cost_assignment(dist_matrix, students, PANs, n_candidates=n_candidates)
+        seconds.append(time.perf_counter() - start)
+    return {
+        "n_schools": n_schools,
+        "n_lsoas": n_lsoas,
+        "seconds": min(seconds),
+        "seconds_mean": float(np.mean(seconds)),
+        "rounds": outcome["rounds"],
+        "phases": outcome.get("phases"),
+        "cost": outcome["cost"],
+        "overflow_students": int(outcome["overflow"].sum()),
+        "error": f"over the flow time budget ({flow_time_budget} s)" if min(seconds) > flow_time_budget else None,
+    }
+
+if __name__ == "__main__":
+    ## python benchmarks.py [sizes ...], e.g. python benchmarks.py small city county flow
+    ## python benchmarks.py flow [schools LSOAs], the solver of `Optimise_PANs_Flow` (national scale by default)
+    if sys.argv[1:2] == ["flow"]:
+        print(flow_benchmark(*map(int, sys.argv[2:4])))
+    else:
+        results = run_benchmarks(sizes=tuple(sys.argv[1:]) or ("small", "city"))
+        print(results.to_string(index=False))
@@ -0,0 +1,132 @@
+import geopandas as gpd
+import pandas as pd
+import numpy as np
+import hashlib
+import os
+import shutil
+import tempfile
+from models import python_directory, reset_parameters, build_distance_matrix
+
+### On-disk cache of the prepared model inputs
+## Version of the cache layout (changing it invalidates all the cached inputs)
+CACHE_VERSION = 1
+## Default location of the cache
+cache_directory = os.path.join(python_directory, "data", "cache")
+
+## Fingerprint of the input files and the parameters used to prepare them
+def inputs_fingerprint(paths, age_factor, crs):
+    fingerprint = hashlib.sha256()
+    fingerprint.update(f"{CACHE_VERSION}|{age_factor!r}|{crs}".encode())
+    for path in paths:
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                fingerprint.update(block)
+        fingerprint.update(b"|")
+    return fingerprint.hexdigest()
+
+## Write a file through a temporary file, so an interrupted write never leaves an incomplete file (checkpoints, stores of results)
+def write_atomic(path, write):
+    file, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=os.path.splitext(path)[1])
+    try:
+        with os.fdopen(file, "wb") as temp_file:
+            write(temp_file)
+        os.replace(temp_path, path)
+    except BaseException:
+        ## an interrupted write leaves neither the temporary file nor an incomplete file at `path`
+        if os.path.exists(temp_path): os.remove(temp_path)
+        raise
+
+## Write and read a GeoDataFrame (GeoParquet if pyarrow is installed, otherwise pickle)
+def write_frame(frame, path):
+    try:
+        frame.to_parquet(f"{path}.parquet")
+    except ImportError:
+        frame.to_pickle(f"{path}.pkl")
+
+def read_frame(path):
+    if os.path.exists(f"{path}.parquet"):
+        return gpd.read_parquet(f"{path}.parquet")
+    return pd.read_pickle(f"{path}.pkl")
+
+def load_model_inputs(
+        schools_path,
+        students_path,
+        catchment_path,
+        age_factor=0.19288,
+        crs=27700,
+        cache_dir=cache_directory,
+        mmap_mode=None,
+        ):
+    """
+    A function that loads the schools, LSOAs and catchments, and prepares them for the models 
+    (`reset_parameters` and `build_distance_matrix`).
+    The prepared inputs are cached on disk, keyed by a hash of the input files, `age_factor` and `crs`,
+    so later calls with the same inputs skip reading the GeoJSON files and the polygon overlays.
+
+    Parameters
+    ----------
+    `schools_path`: str
+        File with the school locations as points (e.g. "brighton_sec_schools.geojson")
+    `students_path`: str
+        File with the LSOAs, including the number of 5 to 9 year olds "5_9_total" (e.g. "BrightonLSOA_Clean.geojson")
+    `catchment_path`: str
+        File with the catchments (e.g. "catchment_02.geojson")
+    `age_factor`: float (default=0.19288)
+        Share of the 5 to 9 year olds estimated to be 5 years old
+    `crs`: int (default=27700)
+        EPSG code of the projected CRS used to measure distances
+    `cache_dir`: str (default="data/cache")
+        Directory of the cache. The inputs are not cached if None
+    `mmap_mode`: str (default=None)
+        If provided (e.g. "r"), the cached distance matrix is memory-mapped rather than read (see `np.load`), 
+        so worker processes can share it without copies (see `shared.share_inputs`)
+
+    Returns
+    -------
+    Dictionary including:
+        - "catchment": GeoPandas DataFrame,
+        - "schools": GeoPandas DataFrame,
+        - "students": GeoPandas DataFrame,
+        - "dist_matrix": NumPy array
+    """
+    paths = [schools_path, students_path, catchment_path]
+    if cache_dir is not None:
+        entry = os.path.join(cache_dir, inputs_fingerprint(paths, age_factor, crs))
+        ## warm start, the inputs have been prepared before
+        if os.path.isdir(entry):
+            return {
+                "catchment": read_frame(os.path.join(entry, "catchment")),
+                "schools": read_frame(os.path.join(entry, "schools")),
+                "students": read_frame(os.path.join(entry, "students")),
+                "dist_matrix": np.load(os.path.join(entry, "dist_matrix.npy"), mmap_mode=mmap_mode),
+            }
+
+    ## load the maps and transform them to the projected CRS
+    schools = gpd.read_file(schools_path).to_crs(epsg=crs)
+    students = gpd.read_file(students_path).to_crs(epsg=crs)
+    catchment = gpd.read_file(catchment_path).to_crs(epsg=crs)
+    reset_parameters(catchment, schools, students, age_factor)
+    dist_matrix = build_distance_matrix(schools, students)
+
+    if cache_dir is not None:
+        ## write to a temporary directory first, so an interrupted write never leaves an incomplete entry
+        os.makedirs(cache_dir, exist_ok=True)
+        temp_dir = tempfile.mkdtemp(dir=cache_dir)
+        write_frame(catchment, os.path.join(temp_dir, "catchment"))
+        write_frame(schools, os.path.join(temp_dir, "schools"))
+        write_frame(students, os.path.join(temp_dir, "students"))
+        np.save(os.path.join(temp_dir, "dist_matrix.npy"), dist_matrix)
+        try:
+            os.rename(temp_dir, entry)
+        except OSError:
+            # another process cached the same inputs first
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        if mmap_mode is not None:
+            dist_matrix = np.load(os.path.join(entry, "dist_matrix.npy"), mmap_mode=mmap_mode)
+
+    return {
+        "catchment": catchment,
+        "schools": schools,
+        "students": students,
+        "dist_matrix": dist_matrix,
+    }
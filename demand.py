@@ -0,0 +1,121 @@
+import numpy as np
+from models import build_distance_matrix, catchment_matrix, order_schools, distance_queues, assign_from_queues, assign_from_queues_batch, assignment_state_batch, school_preferences, assign_schools_by_LSOA
+from metrics import assignment_KPIs, assigned_distances
+from ensemble import ensemble_accumulator, accumulate
+from sweep import shared_events
+
+### Ensembles of the models over the uncertainty of the demand (the number of 5 year olds of each LSOA)
+# `reset_parameters` estimates the 5 year olds as a fixed share of the 5 to 9 year olds,
+# here each realisation draws them around that share, and the models are run for each realisation over shared distances and queues
+## Metrics of the demand ensembles, for each school
+demand_metrics = ["students_total", "over_PAN", "under_PAN", "oversubscribed", "distance", "students_3_miles"]
+
+## Realisations of the 5 year olds of each LSOA, (draws x LSOAs) array of int
+# "binomial": each of the 5 to 9 year olds is 5 years old with probability `age_factor`, "poisson": Poisson counts with mean `age_factor` x 5 to 9 year olds
+def demand_draws(totals, age_factor, n_draws, rng, distribution="binomial"):
+    totals = np.asarray(totals, dtype=np.int64)
+    if distribution == "poisson":
+        return rng.poisson(totals * age_factor, size=(n_draws, len(totals)))
+    return rng.binomial(totals, age_factor, size=(n_draws, len(totals)))
+
+def Demand_ensemble(
+        schools,
+        students_lsoa,
+        target_PAN,
+        model="catchment_schools",
+        n_draws=1000,
+        distribution="binomial",
+        age_factor=0.19288,
+        seed=None,
+        dist_matrix=None,
+        initial_school="Dorothy Stringer School",
+        batch_size=100,
+        ):
+    """
+    A function that runs a model for many realisations of the demand, drawn around the estimate of the 5 year olds of each LSOA,
+    and returns the distributions of the students, the over- and under-subscription and the distances of each school.
+    The realisations are drawn and evaluated in batches of arrays. The distances, the order of the schools and the queues of the LSOAs
+    are shared by all the realisations, so each realisation only runs the assignment loop of the model.
+    The school-driven models start each realisation from the assignment of the estimated demand ("5_est" if available),
+    resuming it from the first PAN check with a different outcome (see `sweep.shared_events`), with the same outcome as solving it from scratch.
+    The realisations of a batch are resumed together, with a NumPy operation over the batch for each step of a school (see `models.assign_from_queues_batch`).
+    The `schools` and `students_lsoa` DataFrames are not modified.
+
+    Parameters
+    ----------
+    `schools`: GeoPandas DataFrame
+        School locations as points (including "catchment_ID" for the catchment models)
+    `students_lsoa`: GeoPandas DataFrame
+        LSOAs including the number of 5 to 9 year olds "5_9_total" (and "catchment_ID" for the catchment models)
+    `target_PAN`: dict
+        Schools names as index and PAN as value
+    `model`: str (default="catchment_schools")
+        Model run for each realisation: "schools" (`Optimise_PANs_Schools`), "catchment_schools" (`Optimise_PANsCatchment_Schools`),
+        "LSOAs" (`Optimise_PANs_LSOAs`) or "catchment_LSOAs" (`Optimise_PANsCatchment_LSOAs`)
+    `n_draws`: int (default=1000)
+        Number of realisations of the demand
+    `distribution`: str (default="binomial")
+        Distribution of the 5 year olds of each LSOA, "binomial" or "poisson" (see `demand_draws`)
+    `age_factor`: float (default=0.19288)
+        Share of the 5 to 9 year olds estimated to be 5 years old
+    `seed`: int (default=None)
+        Seed of the draws. Not reproducible if not provided (the draws also depend on `batch_size`)
+    `dist_matrix`: NumPy array (default=None)
+        Distances between the schools and the LSOAs (see `build_distance_matrix`). Calculated if not provided
+    `initial_school`: str (default="Dorothy Stringer School")
+        The initial school in the optimisation loop of the school-driven models
+    `batch_size`: int (default=100)
+        Number of realisations drawn and evaluated together, which bounds the memory used
+
+    Returns
+    -------
+    Dictionary with the statistics of the realisations for each school (see `ensemble.ensemble_accumulator` and `ensemble.ensemble_summary`),
+    for the metrics "students_total", "over_PAN", "under_PAN", "oversubscribed" (1 if over the PAN, so its mean is the probability),
+    "distance" (average in miles) and "students_3_miles"
+    """
+    ## inputs shared by all the realisations
+    if dist_matrix is None:
+        dist_matrix = build_distance_matrix(schools, students_lsoa)
+    school_strs = list(schools["establishment_name"])
+    target = np.array([target_PAN[school_str] for school_str in school_strs], dtype=np.int64)
+    catchments = model in ("catchment_schools", "catchment_LSOAs")
+    in_catchment = catchment_matrix(schools, students_lsoa) if catchments else None
+    if model in ("schools", "catchment_schools"):
+        rows = {school_str: i for i, school_str in enumerate(school_strs)}
+        order = [rows[school_str] for school_str in order_schools(schools, initial_school)]
+        queues, queue_all, queue_in = distance_queues(dist_matrix, in_catchment)
+        ## assignment of the estimated demand, the realisations resume it
+        if "5_est" in students_lsoa: base_est = students_lsoa["5_est"].to_numpy()
+        else: base_est = np.floor(students_lsoa["5_9_total"].to_numpy() * age_factor).astype(np.int64)
+        log = assign_from_queues(base_est, target, order, queues, queue_all, queue_in, skip_zero_PAN=catchments, log=True)["log"]
+        def assign_batch(est):
+            # all the realisations of the batch are resumed together (the ones that take the same steps as the estimated demand stop at once)
+            resume = assignment_state_batch(log, shared_events(log, target, target, catchments, est=est), est, len(target))
+            return assign_from_queues_batch(est, target, order, queues, queue_all, queue_in, skip_zero_PAN=catchments, resume=resume)
+    else:
+        preferences = school_preferences(dist_matrix)
+        def assign_batch(est):
+            outcomes = [assign_schools_by_LSOA(preferences, draw, target, in_catchment=in_catchment) for draw in est]
+            return {key: np.array([outcome[key] for outcome in outcomes]) for key in ["school", "students_total"]}
+    lsoa_catchment = students_lsoa["catchment_ID"].to_numpy() if "catchment_ID" in students_lsoa else None
+    school_catchment = schools["catchment_ID"].to_numpy() if "catchment_ID" in schools else None
+    totals = students_lsoa["5_9_total"].to_numpy()
+
+    ## draw and evaluate the realisations in batches
+    rng = np.random.default_rng(seed)
+    accumulator = ensemble_accumulator(school_strs, metric_names=demand_metrics)
+    for start in range(0, n_draws, batch_size):
+        est = demand_draws(totals, age_factor, min(batch_size, n_draws - start), rng, distribution)
+        outcomes = assign_batch(est)
+        school = outcomes["school"]
+        KPIs = assignment_KPIs(
+            school, est, assigned_distances(dist_matrix, school), target,
+            students_total=outcomes["students_total"],
+            lsoa_catchment=lsoa_catchment, school_catchment=school_catchment,
+        )
+        accumulate(
+            accumulator,
+            KPIs["students_total"], KPIs["over_PAN"], KPIs["under_PAN"], (KPIs["over_PAN"] > 0).astype(float),
+            KPIs["distance"], KPIs["students_3_miles"],
+        )
+    return accumulator
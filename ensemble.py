@@ -0,0 +1,141 @@
+import numpy as np
+from statistics import NormalDist
+
+### Streaming statistics of ensembles of runs (constant memory regardless of the number of runs)
+## metrics of the random model, in the order they are returned by the runs
+ensemble_metrics = ["distances", "distances_outside_catchment", "students_3_miles"]
+
+def ensemble_accumulator(school_strs, relative_accuracy=0.01, min_value=1e-3, max_value=1e6, metric_names=ensemble_metrics):
+    """
+    A function that creates an empty accumulator of the statistics of an ensemble, for each school and metric:
+    number of values, running mean and sum of squared differences (Welford),
+    and a quantile sketch (counts of values in logarithmic buckets, with a relative accuracy of `relative_accuracy`).
+
+    Parameters
+    ----------
+    `school_strs`: list of str
+        School names (in the order of the columns of the values accumulated)
+    `relative_accuracy`: float (default=0.01)
+        Relative accuracy of the quantiles
+    `min_value`: float (default=1e-3)
+        Values below `min_value` are counted as 0 by the quantile sketch
+    `max_value`: float (default=1e6)
+        Values above `max_value` are counted as `max_value` by the quantile sketch
+    `metric_names`: list of str (default=`ensemble_metrics`)
+        Metrics accumulated, in the order of the values of `accumulate`
+
+    Returns
+    -------
+    Dictionary including:
+        - "schools": list of str,
+        - "runs": int, number of runs accumulated,
+        - "metric_names": list of str,
+        - "gamma", "min_value": float, parameters of the quantile sketch,
+        - a dictionary for each metric with the arrays "n", "mean", "M2" and "sketch"
+    """
+    n_schools = len(school_strs)
+    gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+    # a bucket for the values below `min_value`, and the logarithmic buckets up to `max_value`
+    n_buckets = int(np.ceil(np.log(max_value / min_value) / np.log(gamma))) + 2
+    accumulator = {
+        "schools": list(school_strs),
+        "runs": 0,
+        "metric_names": list(metric_names),
+        "gamma": gamma,
+        "min_value": min_value,
+    }
+    for metric in metric_names:
+        accumulator[metric] = {
+            "n": np.zeros(n_schools, dtype=np.int64),
+            "mean": np.zeros(n_schools),
+            "M2": np.zeros(n_schools),
+            "sketch": np.zeros((n_schools, n_buckets), dtype=np.int64),
+        }
+    return accumulator
+
+## Add the values of a number of runs to the accumulator
+# each of the values is an array of (runs x schools), NaN values (e.g. schools without students) are skipped
+def accumulate(accumulator, *values):
+    gamma, min_value = accumulator["gamma"], accumulator["min_value"]
+    accumulator["runs"] += len(values[0])
+    for metric, metric_values in zip(accumulator["metric_names"], values):
+        metric_values = np.asarray(metric_values, dtype=float)
+        stats = accumulator[metric]
+        valid = ~np.isnan(metric_values)
+        ## mean and squared differences of the new runs, combined with the previous runs
+        n_new = valid.sum(axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean_new = np.where(valid, metric_values, 0).sum(axis=0) / n_new
+        M2_new = (np.where(valid, metric_values - mean_new, 0) ** 2).sum(axis=0)
+        n = stats["n"] + n_new
+        new = n_new > 0
+        delta = mean_new[new] - stats["mean"][new]
+        stats["M2"][new] += M2_new[new] + delta ** 2 * stats["n"][new] * n_new[new] / n[new]
+        stats["mean"][new] += delta * n_new[new] / n[new]
+        stats["n"] = n
+        ## quantile sketch
+        i_schools = np.nonzero(valid)[1]
+        sketch_values = metric_values[valid]
+        buckets = np.zeros(len(sketch_values), dtype=np.int64)
+        above = sketch_values >= min_value
+        buckets[above] = 1 + np.floor(np.log(sketch_values[above] / min_value) / np.log(gamma)).astype(np.int64)
+        np.add.at(stats["sketch"], (i_schools, np.minimum(buckets, stats["sketch"].shape[1] - 1)), 1)
+    return accumulator
+
+## Standard deviation of a metric for each school
+def ensemble_std(accumulator, metric="distances"):
+    stats = accumulator[metric]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.sqrt(stats["M2"] / (stats["n"] - 1))
+
+## Half width of the confidence interval of the mean of a metric for each school
+def ensemble_ci(accumulator, metric="distances", confidence=0.95):
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return z * ensemble_std(accumulator, metric) / np.sqrt(accumulator[metric]["n"])
+
+## Quantile of a metric for each school (estimated from the sketch)
+def ensemble_quantile(accumulator, q, metric="distances"):
+    gamma, min_value = accumulator["gamma"], accumulator["min_value"]
+    sketch = accumulator[metric]["sketch"]
+    counts = np.cumsum(sketch, axis=1)
+    rank = q * (counts[:, -1] - 1)
+    buckets = (counts <= rank[:, np.newaxis]).sum(axis=1)
+    ## the middle of the logarithmic bucket, 0 for the bucket of the values below `min_value`
+    values = np.where(buckets > 0, min_value * gamma ** (buckets - 1) * 2 * gamma / (gamma + 1), 0.0)
+    return np.where(counts[:, -1] > 0, values, np.nan)
+
+## Whether the confidence interval of the mean distance of each school is within the tolerance
+def ensemble_converged(accumulator, tolerance, confidence=0.95, min_runs=30, metric="distances"):
+    if accumulator["runs"] < min_runs: return False
+    has_values = accumulator[metric]["n"] > 0
+    return bool(np.all(ensemble_ci(accumulator, metric, confidence)[has_values] <= tolerance))
+
+def ensemble_summary(accumulator, quantiles=(0.05, 0.5, 0.95), confidence=0.95):
+    """
+    A function that summarises the statistics of an ensemble, for each school.
+
+    Parameters
+    ----------
+    `accumulator`: dict
+        Statistics of the ensemble (see `ensemble_accumulator`)
+    `quantiles`: tuple of float (default=(0.05, 0.5, 0.95))
+        Quantiles to report
+    `confidence`: float (default=0.95)
+        Confidence level of the confidence interval of the mean
+
+    Returns
+    -------
+    Pandas DataFrame with a row for each school,
+    and the columns "{metric}_mean", "{metric}_std", "{metric}_ci" and "{metric}_q{quantile}" for each metric
+    """
+    import pandas as pd
+    summary = pd.DataFrame(index=pd.Index(accumulator["schools"], name="school"))
+    summary["runs"] = accumulator["runs"]
+    for metric in accumulator["metric_names"]:
+        summary[f"{metric}_mean"] = np.where(accumulator[metric]["n"] > 0, accumulator[metric]["mean"], np.nan)
+        summary[f"{metric}_std"] = ensemble_std(accumulator, metric)
+        summary[f"{metric}_ci"] = ensemble_ci(accumulator, metric, confidence)
+        for q in quantiles:
+            summary[f"{metric}_q{round(q * 100):02d}"] = ensemble_quantile(accumulator, q, metric)
+    return summary
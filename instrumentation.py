@@ -0,0 +1,91 @@
+import time
+from contextlib import contextmanager
+
+### Opt-in instrumentation of the models: timers of the phases, counters and observers of the assignment steps (or of the tasks of random runs)
+# the models only call these functions between phases (never within the assignment loops),
+# and with `metrics=None` (instrumentation disabled) they return immediately
+## Counters of each kind of event of the assignment engines (see `models.assign_from_queues`)
+event_counters = {
+    0: ("assignments",),
+    1: ("assignments", "saturations"),
+    2: ("saturations",),
+    3: ("assignments", "external_assignments"),
+}
+
+## Empty metrics: wall-clock time (s) of each phase, and counters
+def new_metrics():
+    return {"timers": {}, "counters": {}}
+
+## Time a phase of a model (added to the previous time of the phase)
+@contextmanager
+def phase(metrics, name):
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics["timers"][name] = metrics["timers"].get(name, 0.0) + time.perf_counter() - start
+
+## Add to a counter
+def count(metrics, name, n=1):
+    if metrics is None: return
+    metrics["counters"][name] = metrics["counters"].get(name, 0) + int(n)
+
+def step_observer(metrics, observer=None):
+    """
+    A function that creates the observer passed to the assignment engines,
+    counting the events in `metrics` and forwarding them to `observer`.
+
+    Parameters
+    ----------
+    `metrics`: dict
+        Metrics of the run (see `new_metrics`). The events are not counted if None
+    `observer`: function (default=None)
+        Called after each step of the assignment as `observer(kind, school, lsoa, value, position)`,
+        with the same values as the events of the log of `models.assign_from_queues`
+
+    Returns
+    -------
+    Function, or None if there is nothing to count nor forward (the engines then skip the calls altogether)
+    """
+    if metrics is None: return observer
+    counters = metrics["counters"]
+    for names in event_counters.values():
+        for name in names: counters.setdefault(name, 0)
+
+    def counting_observer(kind, school, lsoa, value, position):
+        for name in event_counters[kind]:
+            counters[name] += 1
+        if observer is not None: observer(kind, school, lsoa, value, position)
+    return counting_observer
+
+def batch_observer(metrics, observer=None):
+    """
+    A function that creates the observer of the tasks of runs of the random model (see `models.Random_PANsCatchment_schools`),
+    counting the tasks and the runs in `metrics`, keeping the time of each task, and forwarding them to `observer`.
+
+    Parameters
+    ----------
+    `metrics`: dict
+        Metrics of the run (see `new_metrics`). The tasks are not counted if None
+    `observer`: function (default=None)
+        Called after each task of runs as `observer(runs, done, seconds)`,
+        with the number of runs of the task, the number of runs done so far and the wall-clock time (s) of the task
+
+    Returns
+    -------
+    Function, or None if there is nothing to count nor forward (the model then does not time the tasks)
+    """
+    if metrics is None: return observer
+    counters = metrics["counters"]
+    for name in ("batches", "runs"): counters.setdefault(name, 0)
+    batches = metrics.setdefault("batches", [])
+
+    def counting_observer(runs, done, seconds):
+        counters["batches"] += 1
+        counters["runs"] += runs
+        batches.append(seconds)
+        if observer is not None: observer(runs, done, seconds)
+    return counting_observer
@@ -0,0 +1,252 @@
+import pandas as pd
+import numpy as np
+import hashlib
+import json
+import os
+import sys
+import models
+from cache import load_model_inputs, inputs_fingerprint, write_atomic
+from ensemble import ensemble_accumulator, ensemble_metrics, ensemble_converged, ensemble_summary, accumulate
+from sweep import PAN_grid, sweep_PANs
+
+### Long-running jobs (random model ensembles and PAN sweeps) described by a scenario file, checkpointed to disk
+# a job stopped at any point (e.g. the kernel or the batch node died) resumes from its last checkpoint
+# and gives exactly the same outcome as a job that was never stopped
+## Version of the checkpoints (changing it invalidates all of them)
+JOB_VERSION = 1
+## Default values of the scenario files
+job_defaults = {
+    "age_factor": 0.19288,
+    "crs": 27700,
+    "PAN_year": 2024,
+    "catchments": True,
+    "initial_school": "Dorothy Stringer School",
+    "n_runs": 1000,
+    "seed": None,
+    "workers": None,
+    "batch_size": None,
+    "checkpoint_every": 100,
+    "tolerance": None,
+    "confidence": 0.95,
+    "min_runs": 30,
+    "keep_runs": False,
+}
+## Parameters that do not change the outcome of a job (they can be changed before resuming it)
+execution_parameters = ("workers", "batch_size", "output")
+
+def read_job(path):
+    """
+    A function that reads a scenario file (JSON) describing a job, e.g.
+
+        {
+            "job": "random",
+            "inputs": {"schools": "data/brighton_sec_schools.geojson", "students": "data/BrightonLSOA_Clean.geojson", "catchment": "data/catchment_02.geojson"},
+            "PANs": "data/Yr7_admissions.csv", "PAN_year": 2024,
+            "n_runs": 50000, "seed": 1, "checkpoint_every": 1000, "workers": 8
+        }
+
+    The paths are relative to the scenario file.
+
+    Parameters
+    ----------
+    `path`: str
+        Scenario file
+
+    Returns
+    -------
+    Dictionary with the parameters of the job, including:
+        - "job": "random" (`models.Random_PANsCatchment_schools`) or "sweep" (`sweep.sweep_PANs`),
+        - "inputs": paths of the "schools", "students" and "catchment" files (see `cache.load_model_inputs`),
+        - "PANs": CSV file of the PANs (columns "school" and "pan{PAN_year}") or dictionary of the PANs,
+        - for "random" jobs: "n_runs", "seed", "workers", "batch_size", "tolerance", "confidence", "min_runs" and "keep_runs" (write the values of each run),
+        - for "sweep" jobs: "scenarios" (dictionary of PANs of some schools for each scenario), or "options" (see `sweep.PAN_grid`),
+          and "catchments" and "initial_school",
+        - "checkpoint_every": number of runs or scenarios between checkpoints,
+        - "output": directory of the checkpoints and the outcome (by default, named after the scenario file)
+    """
+    with open(path) as file:
+        job = {**job_defaults, **json.load(file)}
+    base = os.path.dirname(os.path.abspath(path))
+    job["inputs"] = {key: os.path.join(base, value) for key, value in job["inputs"].items()}
+    if isinstance(job["PANs"], str): job["PANs"] = os.path.join(base, job["PANs"])
+    job["output"] = os.path.join(base, job.get("output", os.path.splitext(os.path.basename(path))[0]))
+    return job
+
+## Fingerprint of the parameters of a job that change its outcome and of the contents of its input files
+# (a checkpoint is only resumed by the same job on the same inputs, wherever the files are)
+def job_fingerprint(job):
+    paths = [job["inputs"]["schools"], job["inputs"]["students"], job["inputs"]["catchment"]]
+    if isinstance(job["PANs"], str): paths.append(job["PANs"])
+    files = inputs_fingerprint(paths, job["age_factor"], job["crs"])
+    parameters = {key: value for key, value in job.items() if key not in execution_parameters and key != "inputs"}
+    if isinstance(job["PANs"], str): del parameters["PANs"]
+    return hashlib.sha256(f"{JOB_VERSION}|{files}|{json.dumps(parameters, sort_keys=True, default=str)}".encode()).hexdigest()
+
+## Inputs of a job: the prepared DataFrames and distances (cached, see `cache.load_model_inputs`) and the PANs
+def job_inputs(job):
+    inputs = load_model_inputs(
+        job["inputs"]["schools"], job["inputs"]["students"], job["inputs"]["catchment"],
+        age_factor=job["age_factor"], crs=job["crs"], mmap_mode="r",
+    )
+    if isinstance(job["PANs"], str):
+        inputs["target_PAN"] = models.extract_PANs(pd.read_csv(job["PANs"]), job["PAN_year"])
+    else:
+        inputs["target_PAN"] = dict(job["PANs"])
+    return inputs
+
+## Save and load the checkpoint of a random job: the statistics of the runs done and the seed of the runs
+def save_random_checkpoint(path, fingerprint, entropy, accumulator, done):
+    arrays = {f"{metric}/{key}": values for metric in ensemble_metrics for key, values in accumulator[metric].items()}
+    state = {
+        "fingerprint": fingerprint,
+        "entropy": str(entropy),
+        "done": done,
+        "schools": accumulator["schools"],
+        "runs": accumulator["runs"],
+        "gamma": accumulator["gamma"],
+        "min_value": accumulator["min_value"],
+    }
+    write_atomic(path, lambda file: np.savez(file, state=np.array(json.dumps(state)), **arrays))
+
+def load_random_checkpoint(path):
+    with np.load(path) as checkpoint:
+        state = json.loads(str(checkpoint["state"]))
+        accumulator = {key: state[key] for key in ("schools", "runs", "gamma", "min_value")}
+        accumulator["metric_names"] = list(ensemble_metrics)
+        for metric in ensemble_metrics:
+            accumulator[metric] = {key: checkpoint[f"{metric}/{key}"] for key in ("n", "mean", "M2", "sketch")}
+    return state["fingerprint"], int(state["entropy"]), accumulator, state["done"]
+
+def run_random_job(job, log=print):
+    """
+    A function that runs (or resumes) a random job: the runs of `models.Random_PANsCatchment_schools`,
+    accumulated in blocks of `checkpoint_every` runs, with a checkpoint of the statistics after each block.
+    The runs are seeded from the master seed of the job (drawn on the first start if the scenario file has none),
+    and always accumulated in the same blocks, so the statistics are bit-identical however many times the job is stopped,
+    and whatever the `workers` and `batch_size`.
+
+    Parameters
+    ----------
+    `job`: dict
+        Parameters of the job (see `read_job`)
+    `log`: function (default=print)
+        Called with a message after each checkpoint
+
+    Returns
+    -------
+    Dictionary with the statistics of the runs (see `ensemble.ensemble_accumulator`),
+    also summarised in "summary.csv" of the `output` directory (see `ensemble.ensemble_summary`)
+    """
+    os.makedirs(job["output"], exist_ok=True)
+    checkpoint_path = os.path.join(job["output"], "checkpoint.npz")
+    fingerprint = job_fingerprint(job)
+    inputs = job_inputs(job)
+    school_strs = list(inputs["target_PAN"])
+    if os.path.exists(checkpoint_path):
+        checkpoint_fingerprint, entropy, accumulator, done = load_random_checkpoint(checkpoint_path)
+        if checkpoint_fingerprint != fingerprint:
+            raise ValueError(f"{checkpoint_path} is the checkpoint of a different job")
+        log(f"resuming after {done} runs")
+    else:
+        entropy = np.random.SeedSequence(job["seed"]).entropy
+        accumulator, done = ensemble_accumulator(school_strs), 0
+
+    random_inputs = models.random_model_inputs(inputs["schools"], inputs["students"], inputs["target_PAN"], inputs["dist_matrix"])
+    order = random_inputs["order"]
+    seeds = np.random.SeedSequence(entropy).spawn(job["n_runs"])
+    block = job["checkpoint_every"]
+    converged = job["tolerance"] is not None and ensemble_converged(accumulator, job["tolerance"], job["confidence"], job["min_runs"])
+    ## runs not accumulated yet (less than a block)
+    pending = [np.zeros((0, len(school_strs))) for metric in ensemble_metrics]
+    tasks = models.random_model_tasks(random_inputs, seeds[done:], job["workers"], job["batch_size"])
+    try:
+        for task, outcome in ([] if converged else tasks):
+            pending = [np.concatenate([pending[k], values[:, order]]) for k, values in enumerate(outcome)]
+            ## accumulate the complete blocks of runs (the blocks start at multiples of `checkpoint_every`, and the last block is the rest)
+            while len(pending[0]) >= block or (len(pending[0]) > 0 and done + len(pending[0]) == job["n_runs"]):
+                # contiguous, so the sums over the runs are the same whatever the tasks the runs come from
+                block_values = [np.ascontiguousarray(values[:block]) for values in pending]
+                pending = [values[block:] for values in pending]
+                accumulate(accumulator, *block_values)
+                if job["keep_runs"]:
+                    write_atomic(os.path.join(job["output"], f"runs_{done:09d}.npz"), lambda file: np.savez(file, **dict(zip(ensemble_metrics, block_values))))
+                done += len(block_values[0])
+                save_random_checkpoint(checkpoint_path, fingerprint, entropy, accumulator, done)
+                log(f"{done} / {job['n_runs']} runs")
+                ## stop once the mean distance of each school is known within the tolerance
+                if job["tolerance"] is not None and ensemble_converged(accumulator, job["tolerance"], job["confidence"], job["min_runs"]):
+                    converged = True
+                    break
+            if converged: break
+    finally:
+        tasks.close()
+
+    ensemble_summary(accumulator).to_csv(os.path.join(job["output"], "summary.csv"))
+    return accumulator
+
+def run_sweep_job(job, log=print):
+    """
+    A function that runs (or resumes) a sweep job: `sweep.sweep_PANs` over the scenarios of the job,
+    in blocks of `checkpoint_every` scenarios, with a checkpoint of the KPIs after each block.
+    The sweeps give the same assignment as solving each scenario from scratch, so the KPIs do not depend on the blocks.
+
+    Parameters
+    ----------
+    `job`: dict
+        Parameters of the job (see `read_job`)
+    `log`: function (default=print)
+        Called with a message after each checkpoint
+
+    Returns
+    -------
+    Pandas DataFrame with the KPIs of each scenario and school (see `sweep.sweep_PANs`),
+    also written to "sweep.csv" of the `output` directory
+    """
+    os.makedirs(job["output"], exist_ok=True)
+    checkpoint_path = os.path.join(job["output"], "checkpoint.pkl")
+    fingerprint = job_fingerprint(job)
+    inputs = job_inputs(job)
+    if "options" in job:
+        scenarios = dict(enumerate(PAN_grid(inputs["target_PAN"], job["options"])))
+    else:
+        scenarios = {name: {**inputs["target_PAN"], **PANs} for name, PANs in job["scenarios"].items()}
+    names = list(scenarios)
+
+    results = []
+    if os.path.exists(checkpoint_path):
+        checkpoint = pd.read_pickle(checkpoint_path)
+        if checkpoint["fingerprint"] != fingerprint:
+            raise ValueError(f"{checkpoint_path} is the checkpoint of a different job")
+        results = [checkpoint["KPIs"]]
+        log(f"resuming after {checkpoint['done']} scenarios")
+    done = checkpoint["done"] if results else 0
+
+    block = job["checkpoint_every"]
+    for start in range(done, len(names), block):
+        block_names = names[start:start + block]
+        results.append(sweep_PANs(
+            inputs["schools"], inputs["students"], {name: scenarios[name] for name in block_names},
+            catchments=job["catchments"], initial_school=job["initial_school"], dist_matrix=inputs["dist_matrix"],
+        ))
+        done = start + len(block_names)
+        KPIs = pd.concat(results, ignore_index=True)
+        results = [KPIs]
+        write_atomic(checkpoint_path, lambda file: pd.to_pickle({"fingerprint": fingerprint, "done": done, "KPIs": KPIs}, file))
+        log(f"{done} / {len(names)} scenarios")
+
+    KPIs = pd.concat(results, ignore_index=True) if results else pd.DataFrame()
+    KPIs.to_csv(os.path.join(job["output"], "sweep.csv"), index=False)
+    return KPIs
+
+## Run (or resume) the job of a scenario file
+def run_job(path, log=print):
+    job = read_job(path)
+    if job["job"] == "sweep":
+        return run_sweep_job(job, log)
+    return run_random_job(job, log)
+
+if __name__ == "__main__":
+    ## python jobs.py scenario.json [scenario.json ...], the jobs are run one after the other (the finished jobs return immediately)
+    for path in sys.argv[1:]:
+        print(f"job {path}")
+        run_job(path)
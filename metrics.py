@@ -0,0 +1,83 @@
+import numpy as np
+
+### KPIs of the assignments of the models for each school, in a single pass over the LSOAs assigned (`np.bincount` over the schools)
+## Conversion of the distances (m) to miles, and the distance of the free transport to school
+miles_per_metre = 0.000621371
+three_miles = 3 / miles_per_metre
+
+def assignment_KPIs(school, est, distance, target, students_total=None, lsoa_catchment=None, school_catchment=None, external=None):
+    """
+    A function that calculates the KPIs of an assignment for each school,
+    or of a number of runs at once (arrays with a row for each run, e.g. the runs of the random model).
+
+    Parameters
+    ----------
+    `school`: array of int
+        Row of the school assigned to each LSOA (-1 if not assigned), or (runs x LSOAs)
+    `est`: array of int
+        Number of students of each LSOA ("5_est"), or of each run and LSOA (same shape as `school`, e.g. see `demand.demand_draws`)
+    `distance`: array of float
+        Distance (m) from each LSOA to its school (any value if not assigned, see `assigned_distances`), same shape as `school`
+    `target`: array of int
+        PAN of each school
+    `students_total`: array of int (default=None)
+        Total students in each school, same shape as the KPIs (including the students assigned before the model).
+        The students of the LSOAs assigned if not provided
+    `lsoa_catchment`, `school_catchment`: arrays (default=None)
+        Catchment ID of each LSOA and of each school. No student is outside the catchment if not provided
+    `external`: array of bool (default=None)
+        LSOAs assigned beyond the PANs, same shape as `school`
+
+    Returns
+    -------
+    Dictionary of arrays with a value for each school (or (runs x schools)):
+        - "PAN", "students_total", "over_PAN" and "under_PAN": int,
+        - "distance": float, average distance in miles (NaN if the school has no students),
+        - "students_outside_catchment": int, "share_outside_catchment": float, and
+          "distance_outside_catchment": float, average distance in miles of the students from outside the catchment (NaN if none),
+        - "students_3_miles": int, students living further than 3 miles from the school,
+        - "students_external": int, students assigned beyond the PANs
+    """
+    school = np.asarray(school)
+    target = np.asarray(target, dtype=np.int64)
+    n_schools = len(target)
+    n_runs = len(school) if school.ndim == 2 else 1
+    assigned = school >= 0
+    i_runs, i_lsoas = np.nonzero(assigned.reshape(n_runs, -1))
+    i_schools = school[assigned].astype(np.int64)
+    # runs and schools combined into a single bin
+    bins = i_runs * n_schools + i_schools
+    est = np.asarray(est)
+    est = est[assigned] if est.ndim == school.ndim else est[i_lsoas]
+    dists = np.asarray(distance)[assigned].astype(float)
+    distx5_est = dists * est
+    if lsoa_catchment is not None and school_catchment is not None:
+        outside = np.asarray(lsoa_catchment)[i_lsoas] != np.asarray(school_catchment)[i_schools]
+    else:
+        outside = np.zeros(len(i_lsoas), dtype=bool)
+
+    shape = school.shape[:-1] + (n_schools,)
+    def total(weights, mask=slice(None)):
+        return np.bincount(bins[mask], weights=weights[mask], minlength=n_runs * n_schools).reshape(shape)
+    students = total(est)
+    students_outside = total(est, outside)
+    if students_total is None: students_total = students.astype(np.int64)
+    students_total = np.asarray(students_total, dtype=np.int64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return {
+            "PAN": np.broadcast_to(target, shape),
+            "students_total": students_total,
+            "over_PAN": np.maximum(students_total - target, 0),
+            "under_PAN": np.maximum(target - students_total, 0),
+            "distance": total(distx5_est) / students * miles_per_metre,
+            "students_outside_catchment": students_outside.astype(np.int64),
+            "share_outside_catchment": students_outside / students,
+            "distance_outside_catchment": total(distx5_est, outside) / students_outside * miles_per_metre,
+            "students_3_miles": total(est, dists > three_miles).astype(np.int64),
+            "students_external": total(est, np.asarray(external)[assigned] if external is not None else np.zeros(len(i_lsoas), dtype=bool)).astype(np.int64),
+        }
+
+## Distance from each LSOA to its school (0 if not assigned), for the school of each LSOA (or of each run and LSOA)
+def assigned_distances(dist_matrix, school):
+    school = np.asarray(school)
+    return np.where(school >= 0, dist_matrix[np.maximum(school, 0), np.arange(school.shape[-1])], 0.0)
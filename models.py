@@ -1,43 +1,30 @@
-import geopandas as gpd
-import pandas as pd
-from shapely import within, centroid, intersects, intersection
+## only NumPy and shapely are loaded with the models (pandas, geopandas, tqdm and matplotlib are loaded when used)
+from shapely import within, centroid, intersects, intersection, symmetric_difference, union_all, distance, area, STRtree
 import os
 ## find the directory of the python (assures compatibility)
 python_directory = os.path.abspath("")
-from tqdm import tqdm
-import matplotlib.pyplot as plt
-from matplotlib.lines import Line2D
-import copy
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from contextlib import nullcontext
+from ensemble import ensemble_accumulator, ensemble_converged
+from ensemble import accumulate as accumulate_runs
+from instrumentation import new_metrics, phase, count, step_observer, batch_observer
+from shared import shared_directory, share_inputs, attach_inputs
+from metrics import assignment_KPIs, assigned_distances, three_miles
 import math
-import random
+import tempfile
+import time
 import numpy as np
 import warnings
 warnings.filterwarnings("ignore")
 
-### plotting
-## define colours
-colours = {
-    "Blatchington Mill School": "steelblue",
-    "Brighton Aldridge Community Academy": "orange",
-    "Cardinal Newman Catholic School": "limegreen",
-    "Dorothy Stringer School": "firebrick",
-    "Hove Park School and Sixth Form Centre": "mediumpurple",
-    "King's School": "sienna",
-    "Longhill High School": "palevioletred",
-    "Patcham High School": "gray",
-    "Portslade Aldridge Community Academy": "darkkhaki",
-    "Varndean School": "darkturquoise",
-}
-
-## create custom legend
-def create_custom_legend_handles(colours=colours):
-    handles, labels = plt.gca().get_legend_handles_labels()
-    extend_list = []
-    for school_str in colours:
-        point = Line2D([0], [0], label=school_str, marker='o', markersize=10, markeredgecolor="black", markerfacecolor=colours[school_str], linestyle="")
-        extend_list.append(point)
-    handles.extend(extend_list)
-    return(handles)
+### plotting (loaded on first use, see `plotting`)
+# `models.colours` and `models.create_custom_legend_handles` are still available, without importing matplotlib with the models
+def __getattr__(name):
+    if name in ("colours", "create_custom_legend_handles"):
+        import plotting
+        return getattr(plotting, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 ### reseting parameters and identifying 5 year olds (required when starting the models)
 ## Identify the catchment ID of a polygon geometry based based on the catchment that contains it
@@ -65,15 +52,166 @@ def portion_within(geometry_a, geometry_b):
     portion = intersection_area / geometry_a.area
     return portion
 
+## Identify the catchment ID of many point geometries at once (same outcome as `point_catchment_ID`)
+# Only the catchments returned by a spatial index (STRtree) are tested
+def points_catchment_IDs(geometries, catchment):
+    catchment_geoms = np.asarray(catchment["geometry"])
+    catchment_IDs = catchment["catchment_ID"].to_numpy()
+    tree = STRtree(catchment_geoms)
+    i_points, i_catchments = tree.query(centroid(np.asarray(geometries)), predicate="within")
+    ## the first catchment that contains the point (None if no catchment contains it)
+    first = np.full(len(geometries), len(catchment_geoms))
+    np.minimum.at(first, i_points, i_catchments)
+    return [catchment_IDs[i] if i < len(catchment_geoms) else None for i in first]
+
+## Identify the catchment ID of many polygon geometries at once (same outcome as `polygon_catchment_ID`)
+# Only the overlapping pairs returned by a spatial index (STRtree) are intersected
+def polygons_catchment_IDs(geometries, catchment):
+    geoms = np.asarray(geometries)
+    catchment_IDs = catchment["catchment_ID"].to_numpy()
+    tree = STRtree(np.asarray(catchment["geometry"]))
+    i_polygons, i_catchments = tree.query(geoms, predicate="intersects")
+    portions = area(intersection(geoms[i_polygons], tree.geometries[i_catchments])) / area(geoms[i_polygons])
+    ## the catchment which includes the highest portion of the polygon (the first catchment if there is a tie)
+    sort = np.lexsort((i_catchments, -portions, i_polygons))
+    i_polygons, i_catchments, portions = i_polygons[sort], i_catchments[sort], portions[sort]
+    best = np.zeros(len(geoms), dtype=np.int64)
+    polygons_first, first = np.unique(i_polygons, return_index=True)
+    # polygons which do not overlap any catchment are reported with the first catchment
+    overlapping = portions[first] > 0
+    best[polygons_first[overlapping]] = i_catchments[first][overlapping]
+    return list(catchment_IDs[best])
+
 def extract_PANs(PANs, PAN_year):
     ## Extract the PANs for the input year
     target_PAN = {}
     for school_str in PANs["school"]:
-        target_PAN[school_str] = int(PANs[PANs["school"] == school_str][f"pan{PAN_year}"])
+        target_PAN[school_str] = int(PANs[PANs["school"] == school_str][f"pan{PAN_year}"].iloc[0])
     return target_PAN
 
+## Distances between every school and every LSOA
+# Computed once and shared between the models (and between the runs of the random model)
+def build_distance_matrix(schools, students_lsoa):
+    """
+    A function that calculates the distance from every school to every LSOA.
+
+    Parameters
+    ----------
+    `schools`: GeoPandas DataFrame
+        School locations as points
+    `students_lsoa`: GeoPandas DataFrame
+        LSOAs as polygons
+
+    Returns
+    -------
+    NumPy array of shape (number of schools, number of LSOAs), 
+    where `dist_matrix[i, j]` is the distance between the school in row `i` of `schools` and the LSOA in row `j` of `students_lsoa` (positional, not index labels)
+    """
+    school_geoms = np.asarray(schools["geometry"])
+    lsoa_geoms = np.asarray(students_lsoa["geometry"])
+    return distance(school_geoms[:, np.newaxis], lsoa_geoms[np.newaxis, :])
+
+## (schools x LSOAs) mask of the LSOAs within the catchment of each school
+def catchment_matrix(schools, students_lsoa):
+    school_IDs = schools["catchment_ID"].to_numpy()
+    lsoa_IDs = students_lsoa["catchment_ID"].to_numpy()
+    return lsoa_IDs[np.newaxis, :] == school_IDs[:, np.newaxis]
+
+## Copy of a DataFrame column with the values at the `mask` positions replaced
+def column_with(column, mask, values):
+    column = column.to_numpy()
+    values = np.asarray(values)
+    if column.dtype == object or values.dtype == object: dtype = object
+    else: dtype = np.result_type(column.dtype, values.dtype)
+    column = column.astype(dtype, copy=True)
+    column[mask] = values
+    return column
+
+### Outcome of the models
+class AssignmentResult(dict):
+    """
+    Outcome of a model, kept as compact arrays:
+        - "school": array of int16 (int32 with more than 32,767 schools), row of the school assigned to each LSOA (-1 if not assigned),
+        - "students_total": array of int, total students in each school,
+        - "distance": array of float32, distance (m) from each LSOA to its school (NaN if not assigned),
+        - "external": array of bool, LSOAs assigned beyond the PANs,
+        - "target": array of int, PAN of each school,
+        - "inputs": the `schools` and `students_lsoa` DataFrames of the model (neither copied nor modified)
+    The GeoPandas DataFrames "schools" and "students" with the outcome are built the first time they are accessed (see `assignment_frames`),
+    and so are the "KPIs" of each school (see `result_KPIs`).
+    """
+    def __missing__(self, key):
+        if key == "KPIs":
+            self["KPIs"] = result_KPIs(self)
+        elif key in ("schools", "students"):
+            self.update(assignment_frames(self))
+        else:
+            raise KeyError(key)
+        return dict.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        return self[key] if key in ("schools", "students", "KPIs") else dict.get(self, key, default)
+
+## Outcome of a model from the arrays of the assignment (and the model-specific entries in `extra`)
+def assignment_result(schools, students_lsoa, school, students_total, dist_matrix, external=None, target=None, **extra):
+    n_schools, n_lsoas = dist_matrix.shape
+    school = np.asarray(school)
+    assigned = school >= 0
+    distance = np.full(n_lsoas, np.nan, dtype=np.float32)
+    distance[assigned] = dist_matrix[school[assigned], np.flatnonzero(assigned)]
+    result = AssignmentResult(
+        school=school.astype(np.int16 if n_schools < 2 ** 15 else np.int32),
+        students_total=np.asarray(students_total, dtype=np.int64),
+        distance=distance,
+        external=np.zeros(n_lsoas, dtype=bool) if external is None else np.asarray(external, dtype=bool),
+        target=np.zeros(n_schools, dtype=np.int64) if target is None else np.asarray(target, dtype=np.int64),
+        inputs=(schools, students_lsoa),
+    )
+    result.update(extra)
+    return result
+
+## DataFrames of the outcome of a model: new DataFrames with the columns of the outcome (sharing the other columns with the inputs)
+# the LSOAs not assigned by the model keep the values of the inputs
+def assignment_frames(result):
+    schools, students_lsoa = result["inputs"]
+    school = result["school"].astype(np.int64)
+    assigned = school >= 0
+    i_schools = school[assigned]
+    dists = result["distance"][assigned].astype(float)
+    est = students_lsoa["5_est"].to_numpy()
+    school_strs = schools["establishment_name"].to_numpy()
+    return {
+        "schools": schools.assign(
+            students_total=result["students_total"],
+            students_3_miles=np.bincount(i_schools, weights=est[assigned] * (dists > three_miles), minlength=len(schools)).astype(np.int64),
+        ),
+        "students": students_lsoa.assign(
+            school=column_with(students_lsoa["school"], assigned, school_strs[i_schools]),
+            catchment_ID_school=column_with(students_lsoa["catchment_ID_school"], assigned, schools["catchment_ID"].to_numpy()[i_schools]),
+            dist_to_school=column_with(students_lsoa["dist_to_school"], assigned, dists),
+            distx5_est=column_with(students_lsoa["distx5_est"], assigned, dists * est[assigned]),
+            external=column_with(students_lsoa["external"], assigned, result["external"][assigned]),
+        ),
+    }
+
+## KPIs of each school of the outcome of a model (see `metrics.assignment_KPIs`), in the order of the rows of the `schools`
+# the students are outside the catchment if the `schools` and `students_lsoa` have a "catchment_ID"
+def result_KPIs(result):
+    schools, students_lsoa = result["inputs"]
+    has_catchments = "catchment_ID" in schools and "catchment_ID" in students_lsoa
+    return assignment_KPIs(
+        result["school"],
+        students_lsoa["5_est"].to_numpy(),
+        result["distance"],
+        result["target"],
+        students_total=result["students_total"],
+        lsoa_catchment=students_lsoa["catchment_ID"].to_numpy() if has_catchments else None,
+        school_catchment=schools["catchment_ID"].to_numpy() if has_catchments else None,
+        external=result["external"],
+    )
+
 ## generate additional attribute columns
-def reset_parameters(catchment, schools, students):
+def reset_parameters(catchment, schools, students, age_factor=0.19288):
     ## Catchments
     # column for the catchment id
     catchment["catchment_ID"] = [index + 1 for index in catchment.index]
@@ -84,17 +222,17 @@ def reset_parameters(catchment, schools, students):
     schools["students_total"] = [0 for index in schools.index]
     schools["students_3_miles"] = [0 for index in schools.index]
     schools["catchment_ID"] = [0 for index in schools.index]
-    schools["catchment_ID"] = [point_catchment_ID(schools, i, catchment) for i in schools.index]
+    schools["catchment_ID"] = points_catchment_IDs(schools["geometry"], catchment)
     schools["colour"] = ["" for index in schools.index]
     ## LSOA including number of students
     # Column to assign the name of the schools
-    # Column to assign the estimated number of 5 year olds
+    # Column to assign the estimated number of 5 year olds (`age_factor` of the 5 to 9 year olds)
     # Column to assign catchment ID
     # Column to assign colours
     students["school"] = ["" for index in students.index]
-    students["5_est"] = [math.floor(n * 0.19288) for n in students["5_9_total"]]
+    students["5_est"] = [math.floor(n * age_factor) for n in students["5_9_total"]]
     students["catchment_ID"] = [0 for index in students.index]
-    students["catchment_ID"] = [polygon_catchment_ID(students, i, catchment) for i in students.index]
+    students["catchment_ID"] = polygons_catchment_IDs(students["geometry"], catchment)
     students["catchment_ID_school"] = [0 for index in students.index]
     students["dist_to_school"] = [0 for index in students.index]
     students["distx5_est"] = [0 for index in students.index]
@@ -106,6 +244,593 @@ def reset_parameters(catchment, schools, students):
         "students": students
     }
 
+def update_catchments(catchment, schools, students, changed):
+    """
+    A function that replaces the geometries of some catchments (e.g. boundaries edited by a planner),
+    and updates the catchment IDs of the schools and LSOAs affected, instead of running `reset_parameters` again.
+    Only the schools and LSOAs intersecting the areas added to or removed from the catchments (found through a spatial index)
+    are assigned a catchment again, with the same rules as `reset_parameters`, so the outcome is the same as a full rebuild.
+
+    Parameters
+    ----------
+    `catchment`: GeoPandas DataFrame
+        Catchments, including the attribute "catchment_ID" (see `reset_parameters`)
+    `schools`: GeoPandas DataFrame
+        School locations as points, including the attribute "catchment_ID"
+    `students`: GeoPandas DataFrame
+        LSOAs as polygons, including the attributes "catchment_ID", "school" and "catchment_ID_school"
+    `changed`: dict
+        Catchment IDs as index and new geometry as value
+
+    Returns
+    -------
+    Dictionary including:
+        - "schools": NumPy array of bool, schools whose catchment ID changed,
+        - "students": NumPy array of bool, LSOAs whose catchment ID changed,
+        - "region": shapely geometry, area added to or removed from the catchments
+    """
+    catchment_IDs = catchment["catchment_ID"].to_numpy()
+    rows = [int(np.flatnonzero(catchment_IDs == ID)[0]) for ID in changed]
+    old_geoms = np.asarray(catchment["geometry"])[rows]
+    new_geoms = np.array(list(changed.values()), dtype=object)
+    ## area where the catchments changed (the catchment IDs elsewhere stay the same)
+    region = union_all(symmetric_difference(old_geoms, new_geoms))
+    catchment.iloc[rows, catchment.columns.get_loc("geometry")] = new_geoms
+
+    outcome = {"region": region}
+    for frame, catchment_IDs_of, key in ((schools, points_catchment_IDs, "schools"), (students, polygons_catchment_IDs, "students")):
+        geoms = np.asarray(frame["geometry"])
+        ## the schools and LSOAs in the area (the schools by their centroid, as in `points_catchment_IDs`)
+        tested = intersects(centroid(geoms) if key == "schools" else geoms, region)
+        # missing IDs (schools outside the catchments) as None, as returned by `points_catchment_IDs`
+        IDs = frame["catchment_ID"].astype(object).where(frame["catchment_ID"].notna(), None).to_numpy(copy=True)
+        updated = np.zeros(len(frame), dtype=bool)
+        if tested.any():
+            new_IDs = np.array(catchment_IDs_of(geoms[tested], catchment), dtype=object)
+            updated[tested] = new_IDs != IDs[tested]
+            IDs[tested] = new_IDs
+            # a list, so the column gets the same type as with `reset_parameters`
+            frame["catchment_ID"] = list(IDs)
+        outcome[key] = updated
+
+    ## catchment of the school assigned to the LSOAs, for the schools whose catchment changed
+    if outcome["schools"].any() and "school" in students:
+        school_IDs = dict(zip(schools["establishment_name"][outcome["schools"]], schools["catchment_ID"][outcome["schools"]]))
+        assigned = students["school"].isin(school_IDs).to_numpy()
+        students.loc[students.index[assigned], "catchment_ID_school"] = students["school"][assigned].map(school_IDs)
+    return outcome
+
+
+### Array-backed assignment engines (shared by the school-driven and the LSOA-driven models)
+## Order the schools by distance, starting from the initial school and moving to the closest school not yet visited
+def order_schools(schools, initial_school):
+    school_strs = list(schools["establishment_name"])
+    school_geoms = np.asarray(schools["geometry"])
+    dists = distance(school_geoms[:, np.newaxis], school_geoms[np.newaxis, :])
+    visited = np.zeros(len(school_strs), dtype=bool)
+    i_current = school_strs.index(initial_school)
+    schools_ordered = []
+    while not visited.all():
+        schools_ordered.append(school_strs[i_current])
+        visited[i_current] = True
+        # find the next closest (not visited) school
+        if not visited.all():
+            i_current = int(np.argmin(np.where(visited, np.inf, dists[i_current])))
+    return schools_ordered
+
+## Loop through the schools (in order) and assign the closest LSOAs until the PANs are saturated
+def assign_LSOAs_by_school(
+        dist_matrix,
+        est,
+        target,
+        order,
+        students_total=None,
+        unassigned=None,
+        in_catchment=None,
+        skip_zero_PAN=False,
+        observer=None,
+        metrics=None,
+        ):
+    """
+    The core of the school-driven models, keeping the state of the assignment in NumPy arrays.
+    Each school keeps a queue of the LSOAs sorted by distance and a pointer to its closest unassigned LSOA, 
+    so finding the next LSOA does not require filtering the LSOAs DataFrame.
+
+    Parameters
+    ----------
+    `dist_matrix`: NumPy array
+        Distances between the schools and the LSOAs (see `build_distance_matrix`)
+    `est`: array of int
+        Number of students in each LSOA
+    `target`: array of int
+        PAN of each school (same order as the rows of `dist_matrix`)
+    `order`: list of int
+        Rows of the schools in the order they are looped through
+    `students_total`: array of int (default=None)
+        Students already assigned to each school. Zeros if not provided
+    `unassigned`: array of bool (default=None)
+        LSOAs that can still be assigned. All LSOAs if not provided
+    `in_catchment`: array of bool (default=None)
+        (schools x LSOAs) mask of the LSOAs within the catchment of each school. 
+        If provided, each school assigns the LSOAs within its catchment first
+    `skip_zero_PAN`: bool (default=False)
+        If True, schools with a PAN of 0 are not assigned LSOAs once all the PANs are saturated
+    `observer`: function (default=None)
+        Called after each step of the assignment (see `assign_from_queues`)
+    `metrics`: dict (default=None)
+        Metrics to add the time of the phases to (see `instrumentation.new_metrics`)
+
+    Returns
+    -------
+    Dictionary including:
+        - "school": array of int, row of the school assigned to each LSOA (-1 if not assigned by the model)
+        - "students_total": array of int, total students in each school
+        - "external": array of bool, LSOAs assigned after all the PANs were saturated
+    """
+    with phase(metrics, "candidates"):
+        queues, queue_all, queue_in = distance_queues(dist_matrix, in_catchment)
+    with phase(metrics, "assignment"):
+        return assign_from_queues(est, target, order, queues, queue_all, queue_in, students_total, unassigned, skip_zero_PAN, observer=observer)
+
+## Queues of LSOAs sorted by distance for each school (stable, ties keep the order of the LSOAs)
+# followed by the queues of the LSOAs within the catchment of each school, if `in_catchment` is provided
+def distance_queues(dist_matrix, in_catchment=None):
+    n_schools = dist_matrix.shape[0]
+    queues = list(np.argsort(dist_matrix, axis=1, kind="stable"))
+    queue_all = list(range(n_schools))
+    queue_in = None
+    if in_catchment is not None:
+        queues += [queues[i][in_catchment[i, queues[i]]] for i in range(n_schools)]
+        queue_in = [n_schools + i for i in range(n_schools)]
+    return queues, queue_all, queue_in
+
+## Loop through the schools (in order) and assign the next LSOA in their queues until the PANs are saturated
+def assign_from_queues(
+        est,
+        target,
+        order,
+        queues,
+        queue_all,
+        queue_in=None,
+        students_total=None,
+        unassigned=None,
+        skip_zero_PAN=False,
+        log=False,
+        resume=None,
+        observer=None,
+        ):
+    """
+    Assigns LSOAs to schools taking, for each school, the first unassigned LSOA of its queue.
+    Queues can be shared between schools (e.g. a random order of the LSOAs in a catchment), 
+    in which case the schools share the pointer to the first unassigned LSOA.
+
+    Parameters
+    ----------
+    `est`: array of int
+        Number of students in each LSOA
+    `target`: array of int
+        PAN of each school
+    `order`: list of int
+        Rows of the schools in the order they are looped through
+    `queues`: list of arrays of int
+        Queues of LSOAs (positions), in the order they are taken
+    `queue_all`: list of int
+        Queue (position in `queues`) including all the LSOAs, for each school
+    `queue_in`: list of int (default=None)
+        Queue (position in `queues`) including the LSOAs within the catchment, for each school. 
+        If provided, each school takes the LSOAs from this queue first
+    `students_total`: array of int (default=None)
+        Students already assigned to each school. Zeros if not provided
+    `unassigned`: array of bool (default=None)
+        LSOAs that can still be assigned. All LSOAs if not provided
+    `skip_zero_PAN`: bool (default=False)
+        If True, schools with a PAN of 0 are not assigned LSOAs once all the PANs are saturated
+    `log`: bool (default=False)
+        If True, the events of the assignment are recorded (see `assignment_state`)
+    `resume`: dict (default=None)
+        State to resume the assignment from, at the step of the school in position "position" of `order` (see `assignment_state`)
+    `observer`: function (default=None)
+        Called after each event as `observer(kind, school, lsoa, value, position)`, with the values of the log
+
+    Returns
+    -------
+    Dictionary including:
+        - "school": array of int, row of the school assigned to each LSOA (-1 if not assigned by the model)
+        - "students_total": array of int, total students in each school
+        - "external": array of bool, LSOAs assigned after all the PANs were saturated
+        - "log": dictionary of arrays with an entry for each event (if `log`):
+            "kind" (0: assigned within PAN, 1: assigned to the last school with availability and saturated, 2: saturated, 3: assigned after all PANs were saturated), 
+            "school", "lsoa", "value" (students in the school if the LSOA is added) and "position" (position of the school in `order`)
+    """
+    est = np.asarray(est, dtype=np.int64)
+    target = np.asarray(target, dtype=np.int64)
+    n_schools, n_lsoas = len(target), len(est)
+    if students_total is None: students_total = np.zeros(n_schools, dtype=np.int64)
+    else: students_total = np.array(students_total, dtype=np.int64)
+    if unassigned is None: unassigned = np.ones(n_lsoas, dtype=bool)
+    else: unassigned = np.array(unassigned, dtype=bool)
+    school = np.full(n_lsoas, -1, dtype=np.int64)
+    external = np.zeros(n_lsoas, dtype=bool)
+    saturated = np.zeros(n_schools, dtype=bool)
+    start = 0
+    if resume is not None:
+        school = resume["school"].copy()
+        external = resume["external"].copy()
+        students_total = resume["students_total"].copy()
+        saturated = resume["saturated"].copy()
+        unassigned &= school < 0
+        start = resume["position"]
+    pointers = [0] * len(queues)
+    if resume is not None:
+        # skip the assigned LSOAs at the front of the queues
+        pointers = [int(np.argmax(unassigned[q])) if unassigned[q].any() else len(q) for q in queues]
+    events = []
+
+    ## first unassigned LSOA in a queue (-1 if there is none)
+    def next_lsoa(i_queue):
+        q = queues[i_queue]
+        p = pointers[i_queue]
+        while p < len(q) and not unassigned[q[p]]:
+            p += 1
+        pointers[i_queue] = p
+        return q[p] if p < len(q) else -1
+
+    n_unassigned = int(unassigned.sum())
+    n_unsaturated = n_schools - int(saturated.sum())
+
+    def assign(i_lsoa, i_school, is_external):
+        nonlocal n_unassigned
+        school[i_lsoa] = i_school
+        external[i_lsoa] = is_external
+        unassigned[i_lsoa] = False
+        students_total[i_school] += est[i_lsoa]
+        n_unassigned -= 1
+
+    ## a single step of a school, returns True if the state changed
+    def step(k):
+        nonlocal n_unsaturated
+        i_school = order[k]
+        changed = False
+        ## Accumilate students from the LSOAs in the queue
+        if not saturated[i_school]:
+            i_lsoa = -1
+            if queue_in is not None:
+                i_lsoa = next_lsoa(queue_in[i_school])
+            # else, if no LSOAs are within the catchment, consider any unassigned LSOA
+            if i_lsoa < 0:
+                i_lsoa = next_lsoa(queue_all[i_school])
+            if i_lsoa >= 0:
+                changed = True
+                value = students_total[i_school] + est[i_lsoa]
+                ## if adding the number of students in the LSOA will not lead to exceeding the PAN
+                if value < target[i_school]:
+                    kind = 0
+                    assign(i_lsoa, i_school, False)
+                ## if this is the last school with any availability. Add the students to it
+                elif n_unsaturated == 1:
+                    kind = 1
+                    assign(i_lsoa, i_school, False)
+                    saturated[i_school] = True
+                    n_unsaturated -= 1
+                else:
+                    kind = 2
+                    saturated[i_school] = True
+                    n_unsaturated -= 1
+                if log: events.append((kind, i_school, i_lsoa, value, k))
+                if observer is not None: observer(kind, i_school, i_lsoa, value, k)
+        ## Accumilate the next LSOA regardless of PAN, if all schools reached their PANs
+        if n_unsaturated == 0 and n_unassigned > 0 and (target[i_school] > 0 or not skip_zero_PAN):
+            i_lsoa = next_lsoa(queue_all[i_school])
+            assign(i_lsoa, i_school, True)
+            if log: events.append((3, i_school, i_lsoa, students_total[i_school], k))
+            if observer is not None: observer(3, i_school, i_lsoa, students_total[i_school], k)
+            changed = True
+        return changed
+
+    ## while any LSOA has not been adressed a school
+    # saturated schools are skipped until all the schools are saturated
+    # (a resumed assignment starts from the middle of a loop)
+    active = [k for k in range(n_schools) if not saturated[order[k]]]
+    while n_unassigned > 0:
+        changed = start > 0
+        if n_unsaturated > 0:
+            for k in active:
+                if k < start: continue
+                changed |= step(k)
+                # all the schools became saturated, the rest of the loop considers all schools
+                if n_unsaturated == 0:
+                    for k_next in range(k + 1, n_schools):
+                        changed |= step(k_next)
+                    break
+            active = [k for k in active if not saturated[order[k]]]
+        else:
+            for k in range(start, n_schools):
+                changed |= step(k)
+        start = 0
+        # no school can take any of the remaining LSOAs (e.g. all PANs are 0)
+        if not changed: break
+
+    outcome = {
+        "school": school,
+        "students_total": students_total,
+        "external": external,
+    }
+    if log:
+        events = np.array(events, dtype=np.int64).reshape(-1, 5)
+        outcome["log"] = {key: events[:, i] for i, key in enumerate(["kind", "school", "lsoa", "value", "position"])}
+    return outcome
+
+## State of an assignment after the first `n_events` events of its log (to resume the assignment from, see `assign_from_queues`)
+def assignment_state(log, n_events, est, n_schools, students_total=None, n_lsoas=None):
+    if n_lsoas is None: n_lsoas = len(est)
+    kind = log["kind"][:n_events]
+    i_schools = log["school"][:n_events]
+    i_lsoas = log["lsoa"][:n_events]
+    assigned = kind != 2
+    school = np.full(n_lsoas, -1, dtype=np.int64)
+    school[i_lsoas[assigned]] = i_schools[assigned]
+    external = np.zeros(n_lsoas, dtype=bool)
+    external[i_lsoas[kind == 3]] = True
+    if students_total is None: students_total = np.zeros(n_schools, dtype=np.int64)
+    students_total = students_total + np.bincount(i_schools[assigned], weights=np.asarray(est)[i_lsoas[assigned]], minlength=n_schools).astype(np.int64)
+    saturated = np.zeros(n_schools, dtype=bool)
+    saturated[i_schools[(kind == 1) | (kind == 2)]] = True
+    ## resume at the step of the next event
+    position = log["position"][n_events] if n_events < len(log["kind"]) else 0
+    return {
+        "school": school,
+        "external": external,
+        "students_total": students_total,
+        "saturated": saturated,
+        "position": int(position),
+    }
+
+## States of a batch of assignments after the first `n_events[d]` events of a shared log, for each row `d` of `est` (see `assignment_state`)
+def assignment_state_batch(log, n_events, est, n_schools):
+    est = np.asarray(est, dtype=np.int64)
+    n_draws, n_lsoas = est.shape
+    n_events = np.asarray(n_events, dtype=np.int64)
+    kind, i_schools, i_lsoas = log["kind"], log["school"], log["lsoa"]
+    ## events in the prefix of each draw (draws x events)
+    prefix = np.arange(len(kind)) < n_events[:, None]
+    rows, events = np.nonzero(prefix & (kind != 2))
+    school = np.full((n_draws, n_lsoas), -1, dtype=np.int64)
+    school[rows, i_lsoas[events]] = i_schools[events]
+    external = np.zeros((n_draws, n_lsoas), dtype=bool)
+    is_external = kind[events] == 3
+    external[rows[is_external], i_lsoas[events[is_external]]] = True
+    students_total = np.bincount(
+        rows * n_schools + i_schools[events], weights=est[rows, i_lsoas[events]], minlength=n_draws * n_schools,
+    ).astype(np.int64).reshape(n_draws, n_schools)
+    saturated = np.zeros((n_draws, n_schools), dtype=bool)
+    rows, events = np.nonzero(prefix & ((kind == 1) | (kind == 2)))
+    saturated[rows, i_schools[events]] = True
+    ## resume at the step of the next event
+    position = np.zeros(n_draws, dtype=np.int64)
+    resumed = n_events < len(kind)
+    position[resumed] = log["position"][n_events[resumed]]
+    return {
+        "school": school,
+        "external": external,
+        "students_total": students_total,
+        "saturated": saturated,
+        "position": position,
+    }
+
+## A batch of assignments from the same queues, advanced together
+def assign_from_queues_batch(est, target, order, queues, queue_all, queue_in=None, skip_zero_PAN=False, resume=None):
+    """
+    Runs `assign_from_queues` for each row of `est` at once, giving the same outcome as the rows one by one.
+    The state is kept in (draws x LSOAs) and (draws x schools) arrays,
+    so each step of a school (next LSOA, PAN check and bookkeeping) is a single NumPy operation over all the draws.
+
+    Parameters
+    ----------
+    `est`: (draws x LSOAs) array of int
+        Number of students in each LSOA, for each draw
+    `target`, `order`, `queues`, `queue_all`, `queue_in`, `skip_zero_PAN`:
+        As in `assign_from_queues`, shared by all the draws
+    `resume`: dict (default=None)
+        States to resume the assignments from, with a row for each draw and the "position" of each draw (see `assignment_state_batch`)
+
+    Returns
+    -------
+    Dictionary including:
+        - "school": (draws x LSOAs) array of int, row of the school assigned to each LSOA (-1 if not assigned by the model)
+        - "students_total": (draws x schools) array of int, total students in each school
+        - "external": (draws x LSOAs) array of bool, LSOAs assigned after all the PANs were saturated
+    """
+    est = np.asarray(est, dtype=np.int64)
+    target = np.asarray(target, dtype=np.int64)
+    (n_draws, n_lsoas), n_schools = est.shape, len(target)
+
+    ## state of the draws
+    if resume is None:
+        school = np.full((n_draws, n_lsoas), -1, dtype=np.int64)
+        external = np.zeros((n_draws, n_lsoas), dtype=bool)
+        students_total = np.zeros((n_draws, n_schools), dtype=np.int64)
+        saturated = np.zeros((n_draws, n_schools), dtype=bool)
+        start = np.zeros(n_draws, dtype=np.int64)
+    else:
+        school = resume["school"].copy()
+        external = resume["external"].copy()
+        students_total = resume["students_total"].copy()
+        saturated = resume["saturated"].copy()
+        start = np.asarray(resume["position"], dtype=np.int64).copy()
+    unassigned = school < 0
+    n_unassigned = unassigned.sum(axis=1)
+    n_unsaturated = n_schools - saturated.sum(axis=1)
+    # skip the assigned LSOAs at the front of the queues
+    pointers = np.zeros((n_draws, len(queues)), dtype=np.int64)
+    if resume is not None:
+        for i_queue, q in enumerate(queues):
+            if len(q) == 0: continue
+            front = unassigned[:, q]
+            pointers[:, i_queue] = np.where(front.any(axis=1), np.argmax(front, axis=1), len(q))
+
+    ## first unassigned LSOA in a queue, for the draws in `rows` (-1 if there is none)
+    def next_lsoa(i_queue, rows):
+        q = queues[i_queue]
+        if len(q) == 0 or len(rows) == 0: return np.full(len(rows), -1)
+        p = pointers[rows, i_queue]
+        # the pointers look ahead through windows of the queue, doubling in width, until an unassigned LSOA is found
+        check = np.arange(len(rows))
+        width = 4
+        while len(check) > 0:
+            check = check[p[check] < len(q)]
+            window = p[check, None] + np.arange(width)
+            free = unassigned[rows[check, None], q[np.minimum(window, len(q) - 1)]] & (window < len(q))
+            found = free.any(axis=1)
+            p[check] += np.where(found, np.argmax(free, axis=1), width)
+            check = check[~found]
+            width *= 2
+        p = np.minimum(p, len(q))
+        pointers[rows, i_queue] = p
+        return np.where(p < len(q), q[np.minimum(p, len(q) - 1)], -1)
+
+    def assign(rows, i_lsoas, i_school, is_external):
+        school[rows, i_lsoas] = i_school
+        external[rows, i_lsoas] = is_external
+        unassigned[rows, i_lsoas] = False
+        students_total[rows, i_school] += est[rows, i_lsoas]
+        n_unassigned[rows] -= 1
+
+    ## while any draw has LSOAs without a school
+    # a step of a saturated school does nothing until all the schools are saturated, so every loop takes all the schools
+    running = n_unassigned > 0
+    while running.any():
+        changed = running & (start > 0)
+        for k, i_school in enumerate(order):
+            stepping = running & (start <= k)
+            ## Accumilate students from the LSOAs in the queue
+            rows = np.flatnonzero(stepping & ~saturated[:, i_school])
+            i_lsoas = np.full(len(rows), -1)
+            if queue_in is not None:
+                i_lsoas = next_lsoa(queue_in[i_school], rows)
+            # else, if no LSOAs are within the catchment, consider any unassigned LSOA
+            empty = i_lsoas < 0
+            i_lsoas[empty] = next_lsoa(queue_all[i_school], rows[empty])
+            found = i_lsoas >= 0
+            rows, i_lsoas = rows[found], i_lsoas[found]
+            changed[rows] = True
+            fits = students_total[rows, i_school] + est[rows, i_lsoas] < target[i_school]
+            # the last school with any availability takes the students
+            last = ~fits & (n_unsaturated[rows] == 1)
+            assign(rows[fits | last], i_lsoas[fits | last], i_school, False)
+            saturated[rows[~fits], i_school] = True
+            n_unsaturated[rows[~fits]] -= 1
+            ## Accumilate the next LSOA regardless of PAN, if all schools reached their PANs
+            if target[i_school] > 0 or not skip_zero_PAN:
+                rows = np.flatnonzero(stepping & (n_unsaturated == 0) & (n_unassigned > 0))
+                assign(rows, next_lsoa(queue_all[i_school], rows), i_school, True)
+                changed[rows] = True
+        start[:] = 0
+        # draws where no school can take any of the remaining LSOAs stop
+        running &= changed & (n_unassigned > 0)
+
+    return {
+        "school": school,
+        "students_total": students_total,
+        "external": external,
+    }
+
+
+## Schools sorted by distance for each LSOA (LSOAs x schools, stable, ties keep the order of the schools)
+def school_preferences(dist_matrix):
+    return np.argsort(dist_matrix.T, axis=1, kind="stable")
+
+## The `k` closest schools of each LSOA, closest first (LSOAs x `k`), without sorting all the schools (all of them if `k` is None)
+def closest_schools(dist_matrix, k=None):
+    if k is None or k >= dist_matrix.shape[0]: return school_preferences(dist_matrix)
+    closest = np.argpartition(dist_matrix, k - 1, axis=0)[:k]
+    order = np.argsort(np.take_along_axis(dist_matrix, closest, axis=0), axis=0, kind="stable")
+    return np.take_along_axis(closest, order, axis=0).T
+
+## Loop through the LSOAs (in order) and assign the closest school that is not saturated
+def assign_schools_by_LSOA(
+        preferences,
+        est,
+        target,
+        students_total=None,
+        unassigned=None,
+        in_catchment=None,
+        observer=None,
+        ):
+    """
+    The core of the LSOA-driven models, keeping the state of the assignment in NumPy arrays.
+    The distances are sorted once for all the LSOAs (with the schools within the catchment first if `in_catchment` is provided),
+    and each LSOA moves a cursor along its row of the preference matrix, one school at a time, only past the saturated schools:
+    the schools saturate once and for all, so an LSOA costs O(1) plus the saturated schools it prefers to its school.
+
+    Parameters
+    ----------
+    `preferences`: NumPy array
+        Schools sorted by distance for each LSOA (see `school_preferences`)
+    `est`: array of int
+        Number of students in each LSOA
+    `target`: array of int
+        PAN of each school (same order as the schools in `preferences`)
+    `students_total`: array of int (default=None)
+        Students already assigned to each school. Zeros if not provided
+    `unassigned`: array of bool (default=None)
+        LSOAs that can still be assigned. All LSOAs if not provided
+    `in_catchment`: array of bool (default=None)
+        (schools x LSOAs) mask of the LSOAs within the catchment of each school. 
+        If provided, each LSOA is assigned to the schools within its catchment first, 
+        and LSOAs are no longer assigned once all the PANs are saturated
+    `observer`: function (default=None)
+        Called after each event as `observer(kind, school, lsoa, value, position)`, 
+        with the kinds of events of `assign_from_queues` (0: assigned, 2: saturated), 
+        the students in the school if the LSOA is added, and the position of the LSOA in the loop
+
+    Returns
+    -------
+    Dictionary including:
+        - "school": array of int, row of the school assigned to each LSOA (-1 if not assigned by the model)
+        - "students_total": array of int, total students in each school
+    """
+    n_lsoas, n_schools = preferences.shape
+    target = np.asarray(target, dtype=np.int64)
+    lsoas = np.flatnonzero(np.ones(n_lsoas, dtype=bool) if unassigned is None else unassigned)
+    ## the schools within the catchment first, then the other schools (each group by distance)
+    # once the schools within the catchment are saturated, the LSOA goes to the closest school with places, as with all the schools
+    if in_catchment is not None:
+        outside = ~np.asarray(in_catchment)[preferences[lsoas], lsoas[:, np.newaxis]]
+        preferences = np.take_along_axis(preferences[lsoas], np.argsort(outside, axis=1, kind="stable"), axis=1)
+    else:
+        preferences = preferences[lsoas]
+    ## state of the schools in Python lists (scalar access in the loop)
+    est = np.asarray(est, dtype=np.int64)[lsoas].tolist()
+    # remaining places in each school
+    spare = (target - (np.zeros(n_schools, dtype=np.int64) if students_total is None else np.asarray(students_total, dtype=np.int64))).tolist()
+    saturated = [False] * n_schools
+    n_saturated = 0
+    school = np.full(n_lsoas, -1, dtype=np.int64)
+
+    for k, i_lsoa in enumerate(lsoas.tolist()):
+        # no LSOA can be assigned once all the schools are saturated
+        if n_saturated == n_schools: break
+        e = est[k]
+        cursor = 0
+        while cursor < n_schools:
+            i_school = preferences.item(k, cursor)
+            cursor += 1
+            if saturated[i_school]: continue
+            ## if adding the number of students in the LSOA will not lead to exceeding the PAN
+            if e <= spare[i_school]:
+                spare[i_school] -= e
+                school[i_lsoa] = i_school
+                if observer is not None: observer(0, i_school, i_lsoa, target[i_school] - spare[i_school], k)
+                break
+            saturated[i_school] = True
+            n_saturated += 1
+            if observer is not None: observer(2, i_school, i_lsoa, target[i_school] - spare[i_school] + e, k)
+
+    return {
+        "school": school,
+        "students_total": target - np.asarray(spare, dtype=np.int64),
+    }
+
 
 ### Model version 1.1: optimise for schools ignoring catchments
 def Optimise_PANs_Schools(
@@ -113,6 +838,9 @@ def Optimise_PANs_Schools(
         students_lsoa,
         target_PAN,
         initial_school="Dorothy Stringer School",
+        dist_matrix=None,
+        instrument=False,
+        observer=None,
         ):
     """
     A function that identifies the catchement areas based on the proposed PANs. 
@@ -123,97 +851,61 @@ def Optimise_PANs_Schools(
     ----------
     `schools`: GeoPandas DataFrame
         School locations as points
-    `students_losa`: Geopandas DataFrame
-        LSOAs including an attribute for the number of students "est_5"
-    `PANs`: Pandas DataFrame
-        Planned PANs for each school
-    `PAN_year`: int (default=2024)
-        PAN year to extract the values from the `PANs` DataFrame
+    `students_lsoa`: GeoPandas DataFrame
+        LSOAs including an attribute for the number of students "5_est"
+    `target_PAN`: dict
+        School names as keys and PAN as value
     `initial_school`: str (default="Dorothy Stringer School")
         The initial school in the optimisation loop
+    `dist_matrix`: NumPy array (default=None)
+        Distances between the schools and the LSOAs (see `build_distance_matrix`). Calculated if not provided
+    `instrument`: bool (default=False)
+        If True, the time of each phase and counters of the events are returned as "metrics" (see `instrumentation`)
+    `observer`: function (default=None)
+        Called after each step of the assignment as `observer(kind, school, lsoa, value, position)` (see `assign_from_queues`)
 
     Returns
     -------
-    Dictionary including:
-        - "schools": GeoPandas DataFrame,
-        - "students": GeoPandas DataFrame
+    AssignmentResult (dictionary) including:
+        - "school", "students_total", "distance" and "external": arrays of the outcome (see `AssignmentResult`),
+        - "KPIs": dictionary of arrays, KPIs of each school (computed when accessed, see `metrics.assignment_KPIs`),
+        - "schools": GeoPandas DataFrame (built when accessed, the `schools` are not modified),
+        - "students": GeoPandas DataFrame (built when accessed, the `students_lsoa` are not modified),
+        - "metrics": dictionary of "timers" and "counters" (if `instrument`)
     """
-    ## closest school variables
-    schools_temp = copy.deepcopy(schools)
-    lsoa_temp = copy.deepcopy(students_lsoa)
-    previous_str = None
+    metrics = new_metrics() if instrument else None
+    ## distances between the schools and the LSOAs
+    with phase(metrics, "distances"):
+        if dist_matrix is None:
+            dist_matrix = build_distance_matrix(schools, students_lsoa)
+            count(metrics, "distance_evaluations", dist_matrix.size)
+    ## order of the schools by distance starting from the initial school
+    with phase(metrics, "ordering"):
+        schools_ordered = order_schools(schools, initial_school)
+    school_strs = schools["establishment_name"].to_numpy()
+    rows = {school_str: i for i, school_str in enumerate(school_strs)}
 
-    ## Find order of schools by dist starting from initial school
-    current_str = initial_school
-    n_next_schools = len(schools_temp.index)
-    schools_ordered = []
-    while n_next_schools > 0:
-        # update the ordered list
-        schools_ordered.append(current_str)
-        # find distances
-        current_school = schools[schools["establishment_name"] == current_str]
-        i_cSchool = current_school.index[0]
-        schools_temp = schools_temp.drop(i_cSchool)
-        ## if there is another school
-        if len(schools_temp.index) > 0: 
-            dists = schools.at[current_school.index[0],"geometry"].distance(schools_temp["geometry"])
-            # find the next closest df (school)
-            i_nSchool = dists[dists == min(dists)].index[0]
-            next_school = schools.loc[[i_nSchool]]
-            next_school_str = next_school.at[i_nSchool, "establishment_name"]
-            # update current str 
-            current_str = next_school_str
-        n_next_schools = len(schools_temp.index)
-        
+    ## assign LSOAs to schools
+    outcome = assign_LSOAs_by_school(
+        dist_matrix,
+        students_lsoa["5_est"].to_numpy(),
+        [target_PAN[school_str] for school_str in school_strs],
+        [rows[school_str] for school_str in schools_ordered],
+        students_total=schools["students_total"].to_numpy(),
+        unassigned=(students_lsoa["school"] == "").to_numpy(),
+        observer=step_observer(metrics, observer),
+        metrics=metrics,
+    )
+
+    ## outcome of the model (the DataFrames are built when accessed)
+    with phase(metrics, "bookkeeping"):
+        result = assignment_result(
+            schools, students_lsoa, outcome["school"], outcome["students_total"], dist_matrix, outcome.get("external"),
+            target=[target_PAN[school_str] for school_str in school_strs],
+        )
+    if instrument: result["metrics"] = metrics
+    return result
 
-    ## Extract the PANs for the input year
-    saturated_PAN = {}
-    for school_str in target_PAN:
-        saturated_PAN[school_str] = False
-    ## while any LSOA has not been adressed a school
-    while len(students_lsoa[students_lsoa["school"] == ""].index) > 0:
-        # Loop through the ordered schools
-        for current_str in schools_ordered:
-            ## initial school
-            current_school = schools[schools["establishment_name"] == current_str]
-            i_cSchool = current_school.index[0]
-
-            ## Accumilate students from the closest LSOAs
-            if saturated_PAN[current_str] == False:
-                # find LSOA without an assigned establishment_name
-                lsoa_temp = students_lsoa[students_lsoa["school"] == ""]
-                dists_school_LSOAs = current_school.at[i_cSchool, "geometry"].distance(lsoa_temp["geometry"])
-                i_lsoa = dists_school_LSOAs[dists_school_LSOAs == min(dists_school_LSOAs)].index[0]
-                ## if adding the number of students in the LSOA will not lead to exceeding the PAN
-                if schools.at[i_cSchool, "students_total"] + students_lsoa.at[i_lsoa, "5_est"] < target_PAN[current_str]:
-                    schools.at[i_cSchool, "students_total"] += students_lsoa.at[i_lsoa, "5_est"]
-                    students_lsoa.at[i_lsoa, "school"] = current_str
-                ## if this is the last school with any availability. Add the students to it
-                elif schools.at[i_cSchool, "students_total"] + students_lsoa.at[i_lsoa, "5_est"] >= target_PAN[current_str] and list(saturated_PAN.values()).count(False) == 1:
-                    schools.at[i_cSchool, "students_total"] += students_lsoa.at[i_lsoa, "5_est"]
-                    students_lsoa.at[i_lsoa, "school"] = current_str
-                    saturated_PAN[current_str] = True
-                else:
-                    saturated_PAN[current_str] = True
-            
-            ## Accumilate to the student from the closest LSOA regardless of PAN, if all schools reached their PANs
-            if list(saturated_PAN.values()).count(False) == 0:
-                # find LSOA without an assigned establishment_name
-                lsoa_temp = students_lsoa[students_lsoa["school"] == ""]
-                dists_school_LSOAs = current_school.at[i_cSchool, "geometry"].distance(lsoa_temp["geometry"])
-                i_lsoa = dists_school_LSOAs[dists_school_LSOAs == min(dists_school_LSOAs)].index[0]
-                schools.at[i_cSchool, "students_total"] += students_lsoa.at[i_lsoa, "5_est"]
-                students_lsoa.at[i_lsoa, "school"] = current_str
-
-            ## if the school is saturated, skip it
-            if saturated_PAN[current_str] == True:
-                continue
-                
-        
-    return {
-        "schools": schools,
-        "students": students_lsoa,
-    }
 
 ### Model 1.2: optimise for LSOAs ignoring catchments
 def Optimise_PANs_LSOAs(
@@ -221,6 +913,9 @@ def Optimise_PANs_LSOAs(
         students_lsoa,
         PANs,
         PAN_year=2024,
+        dist_matrix=None,
+        instrument=False,
+        observer=None,
         ):
     """
     A function that identifies the catchement areas based on the proposed PANs. 
@@ -231,69 +926,61 @@ def Optimise_PANs_LSOAs(
     ----------
     `schools`: GeoPandas DataFrame
         School locations as points
-    `students_losa`: Geopandas DataFrame
-        LSOAs including an attribute for the number of students "est_5"
+    `students_lsoa`: GeoPandas DataFrame
+        LSOAs including an attribute for the number of students "5_est"
     `PANs`: Pandas DataFrame
         Planned PANs for each school
     `PAN_year`: int (default=2024)
         PAN year to extract the values from the `PANs` DataFrame
-    `initial_school`: str (default="Dorothy Stringer School")
-        The initial school in the optimisation loop
+    `dist_matrix`: NumPy array (default=None)
+        Distances between the schools and the LSOAs (see `build_distance_matrix`). Calculated if not provided
+    `instrument`: bool (default=False)
+        If True, the time of each phase and counters of the events are returned as "metrics" (see `instrumentation`)
+    `observer`: function (default=None)
+        Called after each step of the assignment as `observer(kind, school, lsoa, value, position)` (see `assign_from_queues`)
 
     Returns
     -------
-    Dictionary including:
-        - "schools": GeoPandas DataFrame,
-        - "students": GeoPandas DataFrame
+    AssignmentResult (dictionary) including:
+        - "school", "students_total", "distance" and "external": arrays of the outcome (see `AssignmentResult`),
+        - "KPIs": dictionary of arrays, KPIs of each school (computed when accessed, see `metrics.assignment_KPIs`),
+        - "schools": GeoPandas DataFrame (built when accessed, the `schools` are not modified),
+        - "students": GeoPandas DataFrame (built when accessed, the `students_lsoa` are not modified),
+        - "metrics": dictionary of "timers" and "counters" (if `instrument`)
     """
-    ## closest school variables
-    schools_temp = copy.deepcopy(schools)
-    lsoa_temp = copy.deepcopy(students_lsoa)
+    metrics = new_metrics() if instrument else None
+    ## distances between the schools and the LSOAs
+    with phase(metrics, "distances"):
+        if dist_matrix is None:
+            dist_matrix = build_distance_matrix(schools, students_lsoa)
+            count(metrics, "distance_evaluations", dist_matrix.size)
     ## Extract the PANs for the input year
-    target_PAN = {}
-    saturated_PAN = {}
-    for school_str in PANs["school"]:
-        target_PAN[school_str] = int(PANs[PANs["school"] == school_str][f"pan{PAN_year}"])
-        saturated_PAN[school_str] = False
-    # Loop through the LSOAs
-    for i_lsoa in students_lsoa.index:
-        ## keep looping unti the LSOA is assing a school
-        while students_lsoa.at[i_lsoa, "school"] == "":
-            ## current LSOA under analysis
-            current_lsoa = students_lsoa.iloc[[i_lsoa]]
-            ## Distance from this LSOA to all schools
-            dists_lsoa_schools = current_lsoa.at[i_lsoa, "geometry"].distance(schools["geometry"])
-            dists_set = sorted(set(dists_lsoa_schools))
-            ## Index of the closest school in the schools DataFrame
-            test_PAN_status = True
-            i_temp = 0
-            current_str = ""
-            while test_PAN_status == True and i_temp < len(saturated_PAN.values()):
-                i_cSchool = dists_lsoa_schools[dists_lsoa_schools == dists_set[i_temp]].index[0]
-                current_str = schools.at[i_cSchool, "establishment_name"]
-                if saturated_PAN[current_str] == True:
-                    i_temp += 1
-                    continue
-                else:
-                    test_PAN_status = False
-            ## Current school under analysis
-            current_school = schools.iloc[[i_cSchool]]
-            # current_str = current_school.at[i_cSchool, "establishment_name"]
-            
-            if saturated_PAN[current_str] == False:
-                ## if adding the number of students in the LSOA will not lead to exceeding the PAN
-                if schools.at[i_cSchool, "students_total"] + students_lsoa.at[i_lsoa, "5_est"] <= target_PAN[current_str]:
-                    current_school.at[i_cSchool, "students_total"] += students_lsoa.at[i_lsoa, "5_est"]
-                    schools.at[i_cSchool, "students_total"] += students_lsoa.at[i_lsoa, "5_est"]
-                    # schools.at[i_cSchool, "students_total"] += students.at[i_lsoa, "5_est"]
-                    students_lsoa.at[i_lsoa, "school"] = current_str
-                else:
-                    saturated_PAN[current_str] = True
-        
-    return {
-        "schools": schools,
-        "students": students_lsoa,
-    }
+    target_PAN = extract_PANs(PANs, PAN_year)
+    school_strs = schools["establishment_name"].to_numpy()
+
+    ## schools sorted by distance for each LSOA
+    with phase(metrics, "ordering"):
+        preferences = school_preferences(dist_matrix)
+
+    ## assign schools to LSOAs
+    with phase(metrics, "assignment"):
+        outcome = assign_schools_by_LSOA(
+            preferences,
+            students_lsoa["5_est"].to_numpy(),
+            [target_PAN[school_str] for school_str in school_strs],
+            students_total=schools["students_total"].to_numpy(),
+            unassigned=(students_lsoa["school"] == "").to_numpy(),
+            observer=step_observer(metrics, observer),
+        )
+
+    ## outcome of the model (the DataFrames are built when accessed)
+    with phase(metrics, "bookkeeping"):
+        result = assignment_result(
+            schools, students_lsoa, outcome["school"], outcome["students_total"], dist_matrix, outcome.get("external"),
+            target=[target_PAN[school_str] for school_str in school_strs],
+        )
+    if instrument: result["metrics"] = metrics
+    return result
 
 ### Model version 2.1: optimise for schools while consideting catchments
 def Optimise_PANsCatchment_Schools(
@@ -301,6 +988,12 @@ def Optimise_PANsCatchment_Schools(
         students_lsoa,
         target_PAN,
         initial_school="Dorothy Stringer School",
+        dist_matrix=None,
+        instrument=False,
+        observer=None,
+        refine=False,
+        max_iterations=None,
+        time_limit=None,
         ):
     """
     A function that identifies the catchement areas based on the proposed PANs. 
@@ -312,130 +1005,90 @@ def Optimise_PANsCatchment_Schools(
     ----------
     `schools`: GeoPandas DataFrame
         School locations as points
-    `students_losa`: GeoPandas DataFrame
-        LSOAs including an attribute for the number of students "est_5"
-    `PANs`: dict
-        Schools names as index and PAN as value
+    `students_lsoa`: GeoPandas DataFrame
+        LSOAs including an attribute for the number of students "5_est"
+    `target_PAN`: dict
+        School names as keys and PAN as value
     `initial_school`: str (default="Dorothy Stringer School")
         The initial school in the optimisation loop
+    `dist_matrix`: NumPy array (default=None)
+        Distances between the schools and the LSOAs (see `build_distance_matrix`). Calculated if not provided
+    `instrument`: bool (default=False)
+        If True, the time of each phase and counters of the events are returned as "metrics" (see `instrumentation`)
+    `observer`: function (default=None)
+        Called after each step of the assignment as `observer(kind, school, lsoa, value, position)` (see `assign_from_queues`)
+    `refine`: bool (default=False)
+        If True, the greedy assignment is refined by local search, moving and swapping LSOAs between schools (see `refine_result`)
+    `max_iterations`: int (default=None)
+        Maximum number of passes over the LSOAs of the refinement
+    `time_limit`: float (default=None)
+        Maximum time (s) of the refinement
 
     Returns
     -------
-    Dictionary including:
-        - "schools": GeoPandas DataFrame,
-        - "students": GeoPandas DataFrame
+    AssignmentResult (dictionary) including:
+        - "school", "students_total", "distance" and "external": arrays of the outcome (see `AssignmentResult`),
+        - "KPIs": dictionary of arrays, KPIs of each school (computed when accessed, see `metrics.assignment_KPIs`),
+        - "schools": GeoPandas DataFrame (built when accessed, the `schools` are not modified),
+        - "students": GeoPandas DataFrame (built when accessed, the `students_lsoa` are not modified),
+        - "refinement": dictionary with the improvement on the greedy assignment (if `refine`, see `refine_result`),
+        - "metrics": dictionary of "timers" and "counters" (if `instrument`)
     """
-    ## closest school variables
-    schools_temp = copy.deepcopy(schools)
-    lsoa_temp = copy.deepcopy(students_lsoa)
-    previous_str = None
-
-    ## Find order of schools by dist starting from initial school
-    current_str = initial_school
-    n_next_schools = len(schools_temp.index)
-    schools_ordered = []
-    schools_IDs = {}
-    while n_next_schools > 0:
-        # update the ordered list
-        schools_ordered.append(current_str)
-        # find distances
-        current_school = schools[schools["establishment_name"] == current_str]
-        i_cSchool = current_school.index[0]
-        schools_temp = schools_temp.drop(i_cSchool)
-        # update the IDs
-        schools_IDs[current_str] = (schools.at[i_cSchool, "catchment_ID"])
-        ## if there is another school
-        if len(schools_temp.index) > 0: 
-            dists = schools.at[current_school.index[0],"geometry"].distance(schools_temp["geometry"])
-            # find the next closest df (school)
-            i_nSchool = dists[dists == min(dists)].index[0]
-            next_school = schools.loc[[i_nSchool]]
-            next_school_str = next_school.at[i_nSchool, "establishment_name"]
-            # update current str 
-            current_str = next_school_str
-        n_next_schools = len(schools_temp.index)
-        
+    metrics = new_metrics() if instrument else None
+    ## distances between the schools and the LSOAs
+    with phase(metrics, "distances"):
+        if dist_matrix is None:
+            dist_matrix = build_distance_matrix(schools, students_lsoa)
+            count(metrics, "distance_evaluations", dist_matrix.size)
+    ## order of the schools by distance starting from the initial school
+    with phase(metrics, "ordering"):
+        schools_ordered = order_schools(schools, initial_school)
+    school_strs = schools["establishment_name"].to_numpy()
+    rows = {school_str: i for i, school_str in enumerate(school_strs)}
+    ## LSOAs within the catchment of each school
+    with phase(metrics, "candidates"):
+        in_catchment = catchment_matrix(schools, students_lsoa)
 
-    ## Extract the PANs for the input year
-    saturated_PAN = {}
-    for school_str in target_PAN:
-        saturated_PAN[school_str] = False
-    ## while any LSOA has not been adressed a school
-    while len(students_lsoa[students_lsoa["school"] == ""].index) > 0:
-        # Loop through the ordered schools
-        for current_str in schools_ordered:
-            ## initial school
-            current_school = schools[schools["establishment_name"] == current_str]
-            i_cSchool = current_school.index[0]
-            ID_cSchool = current_school.at[i_cSchool, "catchment_ID"]
-
-            ## Accumilate students from the closest LSOAs
-            if saturated_PAN[current_str] == False:
-                # find LSOAs without an assignment establishment_name and within the schools catchment
-                lsoa_in_catchment = students_lsoa[(students_lsoa["school"] == "") & (students_lsoa["catchment_ID"] == schools_IDs[current_str])]
-                if len(lsoa_in_catchment) > 0:
-                    lsoa_temp = lsoa_in_catchment
-                # else, if no LSOAs are within the catchment, find any LSOAs without an assigned establishment_name
-                else:
-                    lsoa_temp = students_lsoa[students_lsoa["school"] == ""]
+    ## assign LSOAs to schools
+    est = students_lsoa["5_est"].to_numpy()
+    outcome = assign_LSOAs_by_school(
+        dist_matrix,
+        est,
+        [target_PAN[school_str] for school_str in school_strs],
+        [rows[school_str] for school_str in schools_ordered],
+        students_total=schools["students_total"].to_numpy(),
+        unassigned=(students_lsoa["school"] == "").to_numpy(),
+        in_catchment=in_catchment,
+        skip_zero_PAN=True,
+        observer=step_observer(metrics, observer),
+        metrics=metrics,
+    )
 
-                ## find the distances between the selected LSOAs and the current school
-                dists_school_LSOAs = current_school.at[i_cSchool, "geometry"].distance(lsoa_temp["geometry"])
-                i_lsoa = dists_school_LSOAs[dists_school_LSOAs == min(dists_school_LSOAs)].index[0]
-                ## if adding the number of students in the LSOA will not lead to exceeding the PAN
-                if schools.at[i_cSchool, "students_total"] + students_lsoa.at[i_lsoa, "5_est"] < target_PAN[current_str]:
-                    schools.at[i_cSchool, "students_total"] += students_lsoa.at[i_lsoa, "5_est"]
-                    students_lsoa.at[i_lsoa, "school"] = current_str
-                    students_lsoa.at[i_lsoa, "catchment_ID_school"] = schools_IDs[current_str]
-                    students_lsoa.at[i_lsoa, "dist_to_school"] = min(dists_school_LSOAs)
-                    students_lsoa.at[i_lsoa, "distx5_est"] = min(dists_school_LSOAs) * students_lsoa.at[i_lsoa, "5_est"]
-                    students_lsoa.at[i_lsoa, "external"] = False
-                ## if this is the last school with any availability. Add the students to it
-                elif schools.at[i_cSchool, "students_total"] + students_lsoa.at[i_lsoa, "5_est"] >= target_PAN[current_str] and list(saturated_PAN.values()).count(False) == 1:
-                    schools.at[i_cSchool, "students_total"] += students_lsoa.at[i_lsoa, "5_est"]
-                    students_lsoa.at[i_lsoa, "school"] = current_str
-                    students_lsoa.at[i_lsoa, "catchment_ID_school"] = schools_IDs[current_str]
-                    students_lsoa.at[i_lsoa, "dist_to_school"] = min(dists_school_LSOAs)
-                    students_lsoa.at[i_lsoa, "distx5_est"] = min(dists_school_LSOAs) * students_lsoa.at[i_lsoa, "5_est"]
-                    students_lsoa.at[i_lsoa, "external"] = False
-                    saturated_PAN[current_str] = True
-                else:
-                    saturated_PAN[current_str] = True
-            
-            ## Accumilate to the student from the closest LSOA regardless of PAN, if all schools reached their PANs
-            if list(saturated_PAN.values()).count(False) == 0 \
-            and len(students_lsoa[students_lsoa["school"] == ""].index) > 0\
-            and target_PAN[current_str] > 0:
-                # find LSOA without an assigned establishment_name
-                lsoa_temp = students_lsoa[students_lsoa["school"] == ""]
-                dists_school_LSOAs = current_school.at[i_cSchool, "geometry"].distance(lsoa_temp["geometry"])
-                i_lsoa = dists_school_LSOAs[dists_school_LSOAs == min(dists_school_LSOAs)].index[0]
-                schools.at[i_cSchool, "students_total"] += students_lsoa.at[i_lsoa, "5_est"]
-                students_lsoa.at[i_lsoa, "school"] = current_str
-                students_lsoa.at[i_lsoa, "catchment_ID_school"] = schools_IDs[current_str]
-                students_lsoa.at[i_lsoa, "dist_to_school"] = min(dists_school_LSOAs)
-                students_lsoa.at[i_lsoa, "distx5_est"] = min(dists_school_LSOAs) * students_lsoa.at[i_lsoa, "5_est"]
-                students_lsoa.at[i_lsoa, "external"] = True
-
-            ## if the school is saturated, skip it
-            if saturated_PAN[current_str] == True:
-                continue
-    
-    ## generate a school
-        
-    return {
-        "schools": schools,
-        "students": students_lsoa,
-    }
+    ## outcome of the model (the DataFrames are built when accessed)
+    with phase(metrics, "bookkeeping"):
+        result = assignment_result(
+            schools, students_lsoa, outcome["school"], outcome["students_total"], dist_matrix, outcome.get("external"),
+            target=[target_PAN[school_str] for school_str in school_strs],
+        )
+    ## optional refinement of the greedy assignment
+    if refine:
+        with phase(metrics, "refinement"):
+            result = refine_result(result, dist_matrix, in_catchment=in_catchment, max_iterations=max_iterations, time_limit=time_limit)
+        count(metrics, "refinement_moves", result["refinement"]["moves"])
+        count(metrics, "refinement_swaps", result["refinement"]["swaps"])
+    if instrument: result["metrics"] = metrics
+    return result
 
 
 ### Model 2.2: optimise for LSOAs while consideting catchments
-## Work in progress, an error leading assigning more students that actually available (sum actual students is less than sum model assigned students)
 def Optimise_PANsCatchment_LSOAs(
         schools,
         students_lsoa,
         PANs,
         PAN_year=2024,
+        dist_matrix=None,
+        instrument=False,
+        observer=None,
         ):
     """
     A function that identifies the catchement areas based on the proposed PANs. 
@@ -446,219 +1099,1109 @@ def Optimise_PANsCatchment_LSOAs(
     ----------
     `schools`: GeoPandas DataFrame
         School locations as points
-    `students_losa`: Geopandas DataFrame
-        LSOAs including an attribute for the number of students "est_5"
+    `students_lsoa`: GeoPandas DataFrame
+        LSOAs including an attribute for the number of students "5_est"
     `PANs`: Pandas DataFrame
         Planned PANs for each school
     `PAN_year`: int (default=2024)
         PAN year to extract the values from the `PANs` DataFrame
-    `initial_school`: str (default="Dorothy Stringer School")
-        The initial school in the optimisation loop
+    `dist_matrix`: NumPy array (default=None)
+        Distances between the schools and the LSOAs (see `build_distance_matrix`). Calculated if not provided
+    `instrument`: bool (default=False)
+        If True, the time of each phase and counters of the events are returned as "metrics" (see `instrumentation`)
+    `observer`: function (default=None)
+        Called after each step of the assignment as `observer(kind, school, lsoa, value, position)` (see `assign_from_queues`)
 
     Returns
     -------
-    Dictionary including:
-        - "schools": GeoPandas DataFrame,
-        - "students": GeoPandas DataFrame
+    AssignmentResult (dictionary) including:
+        - "school", "students_total", "distance" and "external": arrays of the outcome (see `AssignmentResult`),
+        - "KPIs": dictionary of arrays, KPIs of each school (computed when accessed, see `metrics.assignment_KPIs`),
+        - "schools": GeoPandas DataFrame (built when accessed, the `schools` are not modified),
+        - "students": GeoPandas DataFrame (built when accessed, the `students_lsoa` are not modified),
+        - "metrics": dictionary of "timers" and "counters" (if `instrument`)
     """
+    metrics = new_metrics() if instrument else None
+    ## distances between the schools and the LSOAs
+    with phase(metrics, "distances"):
+        if dist_matrix is None:
+            dist_matrix = build_distance_matrix(schools, students_lsoa)
+            count(metrics, "distance_evaluations", dist_matrix.size)
     ## Extract the PANs for the input year
-    target_PAN = {}
-    saturated_PAN = {}
-    for school_str in PANs["school"]:
-        target_PAN[school_str] = int(PANs[PANs["school"] == school_str][f"pan{PAN_year}"])
-        saturated_PAN[school_str] = False
-    # Loop through the LSOAs
-    for i_lsoa in students_lsoa.index:
-        ## keep looping unti the LSOA is assing a school
-        while students_lsoa.at[i_lsoa, "school"] == "":
-            ## current LSOA under analysis
-            current_lsoa = students_lsoa.iloc[[i_lsoa]]
-            ## current schools in catchment
-            schools_in_catchment = schools[schools["catchment_ID"] == current_lsoa.at[i_lsoa, "catchment_ID"]]
-            strs_in_catchment = schools_in_catchment["establishment_name"]
-            saturated_in_catchment = [saturated_PAN[str_temp] for str_temp in strs_in_catchment]
-            ## if all of the schools in the catchment are saturated with students, consider all the schools
-            saturated_temp = []
-            if saturated_in_catchment.count(False) == 0:
-                schools_temp = schools
-                saturated_temp = saturated_PAN.values()
-            ## else, if any of the schools in catchment is not saturated with students, only consider the schools in the catchment
+    target_PAN = extract_PANs(PANs, PAN_year)
+    school_strs = schools["establishment_name"].to_numpy()
+
+    ## schools sorted by distance for each LSOA, and the schools within the catchment of each LSOA
+    with phase(metrics, "ordering"):
+        preferences = school_preferences(dist_matrix)
+    with phase(metrics, "candidates"):
+        in_catchment = catchment_matrix(schools, students_lsoa)
+
+    ## assign schools to LSOAs
+    with phase(metrics, "assignment"):
+        outcome = assign_schools_by_LSOA(
+            preferences,
+            students_lsoa["5_est"].to_numpy(),
+            [target_PAN[school_str] for school_str in school_strs],
+            students_total=schools["students_total"].to_numpy(),
+            unassigned=(students_lsoa["school"] == "").to_numpy(),
+            in_catchment=in_catchment,
+            observer=step_observer(metrics, observer),
+        )
+
+    ## outcome of the model (the DataFrames are built when accessed)
+    with phase(metrics, "bookkeeping"):
+        result = assignment_result(
+            schools, students_lsoa, outcome["school"], outcome["students_total"], dist_matrix, outcome.get("external"),
+            target=[target_PAN[school_str] for school_str in school_strs],
+        )
+    if instrument: result["metrics"] = metrics
+    return result
+
+### Model version 3: exact capacity-constrained assignment (min-cost flow)
+## Flows of the assignment as arrays of the non-zero flows (school, LSOA and number of students of each flow)
+def sparse_flows(i_schools, i_lsoas, students):
+    kept = students > 0
+    return {"school": i_schools[kept].astype(np.int64), "lsoa": i_lsoas[kept].astype(np.int64), "students": students[kept].astype(np.int64)}
+
+def min_cost_assignment(cost, supply, capacity, n_candidates=8):
+    """
+    A function that finds the assignment of students to schools with the least total cost,
+    without exceeding the capacity of the schools (the transportation problem, a minimum-cost flow).
+    With SciPy, the flow is found by cost scaling over the arcs between each LSOA and its `n_candidates` cheapest schools:
+    the costs are rounded to a grid four times finer at each scale, and at each scale the students left are moved
+    along the shortest paths of the residual network (Dijkstra on the reduced costs, then a maximum flow over the arcs of the shortest paths,
+    the primal-dual method), starting from the flows and the potentials of the previous scale. After each scale, the reduced costs of the other arcs
+    are checked against the potentials, a block of LSOAs at a time, and the arcs with a negative reduced cost are added, until there are none left
+    at the costs themselves, so the solution is optimal over all the schools (see `benchmarks.flow_benchmark` for the time at national scale).
+    Without SciPy, see `shortest_paths_assignment` (for city-sized instances).
+    The students exceeding the total capacity are assigned to an overflow school, which is more costly than any reassignment.
+
+    Parameters
+    ----------
+    `cost`: NumPy array
+        Cost of assigning a student of each LSOA to each school (schools x LSOAs)
+    `supply`: NumPy array
+        Number of students in each LSOA
+    `capacity`: NumPy array
+        Number of places in each school
+    `n_candidates`: int (default=8)
+        Number of cheapest schools of each LSOA in the first arcs (and most arcs added to an LSOA at each check)
+
+    Returns
+    -------
+    Dictionary including:
+        - "flows": dictionary of arrays, "school", "lsoa" and "students" of the non-zero flows of the students assigned to the schools,
+        - "overflow": NumPy array, number of students of each LSOA beyond the capacity of the schools,
+        - "cost": float, total cost of the students assigned to the schools,
+        - "rounds": int, number of solves at the costs themselves (or "augmentations" without SciPy, see `shortest_paths_assignment`),
+        - "phases": int, number of shortest paths and maximum flows over all the scales
+    """
+    try:
+        from scipy.sparse import csr_array
+        from scipy.sparse.csgraph import dijkstra, maximum_flow, connected_components, breadth_first_order
+    except ImportError:
+        return shortest_paths_assignment(cost, supply, capacity)
+    supply = np.asarray(supply, dtype=np.int64)
+    capacity = np.maximum(np.asarray(capacity, dtype=np.int64), 0)
+    n_schools, n_lsoas = cost.shape
+    # LSOAs of each block of the cost matrix (bounds the memory of the checks)
+    block = max(1, (1 << 22) // max(n_schools, 1))
+    ## overflow (a school after the others, with room for every student): the cost of the cheapest school plus more than any saving of a reassignment
+    cost_min, cost_max = float(cost.min()), float(cost.max())
+    overflow_cost = cost.min(axis=0) + 2 * (cost_max - cost_min) + 1
+    tolerance = 1e-9 * max(1.0, abs(cost_min), abs(cost_max))
+    total = int(supply.sum())
+    places = np.append(capacity, total)
+    ## nodes: the LSOAs, the schools and the overflow (from `school_node`), the sink of the places,
+    # and the source and the target of the maximum flows
+    school_node = n_lsoas
+    sink, source, target = n_lsoas + n_schools + 1, n_lsoas + n_schools + 2, n_lsoas + n_schools + 3
+    n_nodes = target + 1
+    schools = school_node + np.arange(n_schools + 1)
+    sink_arcs = np.full(n_schools + 1, sink)
+
+    ## first arcs: the cheapest schools of each LSOA, and the overflow
+    k = min(n_candidates, n_schools)
+    candidates = np.full((n_lsoas, k + 1), n_schools, dtype=np.int64)
+    # cheapest cost of each LSOA to the schools without an arc, less the potentials of the schools at the check that found it (see `price`)
+    floor = np.full(n_lsoas, np.inf)
+    for start in range(0, n_lsoas, block):
+        costs = cost[:, start:start + block].T
+        if k < n_schools:
+            cheapest = np.argpartition(costs, k, axis=1)[:, :k + 1]
+            floor[start:start + len(costs)] = np.take_along_axis(costs, cheapest[:, k:], axis=1)[:, 0]
+            cheapest = cheapest[:, :k]
+        else:
+            cheapest = np.arange(n_schools)
+        candidates[start:start + len(costs), :k] = cheapest
+    # potentials of the schools at each check, and the check of the floor of each LSOA
+    snapshots = [np.zeros(n_schools)]
+    snapshot = np.zeros(n_lsoas, dtype=np.int64)
+    arc_lsoa = np.repeat(np.arange(n_lsoas), k + 1)
+    arc_school = candidates.ravel()
+    arc_cost = np.where(arc_school < n_schools, cost[np.minimum(arc_school, n_schools - 1), arc_lsoa], overflow_cost[arc_lsoa])
+
+    ## first flows: the LSOAs that fit in their cheapest school, in order of cost
+    cheapest = np.argmin(arc_cost.reshape(n_lsoas, k + 1), axis=1) + np.arange(n_lsoas) * (k + 1)
+    order = np.lexsort((arc_cost[cheapest], arc_school[cheapest]))
+    best = arc_school[cheapest[order]]
+    before = np.cumsum(supply[order]) - supply[order]
+    fits = before - before[np.searchsorted(best, best)] + supply[order] <= places[best]
+    flow = np.zeros(len(arc_lsoa), dtype=np.int64)
+    flow[cheapest[order[fits]]] = supply[order[fits]]
+    # students of each school sent to the sink (less than the students of the school while students are moved away)
+    out = np.bincount(arc_school, weights=flow, minlength=n_schools + 1).astype(np.int64)
+    # potentials of the nodes (the reduced cost of an arc is its cost plus the potential of its tail minus the potential of its head)
+    potentials = np.zeros(n_nodes)
+
+    ## potentials of the schools with no reduced cost on the arcs with students at the new costs (a spanning forest of these arcs,
+    # each tree from the potential of a node of it), within the potential of the sink for the schools with places left or taken
+    def tighten(costs_of_arcs):
+        root = n_nodes
+        moved_arcs = np.flatnonzero(flow > 0)
+        tied = np.flatnonzero((out > 0) & (out < places))
+        tails = np.concatenate([arc_lsoa[moved_arcs], schools[tied]])
+        heads = np.concatenate([school_node + arc_school[moved_arcs], sink_arcs[tied]])
+        # kind of each edge: the arc plus one, -1 to the sink and -2 from the root
+        kinds = np.concatenate([moved_arcs + 1, np.full(len(tied), -1)])
+        _, labels = connected_components(csr_array((np.ones(len(tails)), (tails, heads)), shape=(n_nodes, n_nodes)), directed=False)
+        _, first = np.unique(labels, return_index=True)
+        first = first[labels[first] != labels[sink]]
+        tails = np.concatenate([tails, [root], np.full(len(first), root)])
+        heads = np.concatenate([heads, [sink], first])
+        kinds = np.concatenate([kinds, np.full(len(first) + 1, -2)])
+        tree = csr_array((kinds.astype(np.float64), (tails, heads)), shape=(n_nodes + 1, n_nodes + 1))
+        tree = (tree + tree.T).tocsr()
+        _, predecessors = breadth_first_order(tree, root, directed=False, return_predecessors=True)
+        ## potential of each node: the sum of the steps from the root (the cost of an arc to a school, less to an LSOA)
+        nodes = np.flatnonzero(predecessors >= 0)
+        kinds = tree[predecessors[nodes], nodes].astype(np.int64)
+        arcs = np.maximum(kinds - 1, 0)
+        steps = np.zeros(n_nodes + 1)
+        steps[nodes] = np.where(
+            kinds > 0, np.where(nodes >= school_node, costs_of_arcs[arcs], -costs_of_arcs[arcs]), np.where(kinds == -2, potentials[np.minimum(nodes, n_nodes - 1)], 0.0)
+        )
+        pointers = np.full(n_nodes + 1, root)
+        pointers[nodes] = predecessors[nodes]
+        while (pointers != root).any():
+            steps += steps[pointers]
+            pointers = pointers[pointers]
+        potentials[schools] = np.clip(steps[schools], np.where(out < places, steps[sink], -np.inf), np.where(out > 0, steps[sink], np.inf))
+
+    ## the students left are moved along the shortest paths of the residual network (primal-dual phases)
+    def solve(costs_of_arcs, bound):
+        tighten(costs_of_arcs)
+        ## the LSOAs take the potential of their cheapest arc, and the students on their other arcs are assigned again
+        lsoa_potentials = np.full(n_lsoas, -np.inf)
+        np.maximum.at(lsoa_potentials, arc_lsoa, potentials[school_node + arc_school] - costs_of_arcs)
+        potentials[:n_lsoas] = lsoa_potentials
+        flow[costs_of_arcs + potentials[arc_lsoa] - potentials[school_node + arc_school] > tolerance] = 0
+        n_phases = 0
+        while True:
+            inflow = np.bincount(arc_school, weights=flow, minlength=n_schools + 1).astype(np.int64)
+            excess = np.append(supply - np.bincount(arc_lsoa, weights=flow, minlength=n_lsoas).astype(np.int64), out.sum() - total)
+            if not (excess > 0).any(): break
+            n_phases += 1
+            ## residual arcs with a reduced cost below the bound: from the LSOAs to their schools, back from the schools (students to move),
+            # from the schools to the sink (places left) and back (places taken)
+            reduced = costs_of_arcs + potentials[arc_lsoa] - potentials[school_node + arc_school]
+            near = np.flatnonzero(reduced < bound)
+            moved_arcs = np.flatnonzero(flow > 0)
+            school_reduced = potentials[schools] - potentials[sink]
+            spare, taken = np.flatnonzero(out < places), np.flatnonzero(out > 0)
+            tails = np.concatenate([arc_lsoa[near], school_node + arc_school[moved_arcs], schools[spare], sink_arcs[taken]])
+            heads = np.concatenate([school_node + arc_school[near], arc_lsoa[moved_arcs], sink_arcs[spare], schools[taken]])
+            residual = np.concatenate([reduced[near], -reduced[moved_arcs], school_reduced[spare], -school_reduced[taken]])
+            capacities = np.concatenate([np.full(len(near), min(total, np.iinfo(np.int32).max)), flow[moved_arcs], (places - out)[spare], out[taken]])
+            sources = np.flatnonzero(excess > 0)
+            source_nodes = np.where(sources == n_lsoas, sink, sources)
+            deficit = np.append(out - inflow, -excess[-1])
+            targets = np.flatnonzero(deficit > 0)
+            target_nodes = np.where(targets == n_schools + 1, sink, school_node + targets)
+            ## shortest paths from the nodes with students left, or to the nodes missing students if they are fewer
+            # (Dijkstra, the reduced costs of the residual arcs are not negative), up to the bound (the reduced costs of the other arcs stay not negative)
+            forward = len(sources) > len(targets)
+            if forward:
+                graph = csr_array((np.maximum(residual, 0), (tails, heads)), shape=(n_nodes, n_nodes))
+                distances = np.minimum(dijkstra(graph, indices=source_nodes, min_only=True), bound)
             else:
-                schools_temp = schools_in_catchment
-                saturated_temp = saturated_in_catchment
-            
-            print(saturated_temp)
-
-            ## Distance from this LSOA to all schools
-            dists_lsoa_schools = current_lsoa.at[i_lsoa, "geometry"].distance(schools_temp["geometry"])
-            dists_set = sorted(set(dists_lsoa_schools))
-            ## Index of the closest school in the schools DataFrame
-            test_PAN_status = True
-            i_temp = 0
-            current_str = ""
-            while test_PAN_status == True and i_temp < len(saturated_temp):
-                i_cSchool = dists_lsoa_schools[dists_lsoa_schools == dists_set[i_temp]].index[0]
-                current_str = schools_temp.at[i_cSchool, "establishment_name"]
-                if saturated_PAN[current_str] == True:
-                    i_temp += 1
-                    continue
-                else:
-                    test_PAN_status = False
-            ## Current school under analysis
-            current_school = schools.iloc[[i_cSchool]]
-            # current_str = current_school.at[i_cSchool, "establishment_name"]
-            
-            if saturated_PAN[current_str] == False:
-                ## if adding the number of students in the LSOA will not lead to exceeding the PAN
-                if schools_temp.at[i_cSchool, "students_total"] + students_lsoa.at[i_lsoa, "5_est"] <= target_PAN[current_str]:
-                    current_school.at[i_cSchool, "students_total"] += students_lsoa.at[i_lsoa, "5_est"]
-                    schools_temp.at[i_cSchool, "students_total"] += students_lsoa.at[i_lsoa, "5_est"]
-                    schools.at[i_cSchool, "students_total"] += students_lsoa.at[i_lsoa, "5_est"]
-                    # schools.at[i_cSchool, "students_total"] += students.at[i_lsoa, "5_est"]
-                    students_lsoa.at[i_lsoa, "school"] = current_str
-                else:
-                    saturated_PAN[current_str] = True
-            if list(saturated_PAN.values()).count(False) == 0: break
-        
+                graph = csr_array((np.maximum(residual, 0), (heads, tails)), shape=(n_nodes, n_nodes))
+                distances = -np.minimum(dijkstra(graph, indices=target_nodes, min_only=True), bound)
+            potentials[:] += distances
+            ## maximum flow over the arcs of the shortest paths, from the nodes with students left to the nodes missing students
+            # (a wider bound if no shortest path is within it)
+            admissible = (residual + distances[tails] - distances[heads] <= tolerance) & (np.abs(distances[heads if forward else tails]) < bound)
+            network = csr_array(
+                (np.concatenate([capacities[admissible], excess[sources], deficit[targets]]).astype(np.int32),
+                 (np.concatenate([tails[admissible], np.full(len(sources), source), target_nodes]),
+                  np.concatenate([heads[admissible], source_nodes, np.full(len(targets), target)]))),
+                shape=(n_nodes, n_nodes),
+            )
+            moved = maximum_flow(network, source, target, method="dinic")
+            if moved.flow_value == 0:
+                bound *= 4
+                continue
+            changed = np.zeros(len(arc_lsoa), dtype=bool)
+            changed[near[admissible[:len(near)]]] = True
+            changed[moved_arcs[admissible[len(near):len(near) + len(moved_arcs)]]] = True
+            changed = np.flatnonzero(changed)
+            flow[changed] += moved.flow[arc_lsoa[changed], school_node + arc_school[changed]]
+            out[:] += moved.flow[schools, sink_arcs]
+        return n_phases
+
+    ## arcs with a negative reduced cost (beyond the threshold), a block of LSOAs at a time
+    def price(threshold):
+        nonlocal arc_lsoa, arc_school, arc_cost, flow
+        school_potentials = potentials[school_node:school_node + n_schools]
+        # the LSOAs whose floor could have fallen below their potential since it was found
+        shifts = np.array([(school_potentials - old).max() for old in snapshots])
+        snapshots.append(school_potentials.copy())
+        checked = floor - shifts[snapshot] + potentials[:n_lsoas] < -threshold
+        # the blocks with many LSOAs to check are checked whole (the columns of a block are cheaper to read together)
+        blocks = np.add.reduceat(checked, np.arange(0, n_lsoas, block))
+        checked |= np.repeat(blocks * 8 > block, block)[:n_lsoas]
+        checked = np.flatnonzero(checked)
+        snapshot[checked] = len(snapshots) - 1
+        # the arcs of the LSOAs to check, in the order of the LSOAs
+        at_lsoa = np.full(n_lsoas, -1)
+        at_lsoa[checked] = np.arange(len(checked))
+        existing = np.flatnonzero((at_lsoa[arc_lsoa] >= 0) & (arc_school < n_schools))
+        existing = existing[np.argsort(at_lsoa[arc_lsoa[existing]], kind="stable")]
+        existing_at = at_lsoa[arc_lsoa[existing]]
+        new_schools, new_lsoas = [], []
+        for start, stop in zip(*np.searchsorted(checked, [np.arange(0, n_lsoas, block), np.arange(block, n_lsoas + block, block)])):
+            if start == stop: continue
+            i_lsoas = checked[start:stop]
+            columns = cost[:, i_lsoas[0]:i_lsoas[-1] + 1] if i_lsoas[-1] - i_lsoas[0] == stop - start - 1 else cost[:, i_lsoas]
+            reduced = columns - school_potentials[:, np.newaxis]
+            at = slice(*np.searchsorted(existing_at, [start, stop]))
+            reduced[arc_school[existing[at]], existing_at[at] - start] = np.inf
+            lowest = reduced.min(axis=0)
+            violated = np.flatnonzero(lowest + potentials[i_lsoas] < -threshold)
+            if len(violated):
+                # the most negative arcs of each LSOA (at most `n_candidates` each time), and the floor of the others
+                rest = reduced[:, violated]
+                most = np.argpartition(rest, k, axis=0)[:k + 1] if k < n_schools else np.broadcast_to(np.arange(n_schools)[:, np.newaxis], rest.shape)
+                values = np.take_along_axis(rest, most, axis=0)
+                added = values[:k] + potentials[i_lsoas[violated]] < -threshold
+                i, l = np.nonzero(added)
+                new_schools.append(most[i, l])
+                new_lsoas.append(i_lsoas[violated[l]])
+                lowest[violated] = np.where(added.all(axis=0), values[k] if k < n_schools else np.inf, values[:k].min(axis=0, where=~added, initial=np.inf))
+            floor[i_lsoas] = lowest
+        if not new_lsoas: return 0
+        new_schools, new_lsoas = np.concatenate(new_schools), np.concatenate(new_lsoas)
+        arc_lsoa = np.concatenate([arc_lsoa, new_lsoas])
+        arc_school = np.concatenate([arc_school, new_schools])
+        arc_cost = np.concatenate([arc_cost, cost[new_schools, new_lsoas]])
+        flow = np.concatenate([flow, np.zeros(len(new_lsoas), dtype=np.int64)])
+        return len(new_lsoas)
+
+    ## cost scaling: the costs rounded to a grid four times finer at each scale (the flows of a scale only move a little at the next),
+    # down to a grid finer than the tolerance, then the costs themselves until no other arc has a negative reduced cost
+    grid = 2.0 ** np.floor(np.log2(max(cost_max - cost_min, tolerance) / 64))
+    phases = 0
+    while grid > tolerance / 4:
+        phases += solve(np.round(arc_cost / grid) * grid, 16 * grid)
+        price(grid + tolerance)
+        grid /= 4
+    rounds = 0
+    while True:
+        rounds += 1
+        phases += solve(arc_cost, 64 * grid)
+        if price(tolerance) == 0: break
+
+    to_schools = arc_school < n_schools
+    flows = sparse_flows(arc_school[to_schools], arc_lsoa[to_schools], flow[to_schools])
+    return {
+        "flows": flows,
+        "overflow": np.bincount(arc_lsoa[~to_schools], weights=flow[~to_schools], minlength=n_lsoas).astype(np.int64),
+        "cost": float((flows["students"] * cost[flows["school"], flows["lsoa"]]).sum()),
+        "rounds": rounds,
+        "phases": phases,
+    }
+
+## Assignment with the least total cost by successive shortest paths in NumPy (see `min_cost_assignment`, used without SciPy)
+def shortest_paths_assignment(cost, supply, capacity):
+    """
+    A function that finds the assignment of students to schools with the least total cost,
+    without exceeding the capacity of the schools (minimum-cost flow by successive shortest paths).
+    The LSOAs are added one at a time, and the students are routed through the residual graph of the schools:
+    moving students of an LSOA from a school to another has the cost difference between the two schools.
+    The students exceeding the total capacity are assigned to an overflow school, which is more costly than any reassignment.
+    The flows are kept in a dense (schools x LSOAs) array, and each shortest path is a dense Dijkstra over the schools, for city-sized instances.
+
+    Parameters
+    ----------
+    `cost`: NumPy array
+        Cost of assigning a student of each LSOA to each school (schools x LSOAs)
+    `supply`: NumPy array
+        Number of students in each LSOA
+    `capacity`: NumPy array
+        Number of places in each school
+
+    Returns
+    -------
+    Dictionary including:
+        - "flows": dictionary of arrays, "school", "lsoa" and "students" of the non-zero flows of the students assigned to the schools,
+        - "overflow": NumPy array, number of students of each LSOA beyond the capacity of the schools,
+        - "cost": float, total cost of the students assigned to the schools,
+        - "augmentations": int, number of shortest paths the students were moved along
+    """
+    cost = np.asarray(cost, dtype=float)
+    supply = np.asarray(supply, dtype=np.int64)
+    n_schools, n_lsoas = cost.shape
+    ## overflow node (last row): the cost of the nearest school plus more than any saving of a reassignment
+    penalty = 2 * (cost.max() - cost.min()) + 1
+    cost = np.vstack([cost, cost.min(axis=0) + penalty])
+    n_nodes = n_schools + 1
+    spare = np.append(np.maximum(np.asarray(capacity, dtype=np.int64), 0), supply.sum())
+    flows = np.zeros((n_nodes, n_lsoas), dtype=np.int64)
+    ## cheapest move of students between each pair of schools, and the LSOA of the move
+    moves = np.full((n_nodes, n_nodes), np.inf)
+    move_lsoa = np.full((n_nodes, n_nodes), -1, dtype=np.int64)
+    potentials = np.zeros(n_nodes)
+    nodes = np.arange(n_nodes)
+    n_augmentations = 0
+
+    ## recompute the moves out of a school (after an LSOA has left it)
+    def update_moves(s):
+        i_lsoas = np.flatnonzero(flows[s] > 0)
+        if len(i_lsoas) == 0:
+            moves[s] = np.inf
+            move_lsoa[s] = -1
+            return
+        diffs = cost[:, i_lsoas] - cost[s, i_lsoas]
+        best = np.argmin(diffs, axis=1)
+        moves[s] = diffs[nodes, best]
+        move_lsoa[s] = i_lsoas[best]
+        moves[s, s] = np.inf
+
+    ## add the moves of an LSOA that has joined a school
+    def add_moves(s, i_lsoa):
+        diffs = cost[:, i_lsoa] - cost[s, i_lsoa]
+        better = diffs < moves[s]
+        better[s] = False
+        moves[s, better] = diffs[better]
+        move_lsoa[s, better] = i_lsoa
+
+    for i_lsoa in range(n_lsoas):
+        remaining = supply[i_lsoa]
+        while remaining > 0:
+            ## shortest path (Dijkstra on reduced costs) to the nearest school with spare places
+            dists = cost[:, i_lsoa] + potentials
+            previous = np.full(n_nodes, -1, dtype=np.int64)
+            visited = np.zeros(n_nodes, dtype=bool)
+            while True:
+                s = int(np.argmin(np.where(visited, np.inf, dists)))
+                visited[s] = True
+                if spare[s] > 0: break
+                relaxed = dists[s] + moves[s] + potentials - potentials[s]
+                better = (relaxed < dists) & ~visited
+                dists[better] = relaxed[better]
+                previous[better] = s
+            target = s
+            path = [target]
+            while previous[path[-1]] >= 0:
+                path.append(previous[path[-1]])
+            path.reverse()
+            steps = [(a, b, move_lsoa[a, b]) for a, b in zip(path[:-1], path[1:])]
+            ## largest number of students that can be moved along the path
+            delta = min(remaining, spare[target])
+            for a, b, i_move in steps:
+                delta = min(delta, flows[a, i_move])
+            ## move the students
+            flows[path[0], i_lsoa] += delta
+            for a, b, i_move in steps:
+                flows[a, i_move] -= delta
+                flows[b, i_move] += delta
+            spare[target] -= delta
+            remaining -= delta
+            n_augmentations += 1
+            add_moves(path[0], i_lsoa)
+            for a, b, i_move in steps:
+                if flows[a, i_move] == 0: update_moves(a)
+                add_moves(b, i_move)
+            ## keep the reduced costs non-negative
+            potentials -= np.minimum(dists, dists[target])
+
+    i_schools, i_lsoas = np.nonzero(flows[:n_schools])
+    return {
+        "flows": sparse_flows(i_schools, i_lsoas, flows[i_schools, i_lsoas]),
+        "overflow": flows[n_schools],
+        "cost": float((flows[:n_schools] * cost[:n_schools]).sum()),
+        "augmentations": n_augmentations,
+    }
+
+def Optimise_PANs_Flow(
+        schools,
+        students_lsoa,
+        target_PAN,
+        catchment_penalty=None,
+        dist_matrix=None,
+        instrument=False,
+        ):
+    """
+    A function that identifies the catchement areas based on the proposed PANs. 
+    Assigns the LSOAs to schools with the least total distance travelled by the students, without exceeding the PANs
+    (instead of the greedy loops of models 1 and 2). 
+    The students of an LSOA may be split between schools in the optimal solution: each LSOA is assigned to the school with most of its students.
+    If the PANs are not enough for all the students, the students exceeding the PANs are assigned to their closest school as "external".
+
+    Parameters
+    ----------
+    `schools`: GeoPandas DataFrame
+        School locations as points
+    `students_lsoa`: GeoPandas DataFrame
+        LSOAs including an attribute for the number of students "5_est"
+    `target_PAN`: dict
+        School names as keys and PAN as value
+    `catchment_penalty`: float (default=None)
+        Distance (m) added to the assignments to schools outside the LSOA's catchment. 
+        If provided, the `schools` and `students_lsoa` must include a parameter labelled as "catchment_ID"
+    `dist_matrix`: NumPy array (default=None)
+        Distances between the schools and the LSOAs (see `build_distance_matrix`). Calculated if not provided
+    `instrument`: bool (default=False)
+        If True, the time of each phase and counters of the events are returned as "metrics" (see `instrumentation`)
+
+    Returns
+    -------
+    AssignmentResult (dictionary) including:
+        - "school", "students_total", "distance" and "external": arrays of the outcome (see `AssignmentResult`),
+        - "KPIs": dictionary of arrays, KPIs of each school (computed when accessed, see `metrics.assignment_KPIs`),
+        - "schools": GeoPandas DataFrame (built when accessed, the `schools` are not modified),
+        - "students": GeoPandas DataFrame (built when accessed, the `students_lsoa` are not modified),
+        - "flows": dictionary of arrays, "school", "lsoa" and "students" of the non-zero flows of the optimal assignment (see `min_cost_assignment`),
+        - "lower_bound": float, least total distance x students (m) of the students placed within the PANs (without `catchment_penalty`).
+          If the PANs are enough for all the students, it is a lower bound of "distx5_est" of any assignment within the PANs.
+          Otherwise it only covers the students that can be placed within the PANs (not the "overflow_students"),
+          so it is not comparable with the "distx5_est" of the other models, which include the students assigned beyond the PANs,
+        - "overflow_students": int, students beyond the total PAN,
+        - "lower_bound_total": float, "lower_bound" plus the distance x students of the "overflow_students" to their closest school:
+          the least "distx5_est" of the assignments of all the students that place as many students as possible within the PANs
+          (equal to "lower_bound" if the PANs are enough for all the students),
+        - "metrics": dictionary of "timers" and "counters" (if `instrument`)
+    """
+    metrics = new_metrics() if instrument else None
+    ## distances between the schools and the LSOAs
+    with phase(metrics, "distances"):
+        if dist_matrix is None:
+            dist_matrix = build_distance_matrix(schools, students_lsoa)
+            count(metrics, "distance_evaluations", dist_matrix.size)
+    school_strs = schools["establishment_name"].to_numpy()
+    cost = dist_matrix
+    with phase(metrics, "candidates"):
+        if catchment_penalty is not None:
+            cost = dist_matrix + catchment_penalty * ~catchment_matrix(schools, students_lsoa)
+
+    ## optimal assignment
+    est = students_lsoa["5_est"].to_numpy()
+    with phase(metrics, "assignment"):
+        outcome = min_cost_assignment(cost, est, [target_PAN[school_str] for school_str in school_strs])
+    flows = outcome["flows"]
+    count(metrics, "flow_rounds", outcome.get("rounds", 0))
+    count(metrics, "flow_phases", outcome.get("phases", 0))
+    count(metrics, "augmentations", outcome.get("augmentations", 0))
+
+    with phase(metrics, "bookkeeping"):
+        ## each LSOA to the school with most of its students (the closest school if none), or to the closest school if most of its students are beyond the PANs
+        n_lsoas = len(est)
+        i_schools = np.argmin(dist_matrix, axis=0)
+        most = np.zeros(n_lsoas, dtype=np.int64)
+        by_students = np.lexsort((-flows["students"], flows["lsoa"]))
+        first = by_students[np.flatnonzero(np.diff(flows["lsoa"][by_students], prepend=-1) != 0)]
+        i_schools[flows["lsoa"][first]] = flows["school"][first]
+        most[flows["lsoa"][first]] = flows["students"][first]
+        external = outcome["overflow"] > most
+        i_schools[external] = np.argmin(dist_matrix[:, external], axis=0)
+        placed = float((flows["students"] * dist_matrix[flows["school"], flows["lsoa"]]).sum())
+        ## outcome of the model (the DataFrames are built when accessed)
+        result = assignment_result(
+            schools, students_lsoa, i_schools, np.bincount(i_schools, weights=est, minlength=len(schools)), dist_matrix, external,
+            target=[target_PAN[school_str] for school_str in school_strs],
+            flows=flows,
+            lower_bound=placed,
+            overflow_students=int(outcome["overflow"].sum()),
+            lower_bound_total=placed + float((outcome["overflow"] * dist_matrix.min(axis=0)).sum()),
+        )
+    count(metrics, "assignments", len(est))
+    count(metrics, "external_assignments", external.sum())
+    if instrument: result["metrics"] = metrics
+    return result
+
+### Local search: refinement of an assignment by moving LSOAs to other schools and swapping LSOAs between schools
+def local_search(
+        school,
+        est,
+        dist_matrix,
+        target,
+        students_total,
+        in_catchment=None,
+        external=None,
+        catchment_penalty=None,
+        neighbours=8,
+        max_iterations=None,
+        time_limit=None,
+        ):
+    """
+    A function that improves an assignment by local search: for each LSOA in turn, the best move to another school
+    or swap with an LSOA of another school is applied, until no move or swap improves the assignment (or the budget is spent).
+    The objective is the number of students outside their catchment, which never increases, and then the total distance x students ("distx5_est").
+    With `catchment_penalty`, it is the total distance x students with `catchment_penalty` added to the distance of the students outside their catchment.
+    The change of the objective of each candidate only depends on the LSOAs and schools involved (O(1)), so the candidates are never evaluated from scratch,
+    and the swap candidates are looked up in the list of LSOAs of each candidate school (updated with each move and swap).
+    A school never goes over its PAN, nor further over it if it already is.
+
+    Parameters
+    ----------
+    `school`: array of int
+        Row of the school assigned to each LSOA (-1 if not assigned, these LSOAs are not moved)
+    `est`: array of int
+        Number of students of each LSOA
+    `dist_matrix`: NumPy array
+        Distances between the schools and the LSOAs (schools x LSOAs)
+    `target`: array of int
+        PAN of each school
+    `students_total`: array of int
+        Total students in each school (including the students assigned before the model)
+    `in_catchment`: NumPy array of bool (default=None)
+        LSOAs within the catchment of each school (see `catchment_matrix`). No student is outside the catchment if not provided
+    `external`: array of bool (default=None)
+        LSOAs assigned beyond the PANs (each LSOA keeps its flag through the moves and swaps)
+    `catchment_penalty`: float (default=None)
+        Distance (m) added to the students outside their catchment. The students outside their catchment cannot increase if not provided
+    `neighbours`: int (default=8)
+        Number of closest schools of each LSOA considered for its moves and swaps (the swaps look at every LSOA of these schools).
+        All the schools if None, so each LSOA is compared with every other LSOA: O(LSOAs²) a pass, only for small areas
+    `max_iterations`: int (default=None)
+        Maximum number of passes over the LSOAs
+    `time_limit`: float (default=None)
+        Maximum time (s) of the search
+
+    Returns
+    -------
+    Dictionary including:
+        - "school", "students_total" and "external": arrays of the refined assignment,
+        - "passes", "moves" and "swaps": int, passes over the LSOAs and changes applied,
+        - "converged": bool, whether no move or swap improves the refined assignment (False if the budget was spent first),
+        - "distx5_est" and "students_outside_catchment": the values before and after the search,
+        - "objective": the objective before and after the search, (students outside the catchment, "distx5_est")
+          compared in this order, or "distx5_est" with `catchment_penalty` for the students outside the catchment,
+        - "time": float, time (s) of the search
+    """
+    start = time.perf_counter()
+    n_schools, n_lsoas = dist_matrix.shape
+    school = np.asarray(school, dtype=np.int64).copy()
+    est = np.asarray(est, dtype=np.int64)
+    target = np.asarray(target, dtype=np.int64)
+    students_total = np.asarray(students_total, dtype=np.int64).copy()
+    external = np.zeros(n_lsoas, dtype=bool) if external is None else np.asarray(external, dtype=bool).copy()
+    ## objective of a student of each LSOA in each school: the primary objective is a constraint (never increases) without `catchment_penalty`
+    outside = np.zeros((n_schools, n_lsoas), dtype=np.int64) if in_catchment is None else (~np.asarray(in_catchment)).astype(np.int64)
+    if catchment_penalty is None:
+        primary, secondary = outside, np.asarray(dist_matrix, dtype=float)
+    else:
+        primary, secondary = np.zeros_like(outside), dist_matrix + catchment_penalty * outside
+    ## candidate schools of each LSOA (the closest schools)
+    candidates = closest_schools(dist_matrix, neighbours)
+    # changes of the secondary objective below the tolerance are rounding errors
+    tolerance = 1e-6
+    ## LSOAs of each school, and the position of each LSOA in the list of its school
+    members = [list(np.flatnonzero(school == i_school)) for i_school in range(n_schools)]
+    position = np.zeros(n_lsoas, dtype=np.int64)
+    for i_school in range(n_schools):
+        position[members[i_school]] = np.arange(len(members[i_school]))
+
+    def relocate(i_lsoa, i_from, i_to):
+        # the last LSOA of the school takes the place of the LSOA leaving
+        last = members[i_from].pop()
+        if last != i_lsoa:
+            members[i_from][position[i_lsoa]] = last
+            position[last] = position[i_lsoa]
+        position[i_lsoa] = len(members[i_to])
+        members[i_to].append(i_lsoa)
+        school[i_lsoa] = i_to
+        students_total[i_from] -= est[i_lsoa]
+        students_total[i_to] += est[i_lsoa]
+
+    def objectives():
+        assigned = np.flatnonzero(school >= 0)
+        distx5_est = float((dist_matrix[school[assigned], assigned] * est[assigned]).sum())
+        students_outside = int((outside[school[assigned], assigned] * est[assigned]).sum())
+        objective = (students_outside, distx5_est) if catchment_penalty is None else distx5_est + catchment_penalty * students_outside
+        return distx5_est, students_outside, objective
+    distx5_est, students_outside, objective = objectives()
+
+    passes = moves = swaps = 0
+    converged = False
+    while not converged and (max_iterations is None or passes < max_iterations):
+        if time_limit is not None and time.perf_counter() - start > time_limit: break
+        passes += 1
+        converged = True
+        for l in range(n_lsoas):
+            a = school[l]
+            if a < 0: continue
+            if time_limit is not None and time.perf_counter() - start > time_limit:
+                converged = False
+                break
+            e = est[l]
+            ## moves of the LSOA to its candidate schools
+            b = candidates[l][candidates[l] != a]
+            d_primary = e * (primary[b, l] - primary[a, l])
+            d_secondary = e * (secondary[b, l] - secondary[a, l])
+            feasible = students_total[b] + e <= np.maximum(target[b], students_total[b])
+            ## swaps with the LSOAs of the candidate schools
+            m = np.concatenate([np.asarray(members[i_school], dtype=np.int64) for i_school in b]) if len(b) > 0 else np.zeros(0, dtype=np.int64)
+            sb = school[m]
+            em = est[m]
+            d_primary = np.concatenate([d_primary, e * (primary[sb, l] - primary[a, l]) + em * (primary[a, m] - primary[sb, m])])
+            d_secondary = np.concatenate([d_secondary, e * (secondary[sb, l] - secondary[a, l]) + em * (secondary[a, m] - secondary[sb, m])])
+            feasible = np.concatenate([
+                feasible,
+                (students_total[a] - e + em <= max(target[a], students_total[a])) & (students_total[sb] - em + e <= np.maximum(target[sb], students_total[sb])),
+            ])
+            improving = feasible & ((d_primary < 0) | ((d_primary == 0) & (d_secondary < -tolerance)))
+            if not improving.any(): continue
+            ## apply the best candidate (least primary, then least secondary change)
+            i_improving = np.flatnonzero(improving)
+            best = i_improving[np.lexsort((d_secondary[i_improving], d_primary[i_improving]))[0]]
+            if best < len(b):
+                changed = [(l, a, b[best])]
+                moves += 1
+            else:
+                changed = [(l, a, sb[best - len(b)]), (m[best - len(b)], sb[best - len(b)], a)]
+                swaps += 1
+            for i_lsoa, i_from, i_to in changed:
+                relocate(i_lsoa, i_from, i_to)
+            converged = False
+
+    refined_distx5_est, refined_outside, refined_objective = objectives()
     return {
-        "schools": schools,
-        "students": students_lsoa,
+        "school": school,
+        "students_total": students_total,
+        "external": external,
+        "passes": passes,
+        "moves": moves,
+        "swaps": swaps,
+        "converged": converged,
+        "distx5_est": [distx5_est, refined_distx5_est],
+        "students_outside_catchment": [students_outside, refined_outside],
+        "objective": [objective, refined_objective],
+        "time": time.perf_counter() - start,
     }
 
+def refine_result(
+        result,
+        dist_matrix=None,
+        catchments=True,
+        in_catchment=None,
+        catchment_penalty=None,
+        neighbours=8,
+        max_iterations=None,
+        time_limit=None,
+        ):
+    """
+    A function that refines the outcome of a model by local search (see `local_search`),
+    e.g. the greedy assignment of `Optimise_PANsCatchment_Schools`, which depends on the `initial_school` and the order of the schools.
+
+    Parameters
+    ----------
+    `result`: AssignmentResult
+        Outcome of a model (see `AssignmentResult`)
+    `dist_matrix`: NumPy array (default=None)
+        Distances between the schools and the LSOAs (see `build_distance_matrix`). Calculated if not provided
+    `catchments`: bool (default=True)
+        Whether the students outside their catchment are considered (the `schools` and `students_lsoa` of the model must include "catchment_ID")
+    `in_catchment`: NumPy array of bool (default=None)
+        LSOAs within the catchment of each school (see `catchment_matrix`). Calculated if not provided
+    `catchment_penalty`, `neighbours`, `max_iterations`, `time_limit`:
+        See `local_search`
+
+    Returns
+    -------
+    AssignmentResult of the refined assignment (see `AssignmentResult`), including "refinement":
+    dictionary with the "passes", "moves", "swaps", "converged" and "time" of the search (see `local_search`),
+    the "distx5_est", "students_outside_catchment" and "objective" before and after it, and "improvement":
+        - "students_outside_catchment": int, students moved into their catchment (never negative without `catchment_penalty`),
+        - "distx5_est": float, share of the total distance x students saved. Negative if the distances increased
+          to move students into their catchment (the students outside the catchment come first in the objective),
+        - "objective": float, share of the objective saved with `catchment_penalty` (never negative, None without `catchment_penalty`)
+    """
+    schools, students_lsoa = result["inputs"]
+    if dist_matrix is None:
+        dist_matrix = build_distance_matrix(schools, students_lsoa)
+    if catchments and in_catchment is None:
+        in_catchment = catchment_matrix(schools, students_lsoa)
+    outcome = local_search(
+        result["school"], students_lsoa["5_est"].to_numpy(), dist_matrix, result["target"], result["students_total"],
+        in_catchment=in_catchment if catchments else None, external=result["external"], catchment_penalty=catchment_penalty,
+        neighbours=neighbours, max_iterations=max_iterations, time_limit=time_limit,
+    )
+    refinement = {
+        key: outcome[key] for key in ("passes", "moves", "swaps", "converged", "distx5_est", "students_outside_catchment", "objective", "time")
+    }
+    def saved(before, after):
+        return 1 - after / before if before > 0 else 0.0
+    refinement["improvement"] = {
+        "students_outside_catchment": outcome["students_outside_catchment"][0] - outcome["students_outside_catchment"][1],
+        "distx5_est": saved(*outcome["distx5_est"]),
+        "objective": saved(*outcome["objective"]) if catchment_penalty is not None else None,
+    }
+    return assignment_result(
+        schools, students_lsoa, outcome["school"], outcome["students_total"], dist_matrix, outcome["external"], target=result["target"],
+        refinement=refinement,
+    )
+
+### Random model (Monte Carlo) on arrays
+## Numeric inputs of the random model (shared by all the runs, and by the worker processes)
+def random_model_inputs(schools, students_lsoa, target_PAN, dist_matrix):
+    school_strs = list(schools["establishment_name"])
+    ## code of the catchment of each LSOA, and of each school (-1 if no LSOA is in the school's catchment)
+    lsoa_pool, pool_IDs = students_lsoa["catchment_ID"].factorize()
+    pool_codes = {ID: code for code, ID in enumerate(pool_IDs)}
+    school_pool = np.array([pool_codes.get(ID, -1) for ID in schools["catchment_ID"]], dtype=np.int64)
+    return {
+        "dist_matrix": dist_matrix,
+        "est": students_lsoa["5_est"].to_numpy(dtype=np.int64),
+        "target": np.array([target_PAN[school_str] for school_str in school_strs], dtype=np.int64),
+        "order": [school_strs.index(school_str) for school_str in target_PAN],
+        "lsoa_pool": lsoa_pool.astype(np.int64),
+        "school_pool": school_pool,
+        "n_pools": len(pool_IDs),
+        "pool_bounds": np.searchsorted(np.sort(lsoa_pool), np.arange(len(pool_IDs) + 1)),
+    }
+
+## Random orderings of the LSOAs: within each catchment (catchment by catchment), and of all the LSOAs
+# `rngs` is a generator for each run, the orderings are arrays with a row for each run
+# Stable sorts, so a batch of runs gets exactly the same orderings as the runs one by one
+def random_orderings(inputs, rngs):
+    lsoa_pool = inputs["lsoa_pool"]
+    keys = np.array([[rng.random(len(lsoa_pool)), rng.random(len(lsoa_pool))] for rng in rngs]).reshape(len(rngs), 2, len(lsoa_pool))
+    order_pool = np.argsort(keys[:, 0], axis=1, kind="stable")
+    order_pool = np.take_along_axis(order_pool, np.argsort(lsoa_pool[order_pool], axis=1, kind="stable"), axis=1)
+    return order_pool, np.argsort(keys[:, 1], axis=1, kind="stable")
+
+## A single realisation of the random model
+def random_run(inputs, rng):
+    """
+    Each school takes random LSOAs from its catchment until the PANs are saturated.
+    Taking a random unassigned LSOA is the same as taking the next unassigned LSOA of a random ordering,
+    so each run draws one random ordering of the LSOAs within each catchment (shared by the schools in the catchment) 
+    and one random ordering of all the LSOAs (used once no LSOAs are left in the catchment).
+
+    Parameters
+    ----------
+    `inputs`: dict
+        Numeric inputs of the random model (see `random_model_inputs`)
+    `rng`: NumPy Generator
+        Random number generator of the run
+
+    Returns
+    -------
+    Dictionary including (see `assign_from_queues`):
+        - "school": array of int,
+        - "students_total": array of int,
+        - "external": array of bool
+    """
+    n_pools = inputs["n_pools"]
+    order_pool, order_all = random_orderings(inputs, [rng])
+    order_pool, order_all = order_pool[0], order_all[0]
+    ## queues of the catchments, an empty queue (schools without LSOAs in their catchment) and the queue of all LSOAs
+    bounds = inputs["pool_bounds"]
+    queues = [order_pool[bounds[c]:bounds[c + 1]] for c in range(n_pools)]
+    queues += [order_pool[:0], order_all]
+    queue_in = [c if c >= 0 else n_pools for c in inputs["school_pool"]]
+    queue_all = [n_pools + 1] * len(queue_in)
+    return assign_from_queues(inputs["est"], inputs["target"], inputs["order"], queues, queue_all, queue_in, skip_zero_PAN=True)
+
+## A batch of realisations of the random model, advanced together
+def random_batch(inputs, seeds):
+    """
+    Runs the random model for a batch of seeds at once, giving the same outcome as `random_run` for each seed.
+    The state is kept in (runs x LSOAs) and (runs x schools) arrays, 
+    so each step of a school (random pick, PAN check and bookkeeping) is a single NumPy operation over all the runs.
+
+    Parameters
+    ----------
+    `inputs`: dict
+        Numeric inputs of the random model (see `random_model_inputs`)
+    `seeds`: list of NumPy SeedSequence
+        Seed of each run
+
+    Returns
+    -------
+    Dictionary including:
+        - "school": (runs x LSOAs) array of int, row of the school assigned to each LSOA (-1 if not assigned),
+        - "students_total": (runs x schools) array of int,
+        - "external": (runs x LSOAs) array of bool
+    """
+    est, target = inputs["est"], inputs["target"]
+    n_runs, n_schools, n_lsoas = len(seeds), len(target), len(est)
+    bounds = inputs["pool_bounds"]
+    order_pool, order_all = random_orderings(inputs, [np.random.default_rng(seed) for seed in seeds])
+
+    ## state of the runs
+    unassigned = np.ones((n_runs, n_lsoas), dtype=bool)
+    school = np.full((n_runs, n_lsoas), -1, dtype=np.int64)
+    external = np.zeros((n_runs, n_lsoas), dtype=bool)
+    students_total = np.zeros((n_runs, n_schools), dtype=np.int64)
+    saturated = np.zeros((n_runs, n_schools), dtype=bool)
+    n_unassigned = np.full(n_runs, n_lsoas)
+    n_unsaturated = np.full(n_runs, n_schools)
+    pointer_pool = np.tile(np.asarray(bounds[:-1], dtype=np.int64), (n_runs, 1))
+    pointer_all = np.zeros(n_runs, dtype=np.int64)
+
+    ## first unassigned LSOA in a queue, for the runs in `rows` (-1 if there is none)
+    def next_lsoa(order, pointer, rows, end):
+        p = pointer[rows]
+        # only the pointers that moved are checked again
+        check = np.arange(len(rows))
+        while len(check) > 0:
+            check = check[p[check] < end]
+            check = check[~unassigned[rows[check], order[rows[check], p[check]]]]
+            p[check] += 1
+        pointer[rows] = p
+        return np.where(p < end, order[rows, np.minimum(p, n_lsoas - 1)], -1)
+
+    def assign(rows, i_lsoas, i_school, is_external):
+        school[rows, i_lsoas] = i_school
+        external[rows, i_lsoas] = is_external
+        unassigned[rows, i_lsoas] = False
+        students_total[rows, i_school] += est[i_lsoas]
+        n_unassigned[rows] -= 1
+
+    ## while any run has LSOAs without a school
+    running = n_unassigned > 0
+    while running.any():
+        changed = np.zeros(n_runs, dtype=bool)
+        for i_school in inputs["order"]:
+            c = inputs["school_pool"][i_school]
+            ## Accumilate students from the LSOAs in the catchment (or any LSOA if none left in the catchment)
+            rows = np.flatnonzero(running & ~saturated[:, i_school])
+            i_lsoas = np.full(len(rows), -1)
+            if c >= 0:
+                pool_pointer = pointer_pool[:, c].copy()
+                i_lsoas = next_lsoa(order_pool, pool_pointer, rows, bounds[c + 1])
+                pointer_pool[:, c] = pool_pointer
+            empty = i_lsoas < 0
+            i_lsoas[empty] = next_lsoa(order_all, pointer_all, rows[empty], n_lsoas)
+            found = i_lsoas >= 0
+            rows, i_lsoas = rows[found], i_lsoas[found]
+            changed[rows] = True
+            fits = students_total[rows, i_school] + est[i_lsoas] < target[i_school]
+            last = ~fits & (n_unsaturated[rows] == 1)
+            assign(rows[fits | last], i_lsoas[fits | last], i_school, False)
+            saturated[rows[~fits], i_school] = True
+            n_unsaturated[rows[~fits]] -= 1
+            ## Accumilate a random LSOA regardless of PAN, if all schools reached their PANs
+            if target[i_school] > 0:
+                rows = np.flatnonzero(running & (n_unsaturated == 0) & (n_unassigned > 0))
+                assign(rows, next_lsoa(order_all, pointer_all, rows, n_lsoas), i_school, True)
+                changed[rows] = True
+        # runs where no school can take any of the remaining LSOAs stop
+        running &= changed & (n_unassigned > 0)
+
+    return {
+        "school": school,
+        "students_total": students_total,
+        "external": external,
+    }
+
+## Statistics of the realisations of the random model, for each run (rows) and school (columns)
+def random_statistics(inputs, school):
+    ## KPIs of all the runs at once (see `metrics.assignment_KPIs`)
+    KPIs = assignment_KPIs(
+        school, inputs["est"], assigned_distances(inputs["dist_matrix"], school), inputs["target"],
+        lsoa_catchment=inputs["lsoa_pool"], school_catchment=inputs["school_pool"],
+    )
+    ## average distance in miles (0 for the schools without PAN, and without students from outside the catchment)
+    distances = np.where(inputs["target"] == 0, 0, KPIs["distance"])
+    distances_outside = np.where(KPIs["students_outside_catchment"] > 0, KPIs["distance_outside_catchment"], 0)
+    return distances, distances_outside, KPIs["students_3_miles"]
+
+## Statistics of a number of runs, each with its own random number generator (seed)
+# runs one by one, or in batches of `batch_size` runs
+def random_runs(inputs, seeds, batch_size=None):
+    if batch_size is None:
+        school = np.array([random_run(inputs, np.random.default_rng(seed))["school"] for seed in seeds])
+    else:
+        school = np.concatenate([random_batch(inputs, seeds[n:n + batch_size])["school"] for n in range(0, len(seeds), batch_size)])
+    return random_statistics(inputs, school.reshape(len(seeds), -1))
+
+## Worker processes keep the inputs of the random model, so only the seeds are sent with each task
+# the large arrays (e.g. the distance matrix) are mapped from shared files rather than copied to each worker (see `shared`)
+random_worker_inputs = None
+
+def init_random_worker(shared):
+    global random_worker_inputs
+    random_worker_inputs = attach_inputs(shared)
+
+def random_worker_runs(seeds, batch_size=None):
+    return random_runs(random_worker_inputs, seeds, batch_size)
+
+## Statistics of the runs of the random model, one task (a number of runs) at a time and in the order of the seeds
+# With `workers`, at most two tasks per worker are in progress, so the caller can stop early
+def random_model_tasks(inputs, seeds, workers=None, batch_size=None):
+    n_runs = len(seeds)
+    if batch_size is not None: chunk = batch_size
+    elif workers is None or workers <= 1: chunk = 1
+    else: chunk = max(1, math.ceil(n_runs / (workers * 4)))
+    tasks = [seeds[n:n + chunk] for n in range(0, n_runs, chunk)]
+    if workers is None or workers <= 1:
+        for task in tasks:
+            yield task, random_runs(inputs, task, batch_size)
+        return
+    directory = tempfile.TemporaryDirectory(dir=shared_directory, ignore_cleanup_errors=True)
+    executor = ProcessPoolExecutor(workers, initializer=init_random_worker, initargs=(share_inputs(inputs, directory.name),))
+    try:
+        futures = deque()
+        for task in tasks:
+            futures.append((task, executor.submit(random_worker_runs, task, batch_size)))
+            if len(futures) >= 2 * workers:
+                task_done, future = futures.popleft()
+                yield task_done, future.result()
+        while futures:
+            task_done, future = futures.popleft()
+            yield task_done, future.result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        directory.cleanup()
+
+## A single run of `Random_PANsCatchment_schools` (run number `run` with the same `seed`), as an AssignmentResult
+def random_model_run(schools, students_lsoa, target_PAN, seed, run=0, dist_matrix=None):
+    if dist_matrix is None:
+        dist_matrix = build_distance_matrix(schools, students_lsoa)
+    inputs = random_model_inputs(schools, students_lsoa, target_PAN, dist_matrix)
+    outcome = random_run(inputs, np.random.default_rng(np.random.SeedSequence(seed).spawn(run + 1)[run]))
+    return assignment_result(schools, students_lsoa, outcome["school"], outcome["students_total"], dist_matrix, outcome["external"], inputs["target"])
+
 def Random_PANsCatchment_schools(
     schools,
     students_lsoa,
     target_PAN,
-    n_runs=20
+    n_runs=20,
+    dist_matrix=None,
+    seed=None,
+    workers=None,
+    batch_size=None,
+    accumulate=False,
+    tolerance=None,
+    confidence=0.95,
+    min_runs=30,
+    progress=False,
+    observer=None,
+    instrument=False,
     ):  
     """
     A function that identifies the catchement areas based on the proposed PANs. 
-    Loops through schools and assigns LSOAs. 
+    Loops through schools and assigns random LSOAs. 
     This is constrained to a predefined catchment.
     The `schools` and `students_lsoa` must include a parameter labelled as "catchment_ID".
+    Each run has an independent random number generator derived from `seed`, 
+    so the outcome for a given `seed` is the same regardless of the number of `workers` and the `batch_size`.
 
     Parameters
     ----------
     `schools`: GeoPandas DataFrame
         School locations as points
-    `students_losa`: GeoPandas DataFrame
-        LSOAs including an attribute for the number of students "est_5"
-    `PANs`: dict
-        Schools names as index and PAN as value
+    `students_lsoa`: GeoPandas DataFrame
+        LSOAs including an attribute for the number of students "5_est"
+    `target_PAN`: dict
+        School names as keys and PAN as value
+    `n_runs`: int (default=20)
+        Number of random runs
+    `dist_matrix`: NumPy array (default=None)
+        Distances between the schools and the LSOAs (see `build_distance_matrix`). Calculated if not provided.
+        A memory-mapped matrix (e.g. `np.load(path, mmap_mode="r")`) is shared with the workers without being copied
+    `seed`: int (default=None)
+        Master seed of the runs. Not reproducible if not provided
+    `workers`: int (default=None)
+        Number of worker processes. The runs are executed in the current process if not provided.
+        The workers attach to the numeric inputs in shared memory-mapped files (see `shared.share_inputs`)
+    `batch_size`: int (default=None)
+        Number of runs simulated together as arrays (see `random_batch`), which bounds the memory used. 
+        The runs are simulated one by one if not provided
+    `accumulate`: bool (default=False)
+        If True, only streaming statistics of the runs are kept (constant memory regardless of `n_runs`)
+    `tolerance`: float (default=None)
+        If provided, the runs stop once the confidence interval of the mean distance of each school is narrower than `tolerance` miles
+        (checked after each task of runs, `n_runs` is then the maximum number of runs)
+    `confidence`: float (default=0.95)
+        Confidence level of the confidence interval used with `tolerance`
+    `min_runs`: int (default=30)
+        Minimum number of runs before stopping with `tolerance`
+    `progress`: bool (default=False)
+        If True, a progress bar of the runs is written to stderr (needs tqdm)
+    `observer`: function (default=None)
+        Called after each task of runs as `observer(runs, done, seconds)` (see `instrumentation.batch_observer`)
+    `instrument`: bool (default=False)
+        If True, the time of each phase, the number of tasks and runs, and the time of each task ("batches") are also returned (see `instrumentation`)
 
     Returns
     -------
-    Dictionary including:
-        - "schools": GeoPandas DataFrame,
-        - "students": GeoPandas DataFrame
-    """
-        ## prepare outcome parameters
-    distances = {}
-    distances_outside_catchment = {}
-    students_3_miles = {}
-    for school_str in target_PAN:
-        distances[school_str] = list()
-        distances_outside_catchment[school_str] = list()
-        students_3_miles[school_str] = list()
-
-    for n in tqdm(range(n_runs)):
-        schools["students_total"] = [0 for index in schools.index]
-        schools["students_3_miles"] = [0 for index in schools.index]
-        students_lsoa["school"] = ["" for index in students_lsoa.index]
-        students_lsoa["dist_to_school"] = [0 for index in students_lsoa.index]
-        students_lsoa["distx5_est"] = [0 for index in students_lsoa.index]
-        students_lsoa["colour"] = ["" for index in students_lsoa.index]
-        students_lsoa["external"] = [False for index in students_lsoa.index]
-        random.seed(n + random.randint(0, 100000000))
-        ## prepare saturated PANs disctionary
-        saturated_PAN = {}
-        schools_IDs = {}
-        for school_str in target_PAN:
-            saturated_PAN[school_str] = False
-            # update the IDs
-            current_school = schools[schools["establishment_name"] == school_str]
-            i_cSchool = current_school.index[0]
-            ID_cSchool = current_school.at[i_cSchool, "catchment_ID"]
-            schools_IDs[school_str] = (schools.at[i_cSchool, "catchment_ID"])
-        ## while any LSOA has not been adressed a school
-        while len(students_lsoa[students_lsoa["school"] == ""].index) > 0:
-            # Loop through the schools
-            for current_str in target_PAN:
-                ## initial school
-                current_school = schools[schools["establishment_name"] == current_str]
-                i_cSchool = current_school.index[0]
-                ID_cSchool = current_school.at[i_cSchool, "catchment_ID"]
-
-                ## Accumilate students from the closest LSOAs
-                if saturated_PAN[current_str] == False:
-                    # find LSOAs without an assignment establishment_name and within the schools catchment
-                    lsoa_in_catchment = students_lsoa[(students_lsoa["school"] == "") & (students_lsoa["catchment_ID"] == schools_IDs[current_str])]
-                    if len(lsoa_in_catchment) > 0:
-                        lsoa_temp = lsoa_in_catchment
-                    # else, if no LSOAs are within the catchment, find any LSOAs without an assigned establishment_name
-                    else:
-                        lsoa_temp = students_lsoa[students_lsoa["school"] == ""]
-
-                    # find a random LSOA
-                    if len(lsoa_temp.index) > 0: i_lsoa = random.choice(lsoa_temp.index)
-                    else: break
-                    # calculate distance from all LSOAs
-                    dists_school_LSOAs = current_school.at[i_cSchool, "geometry"].distance(lsoa_temp["geometry"])
-                    ## if adding the number of students in the LSOA will not lead to exceeding the PAN
-                    if schools.at[i_cSchool, "students_total"] + students_lsoa.at[i_lsoa, "5_est"] < target_PAN[current_str]:
-                        schools.at[i_cSchool, "students_total"] += students_lsoa.at[i_lsoa, "5_est"]
-                        students_lsoa.at[i_lsoa, "school"] = current_str
-                        students_lsoa.at[i_lsoa, "catchment_ID_school"] = schools_IDs[current_str]
-                        students_lsoa.at[i_lsoa, "dist_to_school"] = dists_school_LSOAs[i_lsoa]
-                        if dists_school_LSOAs[i_lsoa] > 3 / 0.000621371: schools.at[i_cSchool, "students_3_miles"] += students_lsoa.at[i_lsoa, "5_est"]
-                        students_lsoa.at[i_lsoa, "distx5_est"] = dists_school_LSOAs[i_lsoa] * students_lsoa.at[i_lsoa, "5_est"]
-                        students_lsoa.at[i_lsoa, "external"] = False
-                    ## if this is the last school with any availability. Add the students to it
-                    elif schools.at[i_cSchool, "students_total"] + students_lsoa.at[i_lsoa, "5_est"] >= target_PAN[current_str] and list(saturated_PAN.values()).count(False) == 1:
-                        schools.at[i_cSchool, "students_total"] += students_lsoa.at[i_lsoa, "5_est"]
-                        students_lsoa.at[i_lsoa, "school"] = current_str
-                        students_lsoa.at[i_lsoa, "catchment_ID_school"] = schools_IDs[current_str]
-                        students_lsoa.at[i_lsoa, "dist_to_school"] = dists_school_LSOAs[i_lsoa]
-                        if dists_school_LSOAs[i_lsoa] > 3 / 0.000621371: schools.at[i_cSchool, "students_3_miles"] += students_lsoa.at[i_lsoa, "5_est"]
-                        students_lsoa.at[i_lsoa, "distx5_est"] = dists_school_LSOAs[i_lsoa] * students_lsoa.at[i_lsoa, "5_est"]
-                        students_lsoa.at[i_lsoa, "external"] = False
-                        saturated_PAN[current_str] = True
-                    else:
-                        saturated_PAN[current_str] = True
-                
-                ## Accumilate to the student from the closest LSOA regardless of PAN, if all schools reached their PANs
-                if list(saturated_PAN.values()).count(False) == 0 \
-                and len(students_lsoa[students_lsoa["school"] == ""].index) > 0\
-                and target_PAN[current_str] > 0:
-                    # find LSOA without an assigned establishment_name
-                    lsoa_temp = students_lsoa[students_lsoa["school"] == ""]
-                    i_lsoa = random.choice(lsoa_temp.index)
-                    # calculate distance from all LSOAs
-                    dists_school_LSOAs = current_school.at[i_cSchool, "geometry"].distance(lsoa_temp["geometry"])
-                    # address parameters
-                    schools.at[i_cSchool, "students_total"] += students_lsoa.at[i_lsoa, "5_est"]
-                    students_lsoa.at[i_lsoa, "school"] = current_str
-                    students_lsoa.at[i_lsoa, "catchment_ID_school"] = schools_IDs[current_str]
-                    students_lsoa.at[i_lsoa, "dist_to_school"] = dists_school_LSOAs[i_lsoa]
-                    if dists_school_LSOAs[i_lsoa] > 3 / 0.000621371: schools.at[i_cSchool, "students_3_miles"] += students_lsoa.at[i_lsoa, "5_est"]
-                    students_lsoa.at[i_lsoa, "distx5_est"] = dists_school_LSOAs[i_lsoa] * students_lsoa.at[i_lsoa, "5_est"]
-                    students_lsoa.at[i_lsoa, "external"] = True
-
-                ## if the school is saturated, skip it
-                if saturated_PAN[current_str] == True:
-                    continue
-        for school_str in target_PAN:
-            ## find all LSOAs outside the catchment
-            LSOAs_outside_catchment = students_lsoa[(students_lsoa["school"] == school_str) & (students_lsoa["catchment_ID"] != students_lsoa["catchment_ID_school"])]
-            if target_PAN[school_str] == 0: distances[school_str].append(0)
-            else: distances[school_str].append( ( sum(students_lsoa[students_lsoa["school"] == school_str]["distx5_est"]) / sum(students_lsoa[students_lsoa["school"] == school_str]["5_est"]) ) * 0.000621371)
-            if len(LSOAs_outside_catchment.index) > 0:
-                distances_outside_catchment[school_str].append( (sum(LSOAs_outside_catchment["distx5_est"]) / sum(LSOAs_outside_catchment["5_est"]))  *  0.000621371)
-            else:
-                distances_outside_catchment[school_str].append(0)
-            current_school = schools[schools["establishment_name"] == school_str]
-            i_cSchool = current_school.index[0]
-            students_3_miles[school_str].append(schools.at[i_cSchool, "students_3_miles"])
+    Tuple of dictionaries (school names as keys, and a list with a value for each run):
+        - distances: average distance to school in miles,
+        - distances_outside_catchment: average distance in miles of the students from outside the catchment,
+        - students_3_miles: students living further than 3 miles from the school
+    If `accumulate`, the statistics of the runs instead (see `ensemble.ensemble_accumulator` and `ensemble.ensemble_summary`).
+    If `instrument`, a dictionary of "timers" and "counters" is added to the tuple (or as "metrics" to the statistics).
+    The `schools` and `students_lsoa` DataFrames are not modified (see `random_model_run` for the outcome of a single run).
+    """
+    metrics = new_metrics() if instrument else None
+    ## distances between the schools and the LSOAs
+    with phase(metrics, "distances"):
+        if dist_matrix is None:
+            dist_matrix = build_distance_matrix(schools, students_lsoa)
+            count(metrics, "distance_evaluations", dist_matrix.size)
+    with phase(metrics, "candidates"):
+        inputs = random_model_inputs(schools, students_lsoa, target_PAN, dist_matrix)
+    ## independent random streams for each run
+    seeds = np.random.SeedSequence(seed).spawn(n_runs)
+
+    ## prepare outcome parameters
+    school_strs = list(target_PAN)
+    order = inputs["order"]
+    runs = [[], [], []]
+    if accumulate or tolerance is not None:
+        accumulator = ensemble_accumulator(school_strs)
+
+    ## run the model (in tasks of `batch_size` runs)
+    if progress: from tqdm import tqdm
+    observer = batch_observer(metrics, observer)
+    n_done = 0
+    with phase(metrics, "assignment"), (tqdm(total=n_runs) if progress else nullcontext()) as progress_bar:
+        start = time.perf_counter()
+        for task, outcome in random_model_tasks(inputs, seeds, workers, batch_size):
+            n_done += len(task)
+            if progress: progress_bar.update(len(task))
+            if observer is not None: observer(len(task), n_done, time.perf_counter() - start)
+            # statistics of the schools in the order of `target_PAN`
+            outcome = [values[:, order] for values in outcome]
+            if accumulate or tolerance is not None:
+                accumulate_runs(accumulator, *outcome)
+            if not accumulate:
+                for k in range(3): runs[k].append(outcome[k])
+            ## stop once the mean distance of each school is known within the tolerance
+            if tolerance is not None and ensemble_converged(accumulator, tolerance, confidence, min_runs):
+                break
+            start = time.perf_counter()
 
+    with phase(metrics, "bookkeeping"):
+        if accumulate:
+            outcome = accumulator
+        else:
+            runs = [np.concatenate(values) if len(values) > 0 else np.zeros((0, len(school_strs))) for values in runs]
+            distances = {}
+            distances_outside_catchment = {}
+            students_3_miles = {}
+            for k, school_str in enumerate(school_strs):
+                distances[school_str] = runs[0][:, k].tolist()
+                distances_outside_catchment[school_str] = runs[1][:, k].tolist()
+                students_3_miles[school_str] = runs[2][:, k].tolist()
+            outcome = (distances, distances_outside_catchment, students_3_miles)
 
-    return distances, distances_outside_catchment, students_3_miles
\ No newline at end of file
+    if instrument:
+        if accumulate: outcome["metrics"] = metrics
+        else: outcome = outcome + (metrics,)
+    return outcome
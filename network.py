@@ -0,0 +1,180 @@
+import geopandas as gpd
+import numpy as np
+import hashlib
+import heapq
+import os
+from shapely import STRtree, centroid, distance, get_coordinates, points, to_wkb
+from cache import cache_directory, write_atomic
+
+### Road network costs: distances (or travel times) along a local road or footpath graph instead of straight lines
+# the graph is read from a file on disk (e.g. the roads and footpaths of an OSM extract exported as lines), no network access is needed
+## Version of the cached cost matrices (changing it invalidates all of them)
+NETWORK_CACHE_VERSION = 1
+
+def load_road_graph(path, layer=None, crs=27700, speed=None, snap=1.0):
+    """
+    A function that loads a road or footpath network from a file of lines and builds an undirected graph:
+    every vertex of the lines is a node (vertices rounded to the same point of a grid of `snap` are merged), and every segment between two consecutive vertices an edge.
+
+    Parameters
+    ----------
+    `path`: str
+        File with the roads as (multi)lines (e.g. "brighton_roads.gpkg")
+    `layer`: str (default=None)
+        Layer of the file, if it has several
+    `crs`: int (default=27700)
+        EPSG code of the projected CRS used to measure distances
+    `speed`: float (default=None)
+        Speed (m/s) to convert the lengths of the edges to travel times (s). The costs are lengths (m) if not provided.
+        The models measure the 3 miles and the average distances in metres, so travel times only suit the rankings of the schools
+    `snap`: float (default=1.0)
+        Vertices of the lines are rounded to a grid of `snap` (m) to join the lines.
+        Two vertices closer than `snap` are not merged if they round to different points of the grid
+
+    Returns
+    -------
+    Dictionary including:
+        - "nodes": NumPy array of shape (number of nodes, 2), coordinates of the nodes,
+        - "indptr", "indices", "weights": NumPy arrays, adjacency of the nodes (compressed sparse rows),
+        - "speed": float or None,
+        - "fingerprint": str, hash of the file and the parameters (see `network_cost_matrix`)
+    """
+    fingerprint = hashlib.sha256()
+    fingerprint.update(f"{NETWORK_CACHE_VERSION}|{layer}|{crs}|{speed!r}|{snap!r}".encode())
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            fingerprint.update(block)
+
+    roads = gpd.read_file(path, layer=layer).to_crs(epsg=crs)
+    ## each line of the file is split into its segments (multilines into lines)
+    lines = roads.geometry.explode(index_parts=False)
+    lines = np.asarray(lines[lines.geom_type == "LineString"])
+    coords, line_index = get_coordinates(lines, return_index=True)
+    same_line = line_index[1:] == line_index[:-1]
+    starts = coords[:-1][same_line]
+    ends = coords[1:][same_line]
+    lengths = np.hypot(*(ends - starts).T)
+
+    ## merge the ends of the segments on the grid of `snap`
+    keys = np.round(np.concatenate([starts, ends]) / snap).astype(np.int64)
+    keys, first, node_of = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    nodes = np.concatenate([starts, ends])[first]
+    node_of = node_of.reshape(-1)
+    u, v = node_of[:len(starts)], node_of[len(starts):]
+    # segments collapsed into a node by the snapping are dropped
+    kept = u != v
+    graph = graph_from_edges(nodes, u[kept], v[kept], lengths[kept] if speed is None else lengths[kept] / speed)
+    graph["speed"] = speed
+    graph["fingerprint"] = fingerprint.hexdigest()
+    return graph
+
+## Undirected graph in compressed sparse rows (the shortest edge is kept between two nodes)
+def graph_from_edges(nodes, u, v, weights):
+    heads = np.concatenate([u, v])
+    tails = np.concatenate([v, u])
+    weights = np.concatenate([weights, weights])
+    order = np.lexsort((weights, tails, heads))
+    heads, tails, weights = heads[order], tails[order], weights[order]
+    first = np.ones(len(heads), dtype=bool)
+    first[1:] = (heads[1:] != heads[:-1]) | (tails[1:] != tails[:-1])
+    heads, tails, weights = heads[first], tails[first], weights[first]
+    indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(heads, minlength=len(nodes)), out=indptr[1:])
+    return {"nodes": nodes, "indptr": indptr, "indices": tails, "weights": weights}
+
+## Cost from a source node to every node of the graph (Dijkstra), inf for the nodes not connected to it
+def shortest_costs(graph, source):
+    indptr, indices, weights = graph["indptr"], graph["indices"].tolist(), graph["weights"].tolist()
+    indptr = indptr.tolist()
+    costs = [float("inf")] * (len(indptr) - 1)
+    costs[source] = 0.0
+    queue = [(0.0, source)]
+    while queue:
+        cost, node = heapq.heappop(queue)
+        if cost > costs[node]: continue
+        for k in range(indptr[node], indptr[node + 1]):
+            new_cost = cost + weights[k]
+            if new_cost < costs[indices[k]]:
+                costs[indices[k]] = new_cost
+                heapq.heappush(queue, (new_cost, indices[k]))
+    return np.array(costs)
+
+## Costs from the source nodes to every node, one search for each source (rows in the order of `sources`)
+def costs_from_sources(graph, sources):
+    try:
+        # SciPy, if installed, runs the searches in compiled code
+        from scipy.sparse import csr_matrix
+        from scipy.sparse.csgraph import dijkstra
+    except ImportError:
+        return np.array([shortest_costs(graph, source) for source in sources]).reshape(len(sources), len(graph["nodes"]))
+    n_nodes = len(graph["nodes"])
+    adjacency = csr_matrix((graph["weights"], graph["indices"], graph["indptr"]), shape=(n_nodes, n_nodes))
+    return dijkstra(adjacency, directed=False, indices=np.asarray(sources))
+
+## Closest node of the graph to each point, and the straight-line distance to it
+def snap_to_graph(graph, geoms):
+    node_points = points(graph["nodes"])
+    tree = STRtree(node_points)
+    i_geoms, i_nodes = tree.query_nearest(geoms, all_matches=False)
+    nearest = np.empty(len(geoms), dtype=np.int64)
+    nearest[i_geoms] = i_nodes
+    return nearest, distance(geoms, node_points[nearest])
+
+def network_cost_matrix(graph, schools, students_lsoa, unreachable_factor=2.0, cache_dir=cache_directory):
+    """
+    A function that calculates the cost (distance or travel time) along the road network from every school to every LSOA,
+    to be passed to the models as `dist_matrix` instead of the straight-line distances of `build_distance_matrix`.
+    Schools and LSOA centroids are joined to their closest nodes of the graph, with straight-line costs for the joins,
+    and a single shortest-path search from each school reaches all the LSOAs.
+    The matrix is cached on disk, keyed by the graph and the locations of the schools and LSOAs,
+    so a change of the catchments (or any other attribute) reuses it.
+    The costs run from the school to the centroid of the LSOA, while `build_distance_matrix` measures the straight line to the polygon of the LSOA
+    (0 for a school inside it): the two matrices are not interchangeable, e.g. the students beyond 3 miles of the KPIs and outcomes
+    are counted with whichever matrix the models are given, and the catchments set by `update_catchments` do not follow the network.
+
+    Parameters
+    ----------
+    `graph`: dict
+        Road network (see `load_road_graph`)
+    `schools`: GeoPandas DataFrame
+        School locations as points
+    `students_lsoa`: GeoPandas DataFrame
+        LSOAs as polygons
+    `unreachable_factor`: float (default=2.0)
+        LSOAs not connected to a school by the network get the straight-line cost multiplied by `unreachable_factor`
+    `cache_dir`: str (default="data/cache")
+        Directory of the cache. The matrix is not cached if None
+
+    Returns
+    -------
+    NumPy array of shape (number of schools, number of LSOAs), in metres (or seconds if the graph has a `speed`),
+    where `dist_matrix[i, j]` is the cost between the school in row `i` of `schools` and the LSOA in row `j` of `students_lsoa` (positional, not index labels)
+    """
+    school_geoms = np.asarray(schools["geometry"])
+    lsoa_geoms = centroid(np.asarray(students_lsoa["geometry"]))
+    if cache_dir is not None:
+        fingerprint = hashlib.sha256(f"{graph['fingerprint']}|{unreachable_factor!r}".encode())
+        for geoms in (school_geoms, lsoa_geoms):
+            fingerprint.update(b"".join(to_wkb(geoms)))
+            fingerprint.update(b"|")
+        path = os.path.join(cache_dir, "network", f"{fingerprint.hexdigest()}.npy")
+        ## warm start, the matrix has been calculated before
+        if os.path.exists(path):
+            return np.load(path)
+
+    speed = graph.get("speed") or 1.0
+    school_nodes, school_joins = snap_to_graph(graph, school_geoms)
+    lsoa_nodes, lsoa_joins = snap_to_graph(graph, lsoa_geoms)
+    ## one search for each node with schools
+    source_nodes, source_of = np.unique(school_nodes, return_inverse=True)
+    costs = costs_from_sources(graph, source_nodes)[source_of.reshape(-1)][:, lsoa_nodes]
+    dist_matrix = costs + (school_joins[:, np.newaxis] + lsoa_joins[np.newaxis, :]) / speed
+    unreachable = ~np.isfinite(dist_matrix)
+    if unreachable.any():
+        straight = distance(school_geoms[:, np.newaxis], lsoa_geoms[np.newaxis, :]) / speed
+        dist_matrix[unreachable] = unreachable_factor * straight[unreachable]
+
+    if cache_dir is not None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_atomic(path, lambda file: np.save(file, dist_matrix))
+    return dist_matrix
@@ -0,0 +1,225 @@
+import inspect
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from shapely import STRtree, centroid
+import models
+
+### Partitioned execution of the models (e.g. each local authority in England in its own process)
+## The LSOA-driven models take the PANs as a DataFrame of a PAN year rather than a dictionary
+LSOA_models = (models.Optimise_PANs_LSOAs, models.Optimise_PANsCatchment_LSOAs)
+
+## Split points into `n_parts` groups of similar weight (recursive bisection along the longest side)
+def bisect_points(x, y, weights, n_parts):
+    labels = np.zeros(len(x), dtype=np.int64)
+    if n_parts <= 1 or len(x) <= 1: return labels
+    n_low = n_parts // 2
+    coords = x if np.ptp(x) >= np.ptp(y) else y
+    order = np.argsort(coords, kind="stable")
+    # the split leaves a share of the weight proportional to the number of parts on each side
+    cumulative = np.cumsum(weights[order])
+    split = int(np.searchsorted(cumulative, cumulative[-1] * n_low / n_parts)) + 1
+    split = min(max(split, 1), len(x) - 1)
+    low, high = order[:split], order[split:]
+    labels[low] = bisect_points(x[low], y[low], weights[low], n_low)
+    labels[high] = n_low + bisect_points(x[high], y[high], weights[high], n_parts - n_low)
+    return labels
+
+def catchment_clusters(students_lsoa, n_partitions, by="catchment_ID"):
+    """
+    A function that groups the catchments (or any other areas) into spatially compact clusters with similar numbers of LSOAs.
+
+    Parameters
+    ----------
+    `students_lsoa`: GeoPandas DataFrame
+        LSOAs including the attribute `by`
+    `n_partitions`: int
+        Number of clusters
+    `by`: str (default="catchment_ID")
+        Attribute of the LSOAs identifying the areas to group
+
+    Returns
+    -------
+    NumPy array of int, cluster of each LSOA
+    """
+    codes, areas = pd.factorize(students_lsoa[by])
+    points = centroid(np.asarray(students_lsoa["geometry"]))
+    x = np.bincount(codes, weights=np.array([point.x for point in points]), minlength=len(areas))
+    y = np.bincount(codes, weights=np.array([point.y for point in points]), minlength=len(areas))
+    counts = np.bincount(codes, minlength=len(areas))
+    area_labels = bisect_points(x / counts, y / counts, counts.astype(float), min(n_partitions, len(areas)))
+    return area_labels[codes]
+
+## Partition of each school: the partition of its closest LSOA
+def school_partitions(schools, students_lsoa, lsoa_partition):
+    tree = STRtree(np.asarray(students_lsoa["geometry"]))
+    i_schools, i_lsoas = tree.query_nearest(np.asarray(schools["geometry"]), all_matches=False)
+    partition = np.empty(len(schools), dtype=np.asarray(lsoa_partition).dtype)
+    partition[i_schools] = np.asarray(lsoa_partition)[i_lsoas]
+    return partition
+
+## Groups of partitions connected by pairs of partitions (e.g. the partition of an LSOA and of a school near it), as the smallest partition code of the group
+def partition_groups(n_partitions, first, second):
+    group = np.arange(n_partitions)
+    while True:
+        linked = group.copy()
+        np.minimum.at(linked, first, group[second])
+        np.minimum.at(linked, second, group[first])
+        linked = linked[linked]
+        if np.array_equal(linked, group): return group
+        group = linked
+
+## Models returning statistics of their runs rather than an assignment, which cannot be merged across partitions
+ensemble_models = (models.Random_PANsCatchment_schools,)
+
+## Reject up front (before any partition is run) the models that cannot be partitioned
+def check_model(model):
+    if model in ensemble_models:
+        raise ValueError(f"{model.__name__} returns statistics of its runs, not an assignment of the LSOAs, so it cannot be partitioned")
+
+## Run a model on a subset of the schools and LSOAs, with the PANs reduced by the students already assigned
+def run_subset(model, schools, students_lsoa, target_PAN, model_kwargs):
+    check_model(model)
+    school_strs = list(schools["establishment_name"])
+    schools = schools.assign(students_total=0)
+    students_lsoa = students_lsoa.assign(school="")
+    kwargs = dict(model_kwargs)
+    # the distances are calculated for the subset
+    kwargs.pop("dist_matrix", None)
+    ## start from the requested school if it is in the subset, otherwise from the first school
+    if "initial_school" in inspect.signature(model).parameters:
+        if kwargs.get("initial_school") not in school_strs:
+            kwargs["initial_school"] = school_strs[0]
+    PANs = {school_str: target_PAN[school_str] for school_str in school_strs}
+    if model in LSOA_models:
+        PAN_year = kwargs.pop("PAN_year", 2024)
+        PANs = pd.DataFrame({"school": school_strs, f"pan{PAN_year}": [PANs[school_str] for school_str in school_strs]})
+        kwargs["PAN_year"] = PAN_year
+    outcome = model(schools, students_lsoa, PANs, **kwargs)
+    return outcome["schools"]["students_total"], outcome["students"]
+
+## Entry point of the worker processes
+def run_partition(task):
+    return run_subset(*task)
+
+def Partitioned_model(
+        model,
+        schools,
+        students_lsoa,
+        target_PAN,
+        partition="catchment_ID",
+        halo=2000,
+        workers=None,
+        **model_kwargs,
+        ):
+    """
+    A function that runs a model separately on each partition of the schools and LSOAs (e.g. each local authority),
+    in a pool of processes, and merges the outcomes.
+    The LSOAs closer than `halo` to a school of another partition are then reassigned together with the schools near them,
+    so students can still be assigned across the borders of the partitions.
+    The halo is reassigned in groups of partitions connected by its LSOAs (e.g. the two sides of a border), in the same pool of processes.
+    The PANs of the schools are shared between the two steps (the students already assigned in the first step are kept).
+    The LSOAs of a partition without schools are attached to the partition of their closest school.
+    The LSOAs of the halo only get the places left by the other LSOAs, so a school can still end over its PAN:
+    the LSOAs kept outside the halo may already fill it (a partition with more students than places), or the places left near the halo
+    may not be enough for its LSOAs, and the model then assigns them beyond the PANs as it does without partitions.
+
+    Parameters
+    ----------
+    `model`: function
+        Model to run on each partition (e.g. `models.Optimise_PANsCatchment_Schools`), returning an assignment of the LSOAs
+        ("schools" and "students"). `models.Random_PANsCatchment_schools` raises a ValueError
+    `schools`: GeoPandas DataFrame
+        School locations as points
+    `students_lsoa`: GeoPandas DataFrame
+        LSOAs including an attribute for the number of students "5_est"
+    `target_PAN`: dict
+        School names as keys and PAN as value
+    `partition`: str or array (default="catchment_ID")
+        Attribute of the LSOAs (e.g. local authority code), or partition of each LSOA (e.g. see `catchment_clusters`).
+        The schools are in the partition of their closest LSOA
+    `halo`: float (default=2000)
+        Distance (m) from the schools of other partitions of the LSOAs reassigned across the borders. No reassignment if 0 or None
+    `workers`: int (default=None)
+        Number of worker processes. The partitions are run in the current process if not provided
+    `model_kwargs`:
+        Other parameters of the model (e.g. `initial_school`, used in the partitions including it). 
+        The distances are calculated for each partition, so `dist_matrix` is ignored
+
+    Returns
+    -------
+    Dictionary including:
+        - "schools": GeoPandas DataFrame (new DataFrame, the `schools` are not modified),
+        - "students": GeoPandas DataFrame (new DataFrame, the `students_lsoa` are not modified),
+        - "partition": NumPy array, partition of each LSOA (after attaching the LSOAs of the partitions without schools),
+        - "attached": NumPy array of bool, LSOAs of partitions without schools, attached to the partition of their closest school,
+        - "halo": NumPy array of bool, LSOAs reassigned across the borders
+    """
+    check_model(model)
+    lsoa_partition = np.array(students_lsoa[partition] if isinstance(partition, str) else partition)
+    school_partition = school_partitions(schools, students_lsoa, lsoa_partition)
+    ## the LSOAs of the partitions without schools join the partition of their closest school
+    attached = ~np.isin(lsoa_partition, school_partition)
+    if attached.any():
+        tree = STRtree(np.asarray(schools["geometry"]))
+        i_lsoas, i_schools = tree.query_nearest(np.asarray(students_lsoa["geometry"])[attached], all_matches=False)
+        lsoa_partition[np.flatnonzero(attached)[i_lsoas]] = school_partition[i_schools]
+    labels = pd.unique(lsoa_partition)
+
+    ## the partitions, and then the groups of the halo, are run in the same pool of processes
+    parallel = workers is not None and workers > 1 and len(labels) > 1
+    with ProcessPoolExecutor(min(workers, len(labels))) if parallel else nullcontext() as executor:
+        def run_tasks(tasks):
+            if executor is None or len(tasks) <= 1:
+                return [run_partition(task) for task in tasks]
+            return list(executor.map(run_partition, tasks))
+
+        ## run the model on each partition (largest partitions first)
+        tasks = [(model, schools[school_partition == label], students_lsoa[lsoa_partition == label], target_PAN, model_kwargs) for label in labels]
+        tasks.sort(key=lambda task: -len(task[2]))
+        outcomes = run_tasks(tasks)
+
+        ## merge the outcomes
+        students_total = pd.concat([outcome[0] for outcome in outcomes]).reindex(schools.index, fill_value=0)
+        merged = pd.concat([outcome[1] for outcome in outcomes]).reindex(students_lsoa.index)
+
+        ## reassign the LSOAs near the schools of other partitions
+        in_halo = np.zeros(len(students_lsoa), dtype=bool)
+        if halo:
+            tree = STRtree(np.asarray(schools["geometry"]))
+            i_lsoas, i_schools = tree.query(np.asarray(students_lsoa["geometry"]), predicate="dwithin", distance=halo)
+            in_halo[i_lsoas[school_partition[i_schools] != lsoa_partition[i_lsoas]]] = True
+        if in_halo.any():
+            school_strs = schools["establishment_name"].to_numpy()
+            ## the schools near the LSOAs of the halo, and the schools they were assigned to
+            i_lsoas, i_schools = tree.query(np.asarray(students_lsoa["geometry"])[in_halo], predicate="dwithin", distance=halo)
+            halo_schools = np.isin(school_strs, merged["school"].to_numpy()[in_halo])
+            halo_schools[i_schools] = True
+            ## places left by the LSOAs outside the halo
+            kept = merged[~in_halo & (merged["school"] != "").to_numpy()]
+            kept_totals = kept.groupby("school")["5_est"].sum()
+            halo_PAN = {school_str: max(target_PAN[school_str] - int(kept_totals.get(school_str, 0)), 0) for school_str in school_strs[halo_schools]}
+            ## groups of the partitions linked by the LSOAs of the halo (the schools they are assigned to are in their own partition)
+            codes = pd.Index(labels)
+            lsoa_code, school_code = codes.get_indexer(lsoa_partition), codes.get_indexer(school_partition)
+            group = partition_groups(len(labels), lsoa_code[np.flatnonzero(in_halo)[i_lsoas]], school_code[i_schools])
+            tasks = []
+            for g in np.unique(group[lsoa_code[in_halo]]):
+                group_schools = halo_schools & (group[school_code] == g)
+                tasks.append((model, schools[group_schools], students_lsoa[in_halo & (group[lsoa_code] == g)], halo_PAN, model_kwargs))
+            tasks.sort(key=lambda task: -len(task[2]))
+            students_total = kept_totals.reindex(school_strs, fill_value=0).to_numpy(dtype=np.int64, copy=True)
+            for halo_totals, halo_students in run_tasks(tasks):
+                merged.loc[halo_students.index, halo_students.columns] = halo_students
+                students_total[schools.index.get_indexer(halo_totals.index)] += halo_totals.to_numpy()
+            students_total = pd.Series(students_total, index=schools.index)
+
+    ## outcome in new DataFrames (the inputs are not modified)
+    return {
+        "schools": schools.assign(students_total=students_total.to_numpy()),
+        "students": merged,
+        "partition": lsoa_partition,
+        "attached": attached,
+        "halo": in_halo,
+    }
@@ -0,0 +1,27 @@
+import matplotlib.pyplot as plt
+from matplotlib.lines import Line2D
+
+### plotting
+## define colours
+colours = {
+    "Blatchington Mill School": "steelblue",
+    "Brighton Aldridge Community Academy": "orange",
+    "Cardinal Newman Catholic School": "limegreen",
+    "Dorothy Stringer School": "firebrick",
+    "Hove Park School and Sixth Form Centre": "mediumpurple",
+    "King's School": "sienna",
+    "Longhill High School": "palevioletred",
+    "Patcham High School": "gray",
+    "Portslade Aldridge Community Academy": "darkkhaki",
+    "Varndean School": "darkturquoise",
+}
+
+## create custom legend
+def create_custom_legend_handles(colours=colours):
+    handles, labels = plt.gca().get_legend_handles_labels()
+    extend_list = []
+    for school_str in colours:
+        point = Line2D([0], [0], label=school_str, marker='o', markersize=10, markeredgecolor="black", markerfacecolor=colours[school_str], linestyle="")
+        extend_list.append(point)
+    handles.extend(extend_list)
+    return(handles)
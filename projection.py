@@ -0,0 +1,133 @@
+import numpy as np
+from models import (
+    build_distance_matrix, catchment_matrix, extract_PANs, order_schools, distance_queues, assign_from_queues, assignment_state,
+    school_preferences, assign_schools_by_LSOA, assignment_result,
+)
+from sweep import shared_events
+
+### Multi-year projections: the LSOA cohorts are aged forward year by year, and each year is assigned with the PANs of the year
+# the distances, queues and preferences are prepared once, and each year of the school-driven models resumes the assignment of the previous year
+
+## Single-year cohorts of each LSOA (LSOAs x ages, youngest first) from the 5 to 9 year olds, `age_factor` of them in each year of age
+def initial_cohorts(students_lsoa, age_factor=0.19288):
+    return np.repeat(students_lsoa["5_9_total"].to_numpy(dtype=float)[:, np.newaxis] * age_factor, 5, axis=1)
+
+## The cohorts one year later: each cohort is one year older (the oldest leaves), and the youngest is the previous youngest times 1 + `growth`
+def age_cohorts(cohorts, growth=0.0):
+    aged = np.empty_like(cohorts)
+    aged[:, 1:] = cohorts[:, :-1]
+    aged[:, 0] = cohorts[:, 0] * (1 + np.asarray(growth))
+    return aged
+
+## PAN years of a PANs DataFrame (columns "pan{year}")
+def PAN_years(PANs):
+    return sorted(int(column[3:]) for column in PANs.columns if column.startswith("pan") and column[3:].isdigit())
+
+def project_years(
+        schools,
+        students_lsoa,
+        PANs,
+        years=None,
+        model="catchment_schools",
+        cohorts=None,
+        intake=-1,
+        growth=0.0,
+        age_factor=0.19288,
+        initial_school="Dorothy Stringer School",
+        dist_matrix=None,
+        warm_start=True,
+        ):
+    """
+    A generator that projects the assignment over a range of years: each year the LSOA cohorts are one year older,
+    the students of each LSOA are the cohort of the `intake` age, and the model is run with the PANs of the year.
+    The outcome of each year is yielded as soon as it is ready, so the years can be written out one at a time.
+    The distances, the order of the schools and the queues (or preferences) of the LSOAs are prepared once for all the years.
+    With `warm_start`, the school-driven models resume the assignment of the previous year from its first PAN check with a different outcome
+    (see `sweep.shared_events`), with the same outcome as solving each year from scratch.
+    The `schools` and `students_lsoa` DataFrames are not modified.
+
+    Parameters
+    ----------
+    `schools`: GeoPandas DataFrame
+        School locations as points (including "catchment_ID" for the catchment models)
+    `students_lsoa`: GeoPandas DataFrame
+        LSOAs including the number of 5 to 9 year olds "5_9_total" (and "catchment_ID" for the catchment models)
+    `PANs`: Pandas DataFrame
+        PANs of the schools, with the columns "school" and "pan{year}" for each year
+    `years`: list of int (default=None)
+        Years of the projection, the first year with the cohorts as they are. All the PAN years of `PANs` if not provided
+    `model`: str (default="catchment_schools")
+        Model run each year: "schools" (`Optimise_PANs_Schools`), "catchment_schools" (`Optimise_PANsCatchment_Schools`),
+        "LSOAs" (`Optimise_PANs_LSOAs`) or "catchment_LSOAs" (`Optimise_PANsCatchment_LSOAs`)
+    `cohorts`: NumPy array (default=None)
+        Single-year cohorts of each LSOA in the first year (LSOAs x ages, youngest first). Split from "5_9_total" if not provided (see `initial_cohorts`)
+    `intake`: int (default=-1)
+        Column of `cohorts` admitted each year (by default the oldest, so the first year has the students of `reset_parameters`)
+    `growth`: float or array (default=0.0)
+        Yearly change of the youngest cohort (or of the youngest cohort of each LSOA), e.g. births and migration
+    `age_factor`: float (default=0.19288)
+        Share of the 5 to 9 year olds in each year of age
+    `initial_school`: str (default="Dorothy Stringer School")
+        The initial school in the optimisation loop of the school-driven models
+    `dist_matrix`: NumPy array (default=None)
+        Distances between the schools and the LSOAs (see `build_distance_matrix`). Calculated if not provided
+    `warm_start`: bool (default=True)
+        Whether the school-driven models start each year from the assignment of the previous year
+
+    Yields
+    ------
+    Dictionary for each year including:
+        - "year": int,
+        - "est": NumPy array of int, students of each LSOA,
+        - "result": AssignmentResult of the year (see `models.AssignmentResult`, the "students" have the "5_est" of the year),
+        - "KPIs": dictionary of arrays, KPIs of each school (see `metrics.assignment_KPIs`)
+    """
+    ## inputs shared by all the years
+    if dist_matrix is None:
+        dist_matrix = build_distance_matrix(schools, students_lsoa)
+    if years is None:
+        years = PAN_years(PANs)
+    if cohorts is None:
+        cohorts = initial_cohorts(students_lsoa, age_factor)
+    school_strs = list(schools["establishment_name"])
+    catchments = model in ("catchment_schools", "catchment_LSOAs")
+    in_catchment = catchment_matrix(schools, students_lsoa) if catchments else None
+    school_driven = model in ("schools", "catchment_schools")
+    if school_driven:
+        rows = {school_str: i for i, school_str in enumerate(school_strs)}
+        order = [rows[school_str] for school_str in order_schools(schools, initial_school)]
+        queues, queue_all, queue_in = distance_queues(dist_matrix, in_catchment)
+    else:
+        preferences = school_preferences(dist_matrix)
+
+    previous = None
+    for k, year in enumerate(years):
+        if k > 0:
+            cohorts = age_cohorts(cohorts, growth)
+        est = np.floor(cohorts[:, intake]).astype(np.int64)
+        target_PAN = extract_PANs(PANs, year)
+        target = np.array([target_PAN[school_str] for school_str in school_strs], dtype=np.int64)
+
+        if school_driven:
+            ## resume the assignment of the previous year from the first event with a different outcome
+            resume, prefix = None, None
+            if warm_start and previous is not None:
+                previous_target, log = previous
+                n_shared = shared_events(log, previous_target, target, catchments, est=est)
+                if n_shared > 0:
+                    prefix = {key: values[:n_shared] for key, values in log.items()}
+                    resume = assignment_state(log, n_shared, est, len(target))
+            outcome = assign_from_queues(est, target, order, queues, queue_all, queue_in, skip_zero_PAN=catchments, log=True, resume=resume)
+            log = outcome["log"]
+            if prefix is not None:
+                log = {key: np.concatenate([prefix[key], log[key]]) for key in log}
+            previous = (target, log)
+        else:
+            outcome = assign_schools_by_LSOA(preferences, est, target, in_catchment=in_catchment)
+
+        ## outcome of the year (the LSOAs with the students of the year)
+        result = assignment_result(
+            schools, students_lsoa.assign(**{"5_est": est}), outcome["school"], outcome["students_total"], dist_matrix, outcome.get("external"),
+            target=target,
+        )
+        yield {"year": year, "est": est, "result": result, "KPIs": result["KPIs"]}
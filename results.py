@@ -0,0 +1,363 @@
+import numpy as np
+import pandas as pd
+import hashlib
+import json
+import os
+import time
+import uuid
+import models
+from cache import write_atomic
+
+### Append-only store of the assignments of model runs, across runs and scenarios
+# each append writes a partition (Parquet if pyarrow is installed, otherwise compressed npz) with a row for each run:
+# the school of each LSOA as a compact code (uint8, or uint16 with 255 schools or more), and the metadata of the run
+# (model, seed and run number, catchment version, PANs and the scenario of the PANs), so new questions never require running the models again
+## Version of the store layout
+STORE_VERSION = 1
+## Metadata of each run, used to select the runs of a query
+run_metadata = ["run", "model", "seed", "catchment", "scenario"]
+
+## Type of the school codes, and the code of the LSOAs without a school (the largest value of the type)
+def school_dtype(n_schools):
+    return np.dtype(np.uint8) if n_schools < np.iinfo(np.uint8).max else np.dtype(np.uint16)
+
+## Scenario of a PAN vector (the PANs in the order of the schools of the store)
+def scenario_id(PANs):
+    return hashlib.sha256(np.asarray(PANs, dtype=np.uint16).tobytes()).hexdigest()[:16]
+
+def open_result_store(directory, school_strs, lsoa_strs, format=None):
+    """
+    A function that opens a result store, creating it if the directory has none.
+    The schools and LSOAs of a store are fixed when it is created: the codes of the assignments are the rows of `school_strs`,
+    and the assignments have a column for each of the `lsoa_strs`.
+
+    Parameters
+    ----------
+    `directory`: str
+        Directory of the store
+    `school_strs`: list of str
+        School names (e.g. `list(schools["establishment_name"])`, the rows of the schools of the models)
+    `lsoa_strs`: list of str
+        LSOA codes (e.g. `list(students["LSOA21CD"])`, in the order of the LSOAs of the models)
+    `format`: str (default=None)
+        Format of the partitions of a new store, "parquet" (requires pyarrow) or "npz". Parquet if pyarrow is installed if not provided
+
+    Returns
+    -------
+    Dictionary with the "directory", "schools", "lsoas" and "format" of the store
+    """
+    path = os.path.join(directory, "store.json")
+    store = {"version": STORE_VERSION, "schools": list(school_strs), "lsoas": [str(lsoa) for lsoa in lsoa_strs], "format": format}
+    if os.path.exists(path):
+        with open(path) as file:
+            existing = json.load(file)
+        if existing["schools"] != store["schools"] or existing["lsoas"] != store["lsoas"] or existing["version"] != STORE_VERSION:
+            raise ValueError(f"{directory} is a store of different schools or LSOAs")
+        return {**existing, "directory": directory}
+    if store["format"] is None:
+        try:
+            import pyarrow
+            store["format"] = "parquet"
+        except ImportError:
+            store["format"] = "npz"
+    os.makedirs(directory, exist_ok=True)
+    write_atomic(path, lambda file: file.write(json.dumps(store).encode()))
+    return {**store, "directory": directory}
+
+## Partitions of a store, in the order they were written
+# the partitions replaced by a compacted partition (see `compact_store`) are skipped once it is written
+def store_partitions(store):
+    names = os.listdir(store["directory"])
+    superseded = set()
+    for manifest in compaction_manifests(store):
+        if manifest["partition"] in names: superseded.update(manifest["replaced"])
+    return [os.path.join(store["directory"], name) for name in sorted(names) if name.startswith("part-") and name not in superseded]
+
+## Manifests of the compactions of a store (the compacted partition and the partitions it replaces), written before the partitions are merged
+def compaction_manifests(store):
+    manifests = []
+    for name in sorted(os.listdir(store["directory"])):
+        if name.startswith("compact-") and name.endswith(".json"):
+            with open(os.path.join(store["directory"], name)) as file:
+                manifests.append({**json.load(file), "path": os.path.join(store["directory"], name)})
+    return manifests
+
+## Write and read the columns of a partition: the metadata (arrays of str or int), "PAN" (runs x schools) and "school" (runs x LSOAs)
+def write_partition(path, columns):
+    if path.endswith(".parquet"):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        arrays = {}
+        for name, values in columns.items():
+            if values.ndim == 2:
+                arrays[name] = pa.FixedSizeListArray.from_arrays(pa.array(values.ravel()), values.shape[1])
+            else:
+                arrays[name] = pa.array(values.tolist() if values.dtype.kind == "U" else values)
+        write_atomic(path, lambda file: pq.write_table(pa.table(arrays), file))
+    else:
+        write_atomic(path, lambda file: np.savez_compressed(file, **columns))
+
+def read_partition(path, names, widths):
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        table = pq.read_table(path, columns=list(names))
+        columns = {}
+        for name in names:
+            values = table.column(name).combine_chunks()
+            if name in widths:
+                columns[name] = values.flatten().to_numpy().reshape(-1, widths[name])
+            else:
+                columns[name] = np.asarray(values.to_numpy(zero_copy_only=False))
+        return columns
+    with np.load(path) as partition:
+        return {name: partition[name] for name in names}
+
+def append_runs(store, school, PANs, model, seed=None, run=None, catchment=""):
+    """
+    A function that appends runs to a store, as a new partition.
+
+    Parameters
+    ----------
+    `store`: dict
+        Store (see `open_result_store`)
+    `school`: array of int
+        Row of the school assigned to each LSOA (-1 if not assigned, see `models.AssignmentResult`), or (runs x LSOAs)
+    `PANs`: array of int
+        PAN of each school of the runs (in the order of the schools of the store), or (runs x schools)
+    `model`: str
+        Model of the runs (e.g. "random" or "catchment_schools")
+    `seed`: int (default=None)
+        Seed of the runs (e.g. the master seed of `models.Random_PANsCatchment_schools`)
+    `run`: array of int (default=None)
+        Number of each run with the seed (0, 1, ... if not provided)
+    `catchment`: str (default="")
+        Version of the catchments of the runs (e.g. the name or a hash of the catchment file)
+
+    Returns
+    -------
+    Path of the partition
+    """
+    school = np.atleast_2d(np.asarray(school))
+    n_runs, n_schools = len(school), len(store["schools"])
+    if school.shape[1] != len(store["lsoas"]):
+        raise ValueError(f"the runs have {school.shape[1]} LSOAs, the store has {len(store['lsoas'])}")
+    PANs = np.broadcast_to(np.asarray(PANs), (n_runs, n_schools))
+    if PANs.max(initial=0) > np.iinfo(np.uint16).max or PANs.min(initial=0) < 0:
+        raise ValueError("the PANs must be between 0 and 65535")
+    dtype = school_dtype(n_schools)
+    columns = {
+        "run": np.arange(n_runs, dtype=np.int64) if run is None else np.asarray(run, dtype=np.int64),
+        "model": np.full(n_runs, model),
+        "seed": np.full(n_runs, "" if seed is None else str(seed)),
+        "catchment": np.full(n_runs, str(catchment)),
+        "scenario": np.array([scenario_id(PAN) for PAN in PANs]),
+        "PAN": PANs.astype(np.uint16),
+        # the LSOAs without a school have the largest code
+        "school": np.where(school >= 0, school, np.iinfo(dtype).max).astype(dtype),
+    }
+    # named after the time of the append, so the partitions are read in order (with a random suffix for concurrent appends)
+    path = os.path.join(store["directory"], f"part-{time.time_ns():020d}-{uuid.uuid4().hex[:8]}.{store['format']}")
+    write_partition(path, columns)
+    return path
+
+## Append the assignment of a model (see `models.AssignmentResult`)
+def append_result(store, result, model, seed=None, run=0, catchment=""):
+    return append_runs(store, result["school"], result["target"], model, seed=seed, run=[run], catchment=catchment)
+
+def store_random_runs(store, schools, students_lsoa, target_PAN, n_runs=1000, seed=None, dist_matrix=None, batch_size=100, catchment=""):
+    """
+    A function that runs `models.Random_PANsCatchment_schools` and appends the assignment of each run to a store,
+    a partition for each batch of runs. Each run is the same as `models.random_model_run` with the same `seed` and run number.
+
+    Parameters
+    ----------
+    `store`: dict
+        Store (see `open_result_store`), with the schools of `schools`
+    `schools`, `students_lsoa`, `target_PAN`, `n_runs`, `dist_matrix`:
+        See `models.Random_PANsCatchment_schools`
+    `seed`: int (default=None)
+        Master seed of the runs. Drawn (and stored with the runs) if not provided
+    `batch_size`: int (default=100)
+        Number of runs simulated together (see `models.random_batch`) and written to each partition
+    `catchment`: str (default="")
+        Version of the catchments of the runs
+
+    Returns
+    -------
+    List of the paths of the partitions
+    """
+    if list(schools["establishment_name"]) != store["schools"]:
+        raise ValueError("the schools are not the schools of the store")
+    if dist_matrix is None:
+        dist_matrix = models.build_distance_matrix(schools, students_lsoa)
+    inputs = models.random_model_inputs(schools, students_lsoa, target_PAN, dist_matrix)
+    sequence = np.random.SeedSequence(seed)
+    seeds = sequence.spawn(n_runs)
+    paths = []
+    for start in range(0, n_runs, batch_size):
+        school = models.random_batch(inputs, seeds[start:start + batch_size])["school"]
+        paths.append(append_runs(
+            store, school, inputs["target"], "random", seed=sequence.entropy, run=np.arange(start, start + len(school)), catchment=catchment,
+        ))
+    return paths
+
+### Queries of the runs
+## Runs of a partition that match the filters (model, seed, catchment, scenario, or the PANs of a scenario as a dictionary)
+def matching_runs(store, metadata, filters):
+    selected = np.ones(len(metadata["run"]), dtype=bool)
+    for name, value in filters.items():
+        if value is None: continue
+        if name == "PANs":
+            name, value = "scenario", scenario_id([value[school_str] for school_str in store["schools"]])
+        if name not in run_metadata:
+            raise KeyError(f"unknown filter {name}")
+        selected &= metadata[name] == (value if name == "run" else str(value))
+    return selected
+
+def iterate_runs(store, columns=("school",), **filters):
+    """
+    A generator of the runs of a store that match the filters, a partition at a time (so the memory is bounded by the size of the partitions).
+
+    Parameters
+    ----------
+    `store`: dict
+        Store (see `open_result_store`)
+    `columns`: list of str (default=("school",))
+        Columns read for the matching runs: "school" (codes, as in the store), "PAN" and the metadata `run_metadata`
+    `filters`:
+        Values of the runs selected: "model", "seed", "catchment", "scenario" (see `scenario_id`), "run",
+        or "PANs" (dictionary of the PAN of each school of the scenario)
+
+    Yields
+    ------
+    Dictionary of the columns of the matching runs of each partition
+    """
+    widths = {"school": len(store["lsoas"]), "PAN": len(store["schools"])}
+    for path in store_partitions(store):
+        metadata = read_partition(path, run_metadata, widths)
+        selected = matching_runs(store, metadata, filters)
+        if not selected.any(): continue
+        data = read_partition(path, [name for name in columns if name not in run_metadata], widths)
+        yield {name: (metadata[name] if name in run_metadata else data[name])[selected] for name in columns}
+
+## Metadata of the runs of a store (a row for each run), e.g. to count the runs of each model and scenario
+def store_runs(store, **filters):
+    return pd.concat(
+        [pd.DataFrame(columns) for columns in iterate_runs(store, run_metadata, **filters)] or [pd.DataFrame(columns=run_metadata)],
+        ignore_index=True,
+    )
+
+## Scenarios of a store, with the PAN of each school
+def store_scenarios(store, **filters):
+    scenarios = {}
+    for columns in iterate_runs(store, ("scenario", "PAN"), **filters):
+        for scenario, PAN in zip(columns["scenario"], columns["PAN"]):
+            scenarios.setdefault(scenario, PAN)
+    return pd.DataFrame(list(scenarios.values()), index=list(scenarios), columns=store["schools"], dtype=np.int64)
+
+## Assignments of the runs that match the filters, (runs x LSOAs) array of the row of the school of each LSOA (-1 if not assigned)
+def read_assignments(store, **filters):
+    unassigned = np.iinfo(school_dtype(len(store["schools"]))).max
+    blocks = [columns["school"] for columns in iterate_runs(store, **filters)]
+    school = np.concatenate(blocks) if blocks else np.zeros((0, len(store["lsoas"])), dtype=school_dtype(len(store["schools"])))
+    return np.where(school == unassigned, -1, school.astype(np.int64))
+
+def assignment_probability(store, lsoa=None, school=None, **filters):
+    """
+    A function that estimates the probability of each LSOA being assigned to each school, over the runs that match the filters,
+    e.g. `assignment_probability(store, "E01016867", "Varndean School", model="random", PANs=target_PAN)`.
+    The counts are accumulated a partition at a time.
+
+    Parameters
+    ----------
+    `store`: dict
+        Store (see `open_result_store`)
+    `lsoa`: str (default=None)
+        LSOA code. All the LSOAs if not provided
+    `school`: str (default=None)
+        School name. All the schools if not provided
+    `filters`:
+        Runs selected (see `iterate_runs`)
+
+    Returns
+    -------
+    Pandas DataFrame with the probabilities (share of the runs), the LSOAs as index and the schools as columns
+    (the probabilities of an LSOA add up to less than 1 if it is not assigned in some runs),
+    or the row or column of `lsoa` or `school`, or the probability of `lsoa` and `school` if both are provided (NaN if no run matches)
+    """
+    n_schools, n_lsoas = len(store["schools"]), len(store["lsoas"])
+    # a bin for each LSOA and school, and for each LSOA not assigned
+    n_codes = n_schools + 1
+    unassigned = np.iinfo(school_dtype(n_schools)).max
+    counts = np.zeros(n_lsoas * n_codes, dtype=np.int64)
+    n_runs = 0
+    for columns in iterate_runs(store, **filters):
+        codes = columns["school"].astype(np.int64)
+        codes[codes == unassigned] = n_schools
+        counts += np.bincount((np.arange(n_lsoas) * n_codes + codes).ravel(), minlength=n_lsoas * n_codes)
+        n_runs += len(codes)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        probability = pd.DataFrame(
+            counts.reshape(n_lsoas, n_codes)[:, :n_schools] / n_runs, index=store["lsoas"], columns=store["schools"],
+        )
+    if lsoa is not None and school is not None:
+        return probability.at[lsoa, school]
+    if lsoa is not None:
+        return probability.loc[lsoa]
+    if school is not None:
+        return probability[school]
+    return probability
+
+## Merge the partitions of a store into fewer partitions (fewer files to read once many small appends were made)
+def compact_store(store, max_runs=10000):
+    """
+    A function that merges consecutive partitions of a store into partitions of up to `max_runs` runs,
+    reading a group of partitions at a time (so the memory is bounded by `max_runs`).
+    Each merge is recorded in a manifest before the partitions are written and removed, so an interrupted compaction never
+    loses or repeats runs: the replaced partitions are only skipped once the merged partition is written (see `store_partitions`),
+    and the next compaction finishes removing them.
+
+    Parameters
+    ----------
+    `store`: dict
+        Store (see `open_result_store`)
+    `max_runs`: int (default=10000)
+        Largest number of runs of a merged partition. Partitions with more runs are kept as they are
+
+    Returns
+    -------
+    List of the paths of the partitions of the store
+    """
+    ## finish the compactions that were interrupted
+    for manifest in compaction_manifests(store):
+        if os.path.exists(os.path.join(store["directory"], manifest["partition"])):
+            for name in manifest["replaced"]:
+                if os.path.exists(os.path.join(store["directory"], name)): os.remove(os.path.join(store["directory"], name))
+        os.remove(manifest["path"])
+
+    ## groups of consecutive partitions with up to `max_runs` runs
+    widths = {"school": len(store["lsoas"]), "PAN": len(store["schools"])}
+    groups = [[]]
+    n_runs = 0
+    for path in store_partitions(store):
+        runs = len(read_partition(path, ["run"], widths)["run"])
+        if n_runs + runs > max_runs and groups[-1]:
+            groups.append([])
+            n_runs = 0
+        groups[-1].append(path)
+        n_runs += runs
+
+    names = run_metadata + ["PAN", "school"]
+    for paths in groups:
+        if len(paths) <= 1: continue
+        # named after the first partition, so it keeps its place before the later appends
+        path = os.path.join(store["directory"], os.path.basename(paths[0]).rsplit(".", 1)[0] + f"c.{store['format']}")
+        manifest = {"partition": os.path.basename(path), "replaced": [os.path.basename(old_path) for old_path in paths]}
+        manifest_path = os.path.join(store["directory"], f"compact-{manifest['partition']}.json")
+        write_atomic(manifest_path, lambda file: file.write(json.dumps(manifest).encode()))
+        partitions = [read_partition(old_path, names, widths) for old_path in paths]
+        write_partition(path, {name: np.concatenate([partition[name] for partition in partitions]) for name in names})
+        for old_path in paths:
+            os.remove(old_path)
+        os.remove(manifest_path)
+    return store_partitions(store)
@@ -0,0 +1,239 @@
+import argparse
+import asyncio
+import json
+import math
+from collections import OrderedDict
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import models
+from cache import load_model_inputs
+from ensemble import ensemble_summary
+
+### Local what-if service: the inputs are prepared once and kept in memory, and PAN scenarios are answered over HTTP
+# POST /query with a JSON body, e.g. {"model": "catchment_schools", "target_PAN": {"Varndean School": 300}}, returns the KPIs of each school
+# The models run in threads (the event loop keeps answering), the random ensembles in a pool of processes,
+# and the answers of the latest queries are kept in an LRU cache
+## Models of the queries
+service_models = {
+    "schools": models.Optimise_PANs_Schools,
+    "catchment_schools": models.Optimise_PANsCatchment_Schools,
+    "LSOAs": models.Optimise_PANs_LSOAs,
+    "catchment_LSOAs": models.Optimise_PANsCatchment_LSOAs,
+    "flow": models.Optimise_PANs_Flow,
+    "random": models.Random_PANsCatchment_schools,
+}
+## Default values of the queries
+query_defaults = {
+    "model": "catchment_schools",
+    "target_PAN": {},
+    "initial_school": "Dorothy Stringer School",
+    "catchment_penalty": None,
+    "n_runs": 100,
+    "seed": 0,
+    "assignment": False,
+}
+
+def load_service(schools_path, students_path, catchment_path, PANs_path=None, PAN_year=2024, age_factor=0.19288, crs=27700, cache_size=256, workers=None):
+    """
+    A function that prepares the state of the service: the inputs of the models (see `cache.load_model_inputs`),
+    the base PANs, the LRU cache of the answers and the pool of processes of the random ensembles.
+
+    Parameters
+    ----------
+    `schools_path`, `students_path`, `catchment_path`: str
+        Files with the schools, the LSOAs and the catchments (see `cache.load_model_inputs`)
+    `PANs_path`: str (default=None)
+        CSV file of the PANs (columns "school" and "pan{PAN_year}"). The queries must then give the PAN of every school if not provided
+    `PAN_year`: int (default=2024)
+        Year of the base PANs
+    `age_factor`: float (default=0.19288)
+        Share of the 5 to 9 year olds estimated to be 5 years old
+    `crs`: int (default=27700)
+        EPSG code of the projected CRS used to measure distances
+    `cache_size`: int (default=256)
+        Number of answers kept in the LRU cache
+    `workers`: int (default=None)
+        Number of worker processes of the random ensembles (the number of CPUs if not provided)
+
+    Returns
+    -------
+    Dictionary with the state of the service
+    """
+    paths = (schools_path, students_path, catchment_path)
+    inputs = load_model_inputs(*paths, age_factor=age_factor, crs=crs, mmap_mode="r")
+    target_PAN = models.extract_PANs(pd.read_csv(PANs_path), PAN_year) if PANs_path is not None else {}
+    return {
+        "inputs": inputs,
+        "target_PAN": target_PAN,
+        "PAN_year": PAN_year,
+        "cache": OrderedDict(),
+        "cache_size": cache_size,
+        "pending": {},
+        # the workers load the prepared inputs from the cache on disk (the distances are memory-mapped, not copied),
+        # and are started fresh rather than forked from the threads of the service
+        "executor": ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context("spawn"), initializer=init_service_worker, initargs=(paths, age_factor, crs),
+        ),
+    }
+
+## Query with the default values and the PANs of all the schools, and its key in the cache (the same scenario has the same key)
+# unknown models and schools raise a ValueError (answered with a 400)
+def normalise_query(state, query):
+    query = {**query_defaults, **query}
+    if query["model"] not in service_models:
+        raise ValueError(f"unknown model {query['model']!r}")
+    school_strs = set(state["inputs"]["schools"]["establishment_name"])
+    unknown = [school_str for school_str in query["target_PAN"] if school_str not in school_strs]
+    if unknown:
+        raise ValueError(f"unknown schools in target_PAN: {', '.join(map(repr, unknown))}")
+    query["target_PAN"] = {**state["target_PAN"], **{school_str: int(PAN) for school_str, PAN in query["target_PAN"].items()}}
+    parameters = ["model", "target_PAN", "assignment"]
+    if query["model"] in ("schools", "catchment_schools"): parameters.append("initial_school")
+    if query["model"] == "flow": parameters.append("catchment_penalty")
+    if query["model"] == "random": parameters += ["n_runs", "seed"]
+    query = {key: query[key] for key in parameters}
+    return query, json.dumps(query, sort_keys=True)
+
+## Values of a DataFrame or of arrays that can be written as JSON (NaN as null)
+def json_values(values):
+    return [None if isinstance(value, float) and math.isnan(value) else value for value in np.asarray(values).tolist()]
+
+## Answer a query with a deterministic model (in a thread of the service)
+def answer_query(inputs, query):
+    schools, students = inputs["schools"], inputs["students"]
+    school_strs = list(schools["establishment_name"])
+    target_PAN = query["target_PAN"]
+    if query["model"] in ("LSOAs", "catchment_LSOAs"):
+        # the LSOA-driven models take the PANs as a DataFrame of a PAN year
+        PANs = pd.DataFrame({"school": school_strs, "pan2024": [target_PAN[school_str] for school_str in school_strs]})
+        result = service_models[query["model"]](schools, students, PANs, PAN_year=2024, dist_matrix=inputs["dist_matrix"])
+    elif query["model"] == "flow":
+        result = models.Optimise_PANs_Flow(schools, students, target_PAN, catchment_penalty=query["catchment_penalty"], dist_matrix=inputs["dist_matrix"])
+    else:
+        result = service_models[query["model"]](schools, students, target_PAN, initial_school=query["initial_school"], dist_matrix=inputs["dist_matrix"])
+    answer = {"KPIs": {"school": school_strs, **{name: json_values(values) for name, values in result["KPIs"].items()}}}
+    if query["assignment"]:
+        school = result["school"].astype(np.int64)
+        answer["assignment"] = [school_strs[i] if i >= 0 else None for i in school]
+    return answer
+
+### Worker processes of the random ensembles
+service_worker_inputs = None
+
+def init_service_worker(paths, age_factor, crs):
+    global service_worker_inputs
+    service_worker_inputs = load_model_inputs(*paths, age_factor=age_factor, crs=crs, mmap_mode="r")
+
+## Answer a query with the random model (in a worker process)
+def answer_random_query(query):
+    inputs = service_worker_inputs
+    accumulator = models.Random_PANsCatchment_schools(
+        inputs["schools"], inputs["students"], query["target_PAN"],
+        n_runs=query["n_runs"], dist_matrix=inputs["dist_matrix"], seed=query["seed"], accumulate=True,
+    )
+    summary = ensemble_summary(accumulator)
+    return {"KPIs": {"school": list(summary.index), **{name: json_values(summary[name]) for name in summary.columns}}}
+
+async def handle_query(state, query):
+    """
+    A function that answers a query: from the LRU cache if the scenario was answered recently,
+    otherwise with the model in a thread (or in a worker process for "random"), without blocking the other queries.
+    Queries of a scenario being answered wait for the same answer.
+
+    Parameters
+    ----------
+    `state`: dict
+        State of the service (see `load_service`)
+    `query`: dict
+        Query, including:
+            - "model": "schools", "catchment_schools", "LSOAs", "catchment_LSOAs", "flow" or "random" (default="catchment_schools"),
+            - "target_PAN": dictionary of the PANs, replacing the base PANs of these schools,
+            - "initial_school" (school-driven models), "catchment_penalty" ("flow"), "n_runs" and "seed" ("random"),
+            - "assignment": whether to include the school of each LSOA (default=False)
+
+    Returns
+    -------
+    Dictionary with the "KPIs" of each school (see `metrics.assignment_KPIs`, or `ensemble.ensemble_summary` for "random"),
+    "assignment" if requested, and "cached": whether the answer was in the cache.
+    A ValueError is raised for unknown models or schools (see `normalise_query`)
+    """
+    query, key = normalise_query(state, query)
+    cache = state["cache"]
+    if key in cache:
+        cache.move_to_end(key)
+        return {**cache[key], "cached": True}
+    ## a single run of the model for the queries of the same scenario
+    if key not in state["pending"]:
+        loop = asyncio.get_running_loop()
+        if query["model"] == "random":
+            future = loop.run_in_executor(state["executor"], answer_random_query, query)
+        else:
+            future = asyncio.ensure_future(asyncio.to_thread(answer_query, state["inputs"], query))
+        state["pending"][key] = future
+    try:
+        answer = await asyncio.shield(state["pending"][key])
+    finally:
+        if state["pending"].get(key) is not None and state["pending"][key].done():
+            del state["pending"][key]
+    cache[key] = answer
+    cache.move_to_end(key)
+    while len(cache) > state["cache_size"]:
+        cache.popitem(last=False)
+    return {**answer, "cached": False}
+
+## Write a JSON response
+async def respond(writer, status, body):
+    payload = json.dumps(body).encode()
+    writer.write(
+        f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload
+    )
+    await writer.drain()
+    writer.close()
+
+## Answer an HTTP request (POST /query, GET /health)
+async def handle_connection(state, reader, writer):
+    try:
+        method, path, _ = (await reader.readline()).decode().split(" ", 2)
+        headers = {}
+        while (line := (await reader.readline()).decode().strip()):
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers.get("content-length", 0)))
+        if method == "GET" and path == "/health":
+            return await respond(writer, "200 OK", {"status": "ok", "cached": len(state["cache"]), "pending": len(state["pending"])})
+        if method != "POST" or path != "/query":
+            return await respond(writer, "404 Not Found", {"error": f"{method} {path} not found"})
+        answer = await handle_query(state, json.loads(body or b"{}"))
+        await respond(writer, "200 OK", answer)
+    except (KeyError, ValueError, TypeError) as error:
+        # unknown schools or models, and malformed requests
+        await respond(writer, "400 Bad Request", {"error": repr(error)})
+    except Exception as error:
+        await respond(writer, "500 Internal Server Error", {"error": repr(error)})
+
+## Run the service until it is stopped
+async def serve(state, host="127.0.0.1", port=8765):
+    server = await asyncio.start_server(lambda reader, writer: handle_connection(state, reader, writer), host, port)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        state["executor"].shutdown(cancel_futures=True)
+
+if __name__ == "__main__":
+    ## python service.py schools.geojson students.geojson catchment.geojson --PANs Yr7_admissions.csv
+    parser = argparse.ArgumentParser(description="What-if service of the PAN and catchment models")
+    parser.add_argument("schools")
+    parser.add_argument("students")
+    parser.add_argument("catchment")
+    parser.add_argument("--PANs", default=None)
+    parser.add_argument("--PAN-year", type=int, default=2024)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--cache-size", type=int, default=256)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    state = load_service(args.schools, args.students, args.catchment, args.PANs, args.PAN_year, cache_size=args.cache_size, workers=args.workers)
+    asyncio.run(serve(state, args.host, args.port))
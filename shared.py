@@ -0,0 +1,61 @@
+import mmap
+import os
+import tempfile
+import numpy as np
+
+### Arrays shared with worker processes through memory-mapped files (zero-copy)
+# the workers receive a small description of each array instead of a pickled copy,
+# and map the same pages of the file (in shared memory where available), so their memory stays flat as workers are added
+## Default location of the files: shared memory if the system has it, otherwise the temporary directory
+shared_directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+## Whether an array is a whole memory-mapped file (e.g. `np.load(path, mmap_mode="r")`), which can be shared as it is
+def is_mapped(array):
+    return isinstance(array, np.memmap) and isinstance(array.base, mmap.mmap)
+
+## Description of the mapping of an array, enough to map it again in another process
+def mapping(path, offset, array):
+    order = "F" if array.flags.f_contiguous and not array.flags.c_contiguous else "C"
+    return {"filename": path, "offset": offset, "dtype": array.dtype.str, "shape": array.shape, "order": order}
+
+def share_inputs(inputs, directory, min_bytes=1 << 16):
+    """
+    A function that writes the NumPy arrays of the numeric inputs of a model (e.g. see `models.random_model_inputs`)
+    to memory-mapped files, so worker processes can attach to them (see `attach_inputs`) instead of receiving copies.
+    Arrays that are already memory-mapped files (e.g. the distance matrix loaded with `np.load(path, mmap_mode="r")`) are not written again.
+
+    Parameters
+    ----------
+    `inputs`: dict
+        Inputs of the model
+    `directory`: str
+        Directory of the files (e.g. a `tempfile.TemporaryDirectory` in `shared_directory`, removed once the workers are done)
+    `min_bytes`: int (default=65536)
+        Smaller arrays are left in `inputs` (sent to the workers as copies)
+
+    Returns
+    -------
+    Dictionary with the same entries as `inputs`, except the arrays written to files,
+    and "shared_arrays": dictionary with the mapping of each array written to a file
+    """
+    shared = {"shared_arrays": {}}
+    for name, value in inputs.items():
+        if is_mapped(value):
+            shared["shared_arrays"][name] = mapping(value.filename, value.offset, value)
+        elif isinstance(value, np.ndarray) and value.nbytes >= min_bytes and value.size > 0:
+            path = os.path.join(directory, f"{name}.bin")
+            array = np.memmap(path, dtype=value.dtype, mode="w+", shape=value.shape)
+            array[...] = value
+            array.flush()
+            shared["shared_arrays"][name] = mapping(path, 0, array)
+            del array
+        else:
+            shared[name] = value
+    return shared
+
+## Inputs with the shared arrays mapped read-only (in the worker processes)
+def attach_inputs(shared):
+    inputs = {name: value for name, value in shared.items() if name != "shared_arrays"}
+    for name, description in shared.get("shared_arrays", {}).items():
+        inputs[name] = np.memmap(mode="r", **description)
+    return inputs
@@ -0,0 +1,132 @@
+import itertools
+import numpy as np
+import pandas as pd
+from models import build_distance_matrix, catchment_matrix, order_schools, distance_queues, assign_from_queues, assignment_state
+from metrics import assignment_KPIs, assigned_distances
+
+### Sweeps of PAN scenarios over shared precomputed inputs
+## All the combinations of the PANs in `options` (school names as keys and lists of PANs as values), 
+# the PANs of the other schools are taken from `base_PAN`
+def PAN_grid(base_PAN, options):
+    school_strs = list(options)
+    return [{**base_PAN, **dict(zip(school_strs, values))} for values in itertools.product(*options.values())]
+
+## Number of events of a solved assignment (log, solved with the PANs `previous_target`) that are the same with the PANs `target`
+# and the students of each LSOA `est` (LSOAs, or realisations x LSOAs for a number for each realisation; the students of the log if not provided).
+# The assignment only depends on the PANs and the students through the PAN checks, so the events are the same until the first check with a different outcome
+# (and, if `skip_zero_PAN`, until the last school is saturated if a PAN changed to or from 0: the schools with a PAN of 0 are then skipped).
+# This is the rule of every warm start (the sweeps, the demand ensembles and the projections)
+def shared_events(log, previous_target, target, skip_zero_PAN, est=None):
+    kind, i_schools, i_lsoas = log["kind"], log["school"], log["lsoa"]
+    n_events = len(kind)
+    if est is None:
+        ## the same students: the checks of the schools whose PAN changed, with the students in the school of the log
+        changed = previous_target != target
+        fits = log["value"] < target[i_schools]
+        differs = ((kind != 3) & changed[i_schools] & (fits != (kind == 0)))[np.newaxis, :]
+    else:
+        est = np.asarray(est)
+        ## students in the school before each event with the students `est` (cumulative sums of the events of each school)
+        est_events = est[..., i_lsoas].reshape(-1, n_events)
+        added = np.where(kind != 2, est_events, 0)
+        by_school = np.argsort(i_schools, kind="stable")
+        before = np.cumsum(added[:, by_school], axis=1) - added[:, by_school]
+        first_of_school = np.searchsorted(i_schools[by_school], i_schools[by_school], side="left")
+        students_before = np.empty_like(before)
+        students_before[:, by_school] = before - before[:, first_of_school]
+        fits = students_before + est_events < target[i_schools]
+        differs = (kind != 3) & (fits != (kind == 0))
+    first = np.where(differs.any(axis=1), np.argmax(differs, axis=1), n_events) if n_events > 0 else np.zeros(len(differs), dtype=np.int64)
+    ## the step where the last school was saturated (the first step with all schools saturated)
+    if skip_zero_PAN and ((previous_target > 0) != (target > 0)).any():
+        i_saturated = np.flatnonzero((kind == 1) | (kind == 2))
+        if len(i_saturated) == len(target):
+            first = np.minimum(first, int(i_saturated[-1]))
+    return int(first[0]) if est is None or np.ndim(est) == 1 else first
+
+def sweep_PANs(
+        schools,
+        students_lsoa,
+        scenarios,
+        catchments=True,
+        initial_school="Dorothy Stringer School",
+        dist_matrix=None,
+        warm_start=True,
+        ):
+    """
+    A function that runs a school-driven model (`Optimise_PANsCatchment_Schools`, or `Optimise_PANs_Schools` if not `catchments`)
+    for a number of PAN scenarios, sharing the distances, the school order and the queues of LSOAs between the scenarios.
+    With `warm_start`, each scenario starts from the solved scenario that shares the most steps with it
+    (the steps before the first PAN check that has a different outcome), giving the same assignment as solving it from scratch.
+    The `schools` and `students_lsoa` DataFrames are not modified.
+
+    Parameters
+    ----------
+    `schools`: GeoPandas DataFrame
+        School locations as points
+    `students_lsoa`: GeoPandas DataFrame
+        LSOAs including an attribute for the number of students "5_est"
+    `scenarios`: list or dict of dict
+        PANs of each scenario (school names as keys and PANs as values, see `PAN_grid`). 
+        If a dict, the keys are used as the names of the scenarios
+    `catchments`: bool (default=True)
+        Whether the model is constrained to the catchments
+    `initial_school`: str (default="Dorothy Stringer School")
+        The initial school in the optimisation loop
+    `dist_matrix`: NumPy array (default=None)
+        Distances between the schools and the LSOAs (see `build_distance_matrix`). Calculated if not provided
+    `warm_start`: bool (default=True)
+        Whether to start each scenario from the closest solved scenario
+
+    Returns
+    -------
+    Pandas DataFrame with a row for each scenario and school, including the columns
+    "scenario", "school", "PAN", "students_total", "over_PAN", "under_PAN", "distance" (average in miles),
+    "students_outside_catchment", "share_outside_catchment", "distance_outside_catchment" (average in miles), "students_3_miles" and "students_external"
+    (see `metrics.assignment_KPIs`)
+    """
+    ## inputs shared by all the scenarios
+    if dist_matrix is None:
+        dist_matrix = build_distance_matrix(schools, students_lsoa)
+    school_strs = list(schools["establishment_name"])
+    rows = {school_str: i for i, school_str in enumerate(school_strs)}
+    order = [rows[school_str] for school_str in order_schools(schools, initial_school)]
+    in_catchment = catchment_matrix(schools, students_lsoa) if catchments else None
+    queues, queue_all, queue_in = distance_queues(dist_matrix, in_catchment)
+    est = students_lsoa["5_est"].to_numpy(dtype=np.int64)
+    ## catchment of the LSOAs and of the schools, for the KPIs of the students from outside the catchment
+    has_catchments = "catchment_ID" in schools and "catchment_ID" in students_lsoa
+    lsoa_catchment = students_lsoa["catchment_ID"].to_numpy() if has_catchments else None
+    school_catchment = schools["catchment_ID"].to_numpy() if has_catchments else None
+    if isinstance(scenarios, dict): scenario_names, scenarios = list(scenarios), list(scenarios.values())
+    else: scenario_names = list(range(len(scenarios)))
+
+    ## solve the scenarios
+    solved = []
+    results = []
+    for scenario_name, target_PAN in zip(scenario_names, scenarios):
+        target = np.array([target_PAN[school_str] for school_str in school_strs], dtype=np.int64)
+        ## start from the solved scenario that shares the most events
+        resume, prefix = None, None
+        if warm_start and len(solved) > 0:
+            shared = [shared_events(log, previous_target, target, catchments) for previous_target, log in solved]
+            i_best = int(np.argmax(shared))
+            if shared[i_best] > 0:
+                log = solved[i_best][1]
+                prefix = {key: values[:shared[i_best]] for key, values in log.items()}
+                resume = assignment_state(log, shared[i_best], est, len(school_strs))
+        outcome = assign_from_queues(est, target, order, queues, queue_all, queue_in, skip_zero_PAN=catchments, log=True, resume=resume)
+        log = outcome["log"]
+        if prefix is not None:
+            log = {key: np.concatenate([prefix[key], log[key]]) for key in log}
+        solved.append((target, log))
+        ## KPIs of the scenario
+        KPIs = pd.DataFrame(assignment_KPIs(
+            outcome["school"], est, assigned_distances(dist_matrix, outcome["school"]), target,
+            students_total=outcome["students_total"], lsoa_catchment=lsoa_catchment, school_catchment=school_catchment, external=outcome["external"],
+        ))
+        KPIs.insert(0, "school", school_strs)
+        KPIs.insert(0, "scenario", scenario_name)
+        results.append(KPIs)
+
+    return pd.concat(results, ignore_index=True)
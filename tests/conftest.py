@@ -0,0 +1,17 @@
+import os
+import sys
+import pytest
+
+## the modules of the repository are imported from its root (flat layout)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models
+from benchmarks import synthetic_inputs
+
+## Small seeded synthetic inputs, prepared for the models (see `benchmarks.synthetic_inputs`)
+@pytest.fixture(scope="session")
+def inputs():
+    inputs = synthetic_inputs(8, 200, 4, 0)
+    models.reset_parameters(inputs["catchment"], inputs["schools"], inputs["students"])
+    inputs["dist_matrix"] = models.build_distance_matrix(inputs["schools"], inputs["students"])
+    return inputs
@@ -0,0 +1,15 @@
+import benchmarks
+
+def test_import_check_reports_every_failure(monkeypatch):
+    monkeypatch.setattr(benchmarks, "measure_import_time", lambda module, repeat: ([1.0] * repeat, ["pandas"]))
+    results = benchmarks.run_benchmarks(sizes=(), output=False)
+    assert results["error"][0] == f"over the import time budget ({benchmarks.import_time_budget} s); loads pandas"
+
+def test_flow_case_reports_the_time_budget(monkeypatch):
+    monkeypatch.setattr(benchmarks, "measure_import_time", lambda module, repeat: ([0.1] * repeat, []))
+    monkeypatch.setattr(benchmarks, "flow_benchmark_size", (20, 300))
+    monkeypatch.setattr(benchmarks, "flow_time_budget", 0.0)
+    results = benchmarks.run_benchmarks(sizes=("flow",), repeat=1, output=False)
+    flow = results[results["size"] == "flow"].iloc[0]
+    assert (flow["n_schools"], flow["n_lsoas"], flow["case"]) == (20, 300, "min_cost_assignment")
+    assert flow["error"] == "over the flow time budget (0.0 s)"
@@ -0,0 +1,44 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import cache
+from benchmarks import synthetic_inputs
+from cache import load_model_inputs, write_atomic
+
+def test_interrupted_write_leaves_no_file(tmp_path):
+    path = str(tmp_path / "runs_000000000.npz")
+    def interrupted(file):
+        file.write(b"PK")
+        raise KeyboardInterrupt
+    with pytest.raises(KeyboardInterrupt):
+        write_atomic(path, interrupted)
+    assert os.listdir(tmp_path) == []
+    write_atomic(path, lambda file: np.savez(file, distances=np.arange(3)))
+    with np.load(path) as runs:
+        assert runs["distances"].tolist() == [0, 1, 2]
+    assert os.listdir(tmp_path) == ["runs_000000000.npz"]
+
+def test_cached_inputs_match_the_prepared_inputs(tmp_path, monkeypatch):
+    inputs = synthetic_inputs(6, 100, 3, 2)
+    paths = []
+    for name in ("schools", "students", "catchment"):
+        paths.append(str(tmp_path / f"{name}.geojson"))
+        inputs[name].to_file(paths[-1])
+    cold = load_model_inputs(*paths, cache_dir=str(tmp_path / "cache"))
+    assert len(os.listdir(tmp_path / "cache")) == 1
+    ## the second call reads the prepared inputs from the cache, without the input files
+    monkeypatch.setattr(cache.gpd, "read_file", None)
+    warm = load_model_inputs(*paths, cache_dir=str(tmp_path / "cache"), mmap_mode="r")
+    for name in ("catchment", "schools", "students"):
+        pd.testing.assert_frame_equal(warm[name], cold[name])
+    assert isinstance(warm["dist_matrix"], np.memmap)
+    np.testing.assert_array_equal(warm["dist_matrix"], cold["dist_matrix"])
+    ## an edited input file is prepared again
+    monkeypatch.undo()
+    inputs["students"].assign(**{"5_9_total": inputs["students"]["5_9_total"] + 1}).to_file(paths[1])
+    edited = load_model_inputs(*paths, cache_dir=str(tmp_path / "cache"))
+    assert (edited["students"]["5_est"] >= cold["students"]["5_est"]).all()
+    assert len(os.listdir(tmp_path / "cache")) == 2
@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+import pytest
+from shapely import box
+
+import models
+from benchmarks import synthetic_inputs
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_update_catchments_matches_a_full_rebuild(seed):
+    inputs = synthetic_inputs(12, 300, 5, seed)
+    catchment, schools, students = inputs["catchment"], inputs["schools"], inputs["students"]
+    models.reset_parameters(catchment, schools, students)
+    ## a planner grows the first catchment over its neighbours and shrinks the second one
+    extent = box(*catchment.total_bounds)
+    geoms = catchment.geometry.to_numpy()
+    changed = {1: geoms[0].buffer(1500).intersection(extent), 2: geoms[1].buffer(-400)}
+    updated = models.update_catchments(catchment, schools, students, changed)
+    assert updated["students"].any()
+
+    rebuilt = synthetic_inputs(12, 300, 5, seed)
+    rebuilt["catchment"].loc[rebuilt["catchment"].index[:2], "geometry"] = list(changed.values())
+    models.reset_parameters(rebuilt["catchment"], rebuilt["schools"], rebuilt["students"])
+    for frame in ("schools", "students"):
+        pd.testing.assert_frame_equal(inputs[frame], rebuilt[frame])
+    ## the flags are the schools and LSOAs whose catchment changed
+    np.testing.assert_array_equal(updated["students"], students["catchment_ID"].to_numpy() != synthetic_reset(seed)["students"]["catchment_ID"].to_numpy())
+
+## The inputs prepared with the original catchments
+def synthetic_reset(seed):
+    inputs = synthetic_inputs(12, 300, 5, seed)
+    models.reset_parameters(inputs["catchment"], inputs["schools"], inputs["students"])
+    return inputs
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+import models
+from benchmarks import synthetic_flow_instance
+
+## Total cost of an assignment with the students beyond the capacities at their cheapest school
+def total_cost(outcome, cost):
+    return outcome["cost"] + float((outcome["overflow"] * cost.min(axis=0)).sum())
+
+@pytest.mark.parametrize("pan_scale", [1.1, 0.8])
+def test_min_cost_assignment_matches_shortest_paths(pan_scale):
+    pytest.importorskip("scipy")
+    cost, supply, capacity = synthetic_flow_instance(30, 400, seed=1, pan_scale=pan_scale)
+    outcome = models.min_cost_assignment(cost, supply, capacity, n_candidates=2)
+    reference = models.shortest_paths_assignment(cost, supply, capacity)
+    assert total_cost(outcome, cost) == pytest.approx(total_cost(reference, cost), rel=1e-9)
+    ## within the capacities, and every student assigned
+    flows = outcome["flows"]
+    assert (np.bincount(flows["school"], weights=flows["students"], minlength=len(capacity)) <= capacity).all()
+    assert (np.bincount(flows["lsoa"], weights=flows["students"], minlength=len(supply)) + outcome["overflow"] == supply).all()
+    assert outcome["overflow"].sum() == max(supply.sum() - capacity.sum(), 0)
+
+def test_flow_bounds_cover_the_students_beyond_the_PANs(inputs):
+    target_PAN = {school_str: PAN // 2 for school_str, PAN in inputs["target_PAN"].items()}
+    result = models.Optimise_PANs_Flow(inputs["schools"], inputs["students"], target_PAN, dist_matrix=inputs["dist_matrix"])
+    est = inputs["students"]["5_est"].to_numpy()
+    assert result["overflow_students"] == est.sum() - sum(target_PAN.values())
+    assert result["overflow_students"] > 0
+    assert result["lower_bound_total"] > result["lower_bound"]
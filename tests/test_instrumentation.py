@@ -0,0 +1,19 @@
+import models
+
+def test_random_model_observes_each_task_of_runs(inputs):
+    events = []
+    outcome = models.Random_PANsCatchment_schools(
+        inputs["schools"], inputs["students"], inputs["target_PAN"], n_runs=10, dist_matrix=inputs["dist_matrix"],
+        seed=0, batch_size=4, observer=lambda *event: events.append(event), instrument=True,
+    )
+    metrics = outcome[-1]
+    ## tasks of 4, 4 and 2 runs
+    assert [(runs, done) for runs, done, seconds in events] == [(4, 4), (4, 8), (2, 10)]
+    assert metrics["counters"]["batches"] == 3
+    assert metrics["counters"]["runs"] == 10
+    assert metrics["batches"] == [seconds for runs, done, seconds in events]
+    ## the observer does not change the runs
+    plain = models.Random_PANsCatchment_schools(
+        inputs["schools"], inputs["students"], inputs["target_PAN"], n_runs=10, dist_matrix=inputs["dist_matrix"], seed=0, batch_size=4,
+    )
+    assert outcome[:-1] == plain
@@ -0,0 +1,29 @@
+import shutil
+
+from jobs import job_defaults, job_fingerprint
+
+## A random job on small input files written to `directory`
+def write_job(directory, students="L1,20\n"):
+    directory.mkdir(exist_ok=True)
+    for name, content in (("schools", "S1\n"), ("students", students), ("catchment", "C1\n"), ("PANs", "school,pan2024\nS1,10\n")):
+        (directory / f"{name}.csv").write_text(content)
+    return {
+        **job_defaults,
+        "job": "random",
+        "inputs": {name: str(directory / f"{name}.csv") for name in ("schools", "students", "catchment")},
+        "PANs": str(directory / "PANs.csv"),
+        "output": str(directory / "job"),
+    }
+
+def test_job_fingerprint_follows_the_contents_of_the_inputs(tmp_path):
+    job = write_job(tmp_path / "a")
+    fingerprint = job_fingerprint(job)
+    ## the same files elsewhere, or with other execution parameters: same job
+    moved = write_job(tmp_path / "b")
+    assert job_fingerprint(dict(moved, workers=4)) == fingerprint
+    ## an input file edited in place: another job
+    (tmp_path / "a" / "students.csv").write_text("L1,25\n")
+    assert job_fingerprint(job) != fingerprint
+    shutil.copy(tmp_path / "b" / "students.csv", tmp_path / "a" / "students.csv")
+    (tmp_path / "a" / "PANs.csv").write_text("school,pan2024\nS1,12\n")
+    assert job_fingerprint(job) != fingerprint
@@ -0,0 +1,62 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import models
+
+## School (row of the schools) of each LSOA of the `inputs` fixture with the base PANs (and "School 0" as the initial school),
+# as assigned by the original models (the DataFrame loops before the array engines).
+# `Optimise_PANsCatchment_LSOAs` is the outcome of the current model: the original loop added some LSOAs twice
+with open(os.path.join(os.path.dirname(__file__), "expected_assignments.json")) as file:
+    expected_assignments = json.load(file)
+
+def PANs_frame(target_PAN):
+    return pd.DataFrame({"school": list(target_PAN), "pan2024": list(target_PAN.values())})
+
+@pytest.mark.parametrize("model", ["Optimise_PANs_Schools", "Optimise_PANsCatchment_Schools"])
+def test_school_driven_models_match_the_original_loops(inputs, model):
+    result = getattr(models, model)(inputs["schools"], inputs["students"], inputs["target_PAN"], initial_school="School 0", dist_matrix=inputs["dist_matrix"])
+    np.testing.assert_array_equal(result["school"], expected_assignments[model])
+    est = inputs["students"]["5_est"].to_numpy()
+    np.testing.assert_array_equal(result["students_total"], np.bincount(result["school"], weights=est, minlength=len(inputs["schools"])))
+
+@pytest.mark.parametrize("model", ["Optimise_PANs_LSOAs", "Optimise_PANsCatchment_LSOAs"])
+def test_LSOA_driven_models_match_the_expected_assignments(inputs, model):
+    result = getattr(models, model)(inputs["schools"], inputs["students"], PANs_frame(inputs["target_PAN"]), dist_matrix=inputs["dist_matrix"])
+    np.testing.assert_array_equal(result["school"], expected_assignments[model])
+
+def test_models_do_not_modify_the_inputs(inputs):
+    schools, students = inputs["schools"].copy(), inputs["students"].copy()
+    result = models.Optimise_PANsCatchment_Schools(inputs["schools"], inputs["students"], inputs["target_PAN"], initial_school="School 0")
+    pd.testing.assert_frame_equal(inputs["schools"], schools)
+    pd.testing.assert_frame_equal(inputs["students"], students)
+    ## the DataFrames of the outcome have the assignment
+    school_strs = inputs["schools"]["establishment_name"].to_numpy()
+    assert (result["students"]["school"].to_numpy() == school_strs[result["school"]]).all()
+
+@pytest.mark.parametrize("share", [1.0, 0.5])
+def test_LSOA_cursor_matches_a_scan_of_the_preferences(inputs, share):
+    ## each LSOA takes the closest school with enough places left (schools without enough places are saturated for good),
+    # the schools within the catchment first for the catchment variant
+    est = inputs["students"]["5_est"].to_numpy()
+    target = [int(PAN * share) for PAN in inputs["target_PAN"].values()]
+    preferences = models.school_preferences(inputs["dist_matrix"])
+    in_catchment = models.catchment_matrix(inputs["schools"], inputs["students"])
+    for catchments in (None, in_catchment):
+        outcome = models.assign_schools_by_LSOA(preferences, est, target, in_catchment=catchments)
+        spare, saturated = np.array(target), np.zeros(len(target), dtype=bool)
+        expected = np.full(len(est), -1)
+        for l in range(len(est)):
+            candidates = preferences[l] if catchments is None else sorted(preferences[l], key=lambda s: not catchments[s, l])
+            for s in candidates:
+                if saturated[s]: continue
+                if est[l] <= spare[s]:
+                    spare[s] -= est[l]
+                    expected[l] = s
+                    break
+                saturated[s] = True
+        np.testing.assert_array_equal(outcome["school"], expected)
+        np.testing.assert_array_equal(outcome["students_total"], np.array(target) - spare)
@@ -0,0 +1,46 @@
+import os
+
+import geopandas as gpd
+import numpy as np
+import pytest
+from shapely import LineString, Point, box
+
+import network
+
+## Roads of a small town: a path of 300 m from the school (the second line starts 0.2 m away from the end of the first),
+# and a road not connected to it
+@pytest.fixture
+def town(tmp_path):
+    roads = gpd.GeoDataFrame(geometry=[
+        LineString([(0, 0), (100, 0), (200, 0)]),
+        LineString([(200.2, 0.1), (200, 100)]),
+        LineString([(1000, 1000), (1100, 1000)]),
+    ], crs=27700)
+    path = str(tmp_path / "roads.gpkg")
+    roads.to_file(path)
+    schools = gpd.GeoDataFrame(geometry=[Point(0, 0)], crs=27700)
+    students = gpd.GeoDataFrame(geometry=[box(190, 90, 210, 110), box(1090, 990, 1110, 1010)], crs=27700)
+    return network.load_road_graph(path), schools, students
+
+def test_load_road_graph_makes_a_node_of_every_vertex(town):
+    graph = town[0]
+    # the ends at (200, 0) and (200.2, 0.1) round to the same point of the grid
+    assert len(graph["nodes"]) == 6
+    assert network.costs_from_sources(graph, [0]).tolist() == [network.shortest_costs(graph, 0).tolist()]
+
+def test_network_cost_matrix_follows_the_roads(town, tmp_path):
+    graph, schools, students = town
+    dist_matrix = network.network_cost_matrix(graph, schools, students, cache_dir=None)
+    # along the roads to the centroid of the first LSOA
+    assert dist_matrix[0, 0] == pytest.approx(300, abs=0.5)
+    # no road to the second LSOA: twice the straight line to its centroid
+    assert dist_matrix[0, 1] == pytest.approx(2 * np.hypot(1100, 1000))
+
+def test_network_cost_matrix_is_cached(town, tmp_path, monkeypatch):
+    graph, schools, students = town
+    cold = network.network_cost_matrix(graph, schools, students, cache_dir=str(tmp_path / "cache"))
+    assert len(os.listdir(tmp_path / "cache" / "network")) == 1
+    ## the second call reads the matrix without any search
+    monkeypatch.setattr(network, "costs_from_sources", None)
+    warm = network.network_cost_matrix(graph, schools, students, cache_dir=str(tmp_path / "cache"))
+    assert np.array_equal(warm, cold)
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+import models
+from shapely import STRtree
+
+import partition
+from benchmarks import synthetic_inputs
+from partition import Partitioned_model, catchment_clusters, partition_groups, run_subset
+
+def test_random_model_is_rejected(inputs):
+    with pytest.raises(ValueError):
+        Partitioned_model(models.Random_PANsCatchment_schools, inputs["schools"], inputs["students"], inputs["target_PAN"], n_runs=2)
+
+def test_halo_can_leave_a_school_over_its_PAN(inputs):
+    target_PAN = inputs["target_PAN"]
+    outcome = Partitioned_model(
+        models.Optimise_PANs_Schools, inputs["schools"], inputs["students"], target_PAN, partition="catchment_ID", halo=3000, initial_school="School 0",
+    )
+    assert outcome["halo"].any()
+    students_total = outcome["schools"].set_index("establishment_name")["students_total"]
+    ## the partitions have enough places overall, but some of them have more students than places
+    assert sum(target_PAN.values()) >= inputs["students"]["5_est"].sum()
+    assert (students_total > students_total.index.map(target_PAN)).any()
+    ## every student is assigned, and the totals of the schools are the students of their LSOAs
+    students = outcome["students"]
+    assert (students["school"] != "").all()
+    assigned = students.groupby("school")["5_est"].sum().reindex(students_total.index, fill_value=0)
+    assert np.array_equal(assigned.to_numpy(), students_total.to_numpy())
+
+## Every LSOA has a school, the totals of the schools are the students of their LSOAs
+def check_assignment(outcome):
+    students_total = outcome["schools"].set_index("establishment_name")["students_total"]
+    students = outcome["students"]
+    assert (students["school"] != "").all()
+    assigned = students.groupby("school")["5_est"].sum().reindex(students_total.index, fill_value=0)
+    assert np.array_equal(assigned.to_numpy(), students_total.to_numpy())
+
+def test_partition_groups():
+    assert partition_groups(6, np.array([0, 3, 4]), np.array([1, 4, 5])).tolist() == [0, 0, 2, 3, 3, 3]
+    assert partition_groups(3, np.array([], dtype=np.int64), np.array([], dtype=np.int64)).tolist() == [0, 1, 2]
+
+def test_partitions_without_schools_are_attached(inputs):
+    schools, students = inputs["schools"], inputs["students"]
+    partition = catchment_clusters(students, 4)
+    ## a partition of LSOAs of partition 0 that are not the closest LSOA of any school
+    _, closest = STRtree(np.asarray(students["geometry"])).query_nearest(np.asarray(schools["geometry"]), all_matches=False)
+    empty = (partition == 0) & ~np.isin(np.arange(len(students)), closest)
+    partition[empty] = 9
+    outcome = Partitioned_model(models.Optimise_PANs_Schools, schools, students, inputs["target_PAN"], partition=partition, halo=0, initial_school="School 0")
+    assert np.array_equal(outcome["attached"], empty)
+    assert not (outcome["partition"] == 9).any()
+    check_assignment(outcome)
+
+def test_halo_groups_in_worker_processes_match_the_current_process(monkeypatch):
+    inputs = synthetic_inputs(24, 600, 12, 0)
+    models.reset_parameters(inputs["catchment"], inputs["schools"], inputs["students"])
+    options = dict(partition=catchment_clusters(inputs["students"], 8), halo=300, initial_school="School 0")
+    ## the halo is reassigned in separate groups of partitions
+    tasks = []
+    monkeypatch.setattr(partition, "run_partition", lambda task: tasks.append(task) or run_subset(*task))
+    serial = Partitioned_model(models.Optimise_PANs_Schools, inputs["schools"], inputs["students"], inputs["target_PAN"], **options)
+    monkeypatch.undo()
+    halo_tasks = tasks[len(np.unique(serial["partition"])):]
+    assert len(halo_tasks) > 1
+    assert sum(len(task[2]) for task in halo_tasks) == serial["halo"].sum()
+    parallel = Partitioned_model(models.Optimise_PANs_Schools, inputs["schools"], inputs["students"], inputs["target_PAN"], workers=2, **options)
+    assert serial["students"]["school"].tolist() == parallel["students"]["school"].tolist()
+    assert serial["schools"]["students_total"].tolist() == parallel["schools"]["students_total"].tolist()
+    check_assignment(parallel)
@@ -0,0 +1,29 @@
+import sys
+
+import numpy as np
+import pytest
+
+import models
+
+def test_random_model_runs_without_tqdm_nor_progress_output(inputs, monkeypatch, capsys):
+    # the import of tqdm fails
+    monkeypatch.setitem(sys.modules, "tqdm", None)
+    models.Random_PANsCatchment_schools(inputs["schools"], inputs["students"], inputs["target_PAN"], n_runs=3, dist_matrix=inputs["dist_matrix"], seed=0)
+    assert capsys.readouterr().err == ""
+
+@pytest.mark.parametrize("share", [1.0, 0.6])
+def test_random_batch_matches_random_run(inputs, share):
+    target_PAN = {school_str: int(PAN * share) for school_str, PAN in inputs["target_PAN"].items()}
+    random_inputs = models.random_model_inputs(inputs["schools"], inputs["students"], target_PAN, inputs["dist_matrix"])
+    seeds = np.random.SeedSequence(7).spawn(6)
+    batch = models.random_batch(random_inputs, seeds)
+    for k, seed in enumerate(seeds):
+        run = models.random_run(random_inputs, np.random.default_rng(seed))
+        for key in ("school", "students_total", "external"):
+            np.testing.assert_array_equal(batch[key][k], run[key])
+
+def test_random_model_does_not_depend_on_the_batches(inputs):
+    options = dict(n_runs=7, dist_matrix=inputs["dist_matrix"], seed=1)
+    one_by_one = models.Random_PANsCatchment_schools(inputs["schools"], inputs["students"], inputs["target_PAN"], **options)
+    batched = models.Random_PANsCatchment_schools(inputs["schools"], inputs["students"], inputs["target_PAN"], batch_size=3, **options)
+    assert one_by_one == batched
@@ -0,0 +1,54 @@
+import numpy as np
+import models
+
+## PANs too small for all the students, so the greedy assigns LSOAs beyond the PANs
+def oversubscribed(inputs, share=0.8):
+    return {school_str: int(PAN * share) for school_str, PAN in inputs["target_PAN"].items()}
+
+def greedy(inputs, target_PAN, **options):
+    schools, students = inputs["schools"], inputs["students"]
+    return models.Optimise_PANsCatchment_Schools(
+        schools, students, target_PAN, initial_school=schools["establishment_name"].iloc[0], dist_matrix=inputs["dist_matrix"], **options,
+    )
+
+def test_noop_refinement_keeps_external(inputs):
+    result = greedy(inputs, oversubscribed(inputs))
+    assert result["external"].sum() > 0
+    refined = models.refine_result(result, inputs["dist_matrix"], max_iterations=0)
+    assert refined["refinement"]["moves"] == refined["refinement"]["swaps"] == 0
+    np.testing.assert_array_equal(refined["school"], result["school"])
+    np.testing.assert_array_equal(refined["external"], result["external"])
+
+def test_refinement_keeps_external_flags_with_the_LSOAs(inputs):
+    result = greedy(inputs, oversubscribed(inputs))
+    refined = models.refine_result(result, inputs["dist_matrix"])
+    assert refined["refinement"]["moves"] + refined["refinement"]["swaps"] > 0
+    np.testing.assert_array_equal(refined["external"], result["external"])
+
+def test_refinement_improves_within_PANs_and_catchments(inputs):
+    result = greedy(inputs, inputs["target_PAN"])
+    refined = greedy(inputs, inputs["target_PAN"], refine=True)
+    refinement = refined["refinement"]
+    assert refinement["converged"]
+    ## the students outside their catchment never increase, then the distances decrease
+    assert refinement["improvement"]["students_outside_catchment"] >= 0
+    assert refinement["objective"][1] < refinement["objective"][0]
+    assert (refined["KPIs"]["over_PAN"] <= result["KPIs"]["over_PAN"]).all()
+    ## the totals and the reported values are those of the refined assignment
+    est = inputs["students"]["5_est"].to_numpy()
+    np.testing.assert_array_equal(refined["students_total"], np.bincount(refined["school"], weights=est, minlength=len(refined["target"])))
+    assert np.isclose(refinement["distx5_est"][1], float(np.nansum(refined["distance"].astype(float) * est)), rtol=1e-5)
+
+def test_refinement_with_catchment_penalty_reports_objective(inputs):
+    result = greedy(inputs, inputs["target_PAN"])
+    refined = models.refine_result(result, inputs["dist_matrix"], catchment_penalty=2000.0, neighbours=3)
+    improvement = refined["refinement"]["improvement"]
+    assert improvement["objective"] >= 0
+    before, after = refined["refinement"]["objective"]
+    assert np.isclose(before, refined["refinement"]["distx5_est"][0] + 2000.0 * refined["refinement"]["students_outside_catchment"][0])
+    assert after <= before
+
+def test_closest_schools_are_the_first_preferences(inputs):
+    dist_matrix = inputs["dist_matrix"]
+    for k in (1, 3, None):
+        np.testing.assert_array_equal(models.closest_schools(dist_matrix, k), models.school_preferences(dist_matrix)[:, :k])
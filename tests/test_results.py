@@ -0,0 +1,69 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import results
+from results import append_runs, compact_store, open_result_store, read_assignments, store_partitions, store_runs
+
+## A store of 3 schools and 5 LSOAs, with 4 appends of 2 runs
+def fill_store(directory):
+    store = open_result_store(str(directory), ["A", "B", "C"], [f"L{i}" for i in range(5)], format="npz")
+    rng = np.random.default_rng(0)
+    school = rng.integers(-1, 3, (8, 5))
+    for start in range(0, 8, 2):
+        append_runs(store, school[start:start + 2], [10, 20, 30], "random", seed=start // 2, run=[start, start + 1])
+    return store, school
+
+def test_append_and_read_runs(tmp_path):
+    store, school = fill_store(tmp_path)
+    assert len(store_partitions(store)) == 4
+    np.testing.assert_array_equal(read_assignments(store), school)
+    np.testing.assert_array_equal(read_assignments(store, seed=1), school[2:4])
+    assert store_runs(store, model="random")["run"].tolist() == list(range(8))
+    assert len(read_assignments(store, model="catchment_schools")) == 0
+    ## the store is reopened with its schools and LSOAs only
+    assert open_result_store(str(tmp_path), ["A", "B", "C"], [f"L{i}" for i in range(5)])["format"] == "npz"
+    with pytest.raises(ValueError):
+        open_result_store(str(tmp_path), ["A", "B"], [f"L{i}" for i in range(5)])
+
+def test_compaction_keeps_the_runs_in_bounded_partitions(tmp_path):
+    store, school = fill_store(tmp_path)
+    before = store_runs(store)
+    paths = compact_store(store, max_runs=5)
+    ## partitions of up to 5 runs: 2 + 2, 2 + 2
+    assert len(paths) == 2 and paths == store_partitions(store)
+    np.testing.assert_array_equal(read_assignments(store), school)
+    pd.testing.assert_frame_equal(store_runs(store), before)
+    assert sorted(os.listdir(tmp_path)) == sorted(["store.json"] + [os.path.basename(path) for path in paths])
+    ## the later appends stay after the compacted partitions
+    append_runs(store, school[:1], [10, 20, 30], "random", seed=9, run=[8])
+    assert len(compact_store(store)) == 1
+    np.testing.assert_array_equal(read_assignments(store), np.concatenate([school, school[:1]]))
+
+def test_interrupted_compaction_never_loses_or_repeats_runs(tmp_path, monkeypatch):
+    store, school = fill_store(tmp_path)
+    ## interrupted while removing the merged partitions: the ones left are skipped
+    remove = os.remove
+    removed = []
+    def interrupted_remove(path):
+        if path.endswith(".npz") and len(removed) == 1: raise KeyboardInterrupt
+        removed.append(path)
+        remove(path)
+    monkeypatch.setattr(results.os, "remove", interrupted_remove)
+    with pytest.raises(KeyboardInterrupt):
+        compact_store(store)
+    monkeypatch.setattr(results.os, "remove", remove)
+    assert any(name.startswith("compact-") for name in os.listdir(tmp_path))
+    np.testing.assert_array_equal(read_assignments(store), school)
+    ## interrupted before the merged partition was written: the manifest is ignored
+    manifest = {"partition": "part-0-missingc.npz", "replaced": [os.path.basename(path) for path in store_partitions(store)]}
+    with open(tmp_path / "compact-part-0-missingc.npz.json", "w") as file:
+        json.dump(manifest, file)
+    np.testing.assert_array_equal(read_assignments(store), school)
+    ## the next compaction finishes the interrupted ones
+    assert len(compact_store(store)) == 1
+    assert not any(name.startswith("compact-") for name in os.listdir(tmp_path))
+    np.testing.assert_array_equal(read_assignments(store), school)
@@ -0,0 +1,73 @@
+import asyncio
+import json
+from collections import OrderedDict
+
+import pytest
+
+import service
+
+## State of the service over the synthetic inputs (without the pool of processes of the random ensembles)
+@pytest.fixture
+def state(inputs):
+    return {
+        "inputs": inputs,
+        "target_PAN": dict(inputs["target_PAN"]),
+        "PAN_year": 2024,
+        "cache": OrderedDict(),
+        "cache_size": 2,
+        "pending": {},
+        "executor": None,
+    }
+
+## Writer of a response kept in memory
+class ResponseWriter:
+    def __init__(self):
+        self.data = b""
+    def write(self, data):
+        self.data += data
+    async def drain(self):
+        pass
+    def close(self):
+        pass
+
+async def send_request(state, request):
+    reader = asyncio.StreamReader()
+    reader.feed_data(request)
+    reader.feed_eof()
+    writer = ResponseWriter()
+    await service.handle_connection(state, reader, writer)
+    return writer
+
+def post_query(state, query):
+    body = json.dumps(query).encode()
+    writer = asyncio.run(send_request(state, f"POST /query HTTP/1.1\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body))
+    head, payload = writer.data.split(b"\r\n\r\n", 1)
+    return head.split(b"\r\n")[0].decode(), json.loads(payload)
+
+def test_normalise_query_fills_the_PANs_and_rejects_unknown_schools(state):
+    query, key = service.normalise_query(state, {"model": "schools", "target_PAN": {"School 1": "7"}, "initial_school": "School 0"})
+    assert query["target_PAN"] == {**state["target_PAN"], "School 1": 7}
+    assert service.normalise_query(state, {"initial_school": "School 0", "model": "schools", "target_PAN": {"School 1": 7.0}})[1] == key
+    with pytest.raises(ValueError, match="Nowhere School"):
+        service.normalise_query(state, {"target_PAN": {"Nowhere School": 30}})
+    with pytest.raises(ValueError, match="unknown model"):
+        service.normalise_query(state, {"model": "nearest"})
+
+def test_unknown_schools_are_bad_requests(state):
+    status, answer = post_query(state, {"model": "schools", "target_PAN": {"Nowhere School": 30}})
+    assert status == "HTTP/1.1 400 Bad Request"
+    assert "Nowhere School" in answer["error"]
+
+def test_answers_are_cached_by_scenario(state):
+    query = {"model": "schools", "initial_school": "School 0", "target_PAN": {"School 1": 5}}
+    status, first = post_query(state, query)
+    assert status == "HTTP/1.1 200 OK"
+    assert not first["cached"]
+    status, second = post_query(state, dict(query, n_runs=5))
+    assert second["cached"]
+    assert second["KPIs"] == first["KPIs"]
+    ## another scenario is a miss, and the cache keeps the `cache_size` latest scenarios
+    assert not post_query(state, dict(query, target_PAN={"School 1": 6}))[1]["cached"]
+    assert not post_query(state, dict(query, target_PAN={"School 1": 8}))[1]["cached"]
+    assert len(state["cache"]) == 2
+    assert not post_query(state, query)[1]["cached"]
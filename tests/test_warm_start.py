@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import models
+from demand import Demand_ensemble, demand_draws
+from ensemble import ensemble_accumulator, accumulate
+from projection import project_years
+from sweep import PAN_grid, shared_events, sweep_PANs
+
+### The warm-started sweeps, demand ensembles and projections give the same outcome as solving each case from scratch
+
+@pytest.mark.parametrize("catchments", [True, False])
+def test_sweep_warm_start_matches_cold(inputs, catchments):
+    base_PAN = inputs["target_PAN"]
+    # including PANs of 0, and PANs too small for all the students
+    scenarios = PAN_grid(base_PAN, {"School 1": [0, base_PAN["School 1"], 2 * base_PAN["School 1"]], "School 4": [base_PAN["School 4"] // 3, 0]})
+    scenarios.append({school_str: PAN // 2 for school_str, PAN in base_PAN.items()})
+    options = dict(catchments=catchments, initial_school="School 0", dist_matrix=inputs["dist_matrix"])
+    warm = sweep_PANs(inputs["schools"], inputs["students"], scenarios, **options)
+    cold = sweep_PANs(inputs["schools"], inputs["students"], scenarios, warm_start=False, **options)
+    pd.testing.assert_frame_equal(warm, cold)
+    ## and the same as the model
+    model = models.Optimise_PANsCatchment_Schools if catchments else models.Optimise_PANs_Schools
+    result = model(inputs["schools"], inputs["students"], scenarios[-1], initial_school="School 0", dist_matrix=inputs["dist_matrix"])
+    np.testing.assert_array_equal(warm["students_total"].to_numpy()[-len(base_PAN):], result["students_total"])
+
+@pytest.mark.parametrize("model", ["schools", "catchment_schools"])
+def test_demand_ensemble_matches_the_model_on_each_draw(inputs, model):
+    schools, students, target_PAN = inputs["schools"], inputs["students"], inputs["target_PAN"]
+    ensemble = Demand_ensemble(schools, students, target_PAN, model=model, n_draws=12, seed=3, dist_matrix=inputs["dist_matrix"], initial_school="School 0", batch_size=5)
+    ## the same draws, each solved from scratch by the model
+    run_model = models.Optimise_PANsCatchment_Schools if model == "catchment_schools" else models.Optimise_PANs_Schools
+    rng = np.random.default_rng(3)
+    expected = ensemble_accumulator(list(schools["establishment_name"]), metric_names=["students_total", "over_PAN"])
+    for start in range(0, 12, 5):
+        est = demand_draws(students["5_9_total"].to_numpy(), 0.19288, min(5, 12 - start), rng)
+        results = [run_model(schools, students.assign(**{"5_est": draw}), target_PAN, initial_school="School 0", dist_matrix=inputs["dist_matrix"]) for draw in est]
+        accumulate(expected, *(np.array([result["KPIs"][metric] for result in results]) for metric in ("students_total", "over_PAN")))
+    for metric in ("students_total", "over_PAN"):
+        np.testing.assert_allclose(ensemble[metric]["mean"], expected[metric]["mean"])
+        np.testing.assert_allclose(ensemble[metric]["M2"], expected[metric]["M2"], atol=1e-6)
+
+@pytest.mark.parametrize("catchments", [True, False])
+def test_batch_resume_matches_each_draw(inputs, catchments):
+    in_catchment = models.catchment_matrix(inputs["schools"], inputs["students"]) if catchments else None
+    queues = models.distance_queues(inputs["dist_matrix"], in_catchment)
+    order = list(range(len(inputs["schools"])))[::-1]
+    # including a PAN of 0
+    target = np.array(list(inputs["target_PAN"].values()))
+    target[3] = 0
+    log = models.assign_from_queues(inputs["students"]["5_est"].to_numpy(), target, order, *queues, skip_zero_PAN=catchments, log=True)["log"]
+    est = demand_draws(inputs["students"]["5_9_total"].to_numpy(), 0.19288, 20, np.random.default_rng(1), "poisson")
+    resume = models.assignment_state_batch(log, shared_events(log, target, target, catchments, est=est), est, len(target))
+    batch = models.assign_from_queues_batch(est, target, order, *queues, skip_zero_PAN=catchments, resume=resume)
+    for d, draw in enumerate(est):
+        expected = models.assign_from_queues(draw, target, order, *queues, skip_zero_PAN=catchments)
+        for key in ("school", "students_total", "external"):
+            np.testing.assert_array_equal(batch[key][d], expected[key])
+
+@pytest.mark.parametrize("model", ["schools", "catchment_schools"])
+def test_projection_warm_start_matches_cold(inputs, model):
+    base = np.array(list(inputs["target_PAN"].values()))
+    PANs = pd.DataFrame({"school": list(inputs["target_PAN"]), "pan2024": base, "pan2025": base, "pan2026": np.where(np.arange(len(base)) == 2, 0, base), "pan2027": base * 3 // 4})
+    options = dict(model=model, growth=0.05, initial_school="School 0", dist_matrix=inputs["dist_matrix"])
+    warm = list(project_years(inputs["schools"], inputs["students"], PANs, **options))
+    cold = list(project_years(inputs["schools"], inputs["students"], PANs, warm_start=False, **options))
+    assert [year["year"] for year in warm] == [2024, 2025, 2026, 2027]
+    for warm_year, cold_year in zip(warm, cold):
+        np.testing.assert_array_equal(warm_year["result"]["school"], cold_year["result"]["school"])
+        np.testing.assert_array_equal(warm_year["result"]["external"], cold_year["result"]["external"])
+        np.testing.assert_array_equal(warm_year["KPIs"]["students_total"], cold_year["KPIs"]["students_total"])
+
+def test_shared_events_with_the_students_of_the_log(inputs):
+    est = inputs["students"]["5_est"].to_numpy()
+    order = list(range(len(inputs["schools"])))
+    queues = models.distance_queues(inputs["dist_matrix"], None)
+    base = np.array(list(inputs["target_PAN"].values()))
+    log = models.assign_from_queues(est, base, order, *queues, log=True)["log"]
+    rng = np.random.default_rng(0)
+    for k in range(20):
+        target = np.maximum(base + rng.integers(-60, 60, len(base)) * (rng.random(len(base)) < 0.3), 0)
+        n_shared = shared_events(log, base, target, True)
+        assert n_shared == shared_events(log, base, target, True, est=est)
+        np.testing.assert_array_equal(shared_events(log, base, target, True, est=np.stack([est, est])), [n_shared, n_shared])